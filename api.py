@@ -1,23 +1,141 @@
+import asyncio
+import heapq
+import itertools
+import time
 import httpx
-from typing import Dict, Any, List
-from config import BASE_HEADERS, STATIONS_API, TRAINS_API
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+from config import (
+    BASE_HEADERS, STATIONS_API, TRAINS_API, HTTP_POOL_SIZE, HTTP_KEEPALIVE, HTTP_WARMUP_CONNECTIONS,
+    UPSTREAM_LANG, TRAINS_CACHE_TTL, UPSTREAM_CONCURRENCY,
+)
+from metrics import Histogram, Counter
+import stations as station_catalogue
+
+UPSTREAM_SECONDS = Histogram("railway_upstream_request_seconds", "eticket API request latency", ("endpoint",))
+UPSTREAM_ERRORS = Counter("railway_upstream_errors_total", "Failed eticket API requests", ("endpoint", "reason"))
+TRAINS_FETCHES = Counter("railway_trains_fetch_total", "fetch_trains_shared calls by how they were served",
+                         ("result",))
+UPSTREAM_WAIT_SECONDS = Histogram("railway_upstream_queue_seconds", "Time trains requests waited for a free upstream slot",
+                                  ("priority",))
+
+# Trains request priorities: a user waiting on a reply goes ahead of scheduler ticks
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# One pooled client per event loop, so requests reuse TCP/TLS connections
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=15,
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE,
+                keepalive_expiry=HTTP_KEEPALIVE,
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+async def close_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+async def warmup() -> None:
+    """Open HTTP_WARMUP_CONNECTIONS pooled connections per upstream host (DNS, TCP, TLS) ahead of real traffic."""
+    client = get_client()
+    origins = {"{0.scheme}://{0.netloc}/".format(urlsplit(url)) for url in (STATIONS_API, TRAINS_API)}
+    await asyncio.gather(
+        *(client.head(origin) for origin in origins for _ in range(HTTP_WARMUP_CONNECTIONS)),
+        return_exceptions=True,
+    )
 
 async def api_post(url: str, lang: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    endpoint = "trains" if url == TRAINS_API else "stations"
     headers = dict(BASE_HEADERS)
     headers["Accept-Language"] = lang
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(url, json=payload, headers=headers)
+    start = time.perf_counter()
+    try:
+        r = await get_client().post(url, json=payload, headers=headers)
         r.raise_for_status()
         return r.json()
+    except httpx.HTTPStatusError as e:
+        UPSTREAM_ERRORS.inc(endpoint, str(e.response.status_code))
+        raise
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(endpoint, type(e).__name__)
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint)
+
+# Upstream slots: UPSTREAM_CONCURRENCY trains requests at once, the rest wait in a heap of
+# [priority, seq, future] (FIFO within a priority). Reset when the event loop changes, like the client.
+_slots_free = UPSTREAM_CONCURRENCY
+_slots_waiting: List[list] = []
+_slots_seq = itertools.count()
+_slots_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _slots_reset() -> None:
+    global _slots_free, _slots_waiting, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots_loop is not loop:
+        _slots_free, _slots_waiting, _slots_loop = UPSTREAM_CONCURRENCY, [], loop
+
+async def _acquire_slot(entry: list) -> None:
+    global _slots_free
+    _slots_reset()
+    if _slots_free > 0 and not _slots_waiting:
+        _slots_free -= 1
+        return
+    heapq.heappush(_slots_waiting, entry)
+    try:
+        await entry[2]
+    except asyncio.CancelledError:
+        if entry[2].done() and not entry[2].cancelled():
+            _release_slot()  # the slot was handed over as we were cancelled: pass it on
+        else:
+            entry[2].cancel()  # left in the heap, skipped by _release_slot
+        raise
+
+def _release_slot() -> None:
+    global _slots_free
+    while _slots_waiting:
+        entry = heapq.heappop(_slots_waiting)
+        if not entry[2].done():
+            entry[2].set_result(None)
+            return
+    _slots_free += 1
+
+def _promote(entry: list) -> None:
+    # A queued background request an interactive caller now waits on
+    if entry[0] != INTERACTIVE and not entry[2].done():
+        entry[0] = INTERACTIVE
+        heapq.heapify(_slots_waiting)
+
+def _slot_entry(priority: int) -> list:
+    # [priority, arrival order, future set when a slot is handed over]: a heap entry of _slots_waiting
+    return [priority, next(_slots_seq), asyncio.get_running_loop().create_future()]
 
 async def search_stations(query: str, lang: str) -> List[Dict[str, str]]:
     q = (query or "").strip()
     if len(q) < 2:
         return []
     data = await api_post(STATIONS_API, lang, {"name": q})
-    return data.get("data", {}).get("stations", []) or []
+    stations = data.get("data", {}).get("stations", []) or []
+    await station_catalogue.remember(lang, stations)
+    return stations
 
-async def fetch_trains(dep_code: str, arv_code: str, date_yyyy_mm_dd: str, lang: str) -> Dict[str, Any]:
+async def fetch_trains(dep_code: str, arv_code: str, date_yyyy_mm_dd: str, lang: str, return_date: Optional[str] = None,
+                       *, priority: int, _entry: Optional[list] = None) -> Dict[str, Any]:
+    # return_date: also ask for the way back (arv -> dep) in the same request, as directions.backward
+    # priority: place in the line for an upstream slot (INTERACTIVE when a user waits on it, else BACKGROUND)
     payload = {
         "directions": {
             "forward": {
@@ -27,4 +145,66 @@ async def fetch_trains(dep_code: str, arv_code: str, date_yyyy_mm_dd: str, lang:
             }
         }
     }
-    return await api_post(TRAINS_API, lang, payload)
+    if return_date:
+        payload["directions"]["backward"] = {
+            "date": return_date,
+            "depStationCode": arv_code,
+            "arvStationCode": dep_code,
+        }
+    entry = _entry or _slot_entry(priority)
+    start = time.perf_counter()
+    await _acquire_slot(entry)
+    UPSTREAM_WAIT_SECONDS.observe(time.perf_counter() - start, PRIORITY_NAMES[entry[0]])
+    try:
+        return await api_post(TRAINS_API, lang, payload)
+    finally:
+        _release_slot()
+
+# (dep, arv, date, return date, lang) -> (fetched at, response) and the request in flight for a key
+_trains_cache: Dict[Tuple[str, ...], Tuple[float, Dict[str, Any]]] = {}
+# plus its slot entry, so an interactive caller joining a queued background request moves it up
+_trains_inflight: Dict[Tuple[str, ...], Tuple[asyncio.Task, list]] = {}
+
+async def _fetch_trains_task(key: Tuple[str, ...], entry: list, dep_code: str, arv_code: str, date_yyyy_mm_dd: str,
+                             lang: str, return_date: Optional[str]) -> Dict[str, Any]:
+    try:
+        data = await fetch_trains(dep_code, arv_code, date_yyyy_mm_dd, lang, return_date, priority=entry[0], _entry=entry)
+    finally:
+        _trains_inflight.pop(key, None)
+    now = time.monotonic()
+    if len(_trains_cache) >= 1024:
+        for k in [k for k, (at, _) in _trains_cache.items() if now - at >= TRAINS_CACHE_TTL]:
+            del _trains_cache[k]
+    _trains_cache[key] = (now, data)
+    return data
+
+async def fetch_trains_shared(dep_code: str, arv_code: str, date_yyyy_mm_dd: str, lang: str = UPSTREAM_LANG, return_date: Optional[str] = None,
+                              *, priority: int) -> Dict[str, Any]:
+    """
+    fetch_trains where concurrent callers for the same route share one request
+    and the response is reused for TRAINS_CACHE_TTL, so a manual check right
+    after a scheduler tick is answered from the tick's response. Callers must
+    not modify it.
+
+    The request runs in a task of its own that no caller owns: a caller that is
+    cancelled stops waiting for it, the others still get the response.
+    """
+    key = (str(dep_code), str(arv_code), date_yyyy_mm_dd, return_date or "", lang)
+    hit = _trains_cache.get(key)
+    if hit is not None and time.monotonic() - hit[0] < TRAINS_CACHE_TTL:
+        TRAINS_FETCHES.inc("cached")
+        return hit[1]
+    pending = _trains_inflight.get(key)
+    if pending is not None:
+        TRAINS_FETCHES.inc("shared")
+        if priority == INTERACTIVE:
+            _promote(pending[1])
+    else:
+        TRAINS_FETCHES.inc("fetched")
+        # Complete before the task starts, so a caller joining in the same loop turn can promote it
+        entry = _slot_entry(priority)
+        task = asyncio.create_task(_fetch_trains_task(key, entry, dep_code, arv_code, date_yyyy_mm_dd, lang, return_date))
+        # Retrieve the exception even when every caller has stopped waiting
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        pending = _trains_inflight[key] = (task, entry)
+    return await asyncio.shield(pending[0])
@@ -10,24 +10,36 @@ import hmac
 import hashlib
 import logging
 import os
+import time
 from datetime import datetime, timezone, timedelta
 from urllib.parse import unquote, parse_qsl
 
 from aiohttp import web
 
-from config import BOT_TOKEN
+try:
+    import brotli
+except ImportError:  # optional: gzip/deflate are still negotiated without it
+    brotli = None
+
+from config import BOT_TOKEN, MAX_ROUTES, MAX_RANGE_DAYS, UPSTREAM_LANG, CHECK_MAX_AGE
 from db import (
     get_user, ensure_user, list_routes, add_route,
-    update_route_field, delete_route,
-    set_language, set_notify_mode, count_routes,
+    update_route_field, delete_route, set_route_filters,
+    set_language, set_notify_mode, count_routes, get_route_results, save_route_result,
 )
-from api import fetch_trains, search_stations
-from scheduler import parse_ticket_info
+from api import search_stations, INTERACTIVE
+from scheduler import fetch_route_result, localise_trains, CAR_CLASSES, BERTHS
+import metrics
 
 logger = logging.getLogger("railway_bot.api")
 
 WEBAPP_ORIGIN = os.getenv("WEBAPP_ORIGIN", "https://railway-bot.netlify.app")
-MAX_ROUTES = 5
+
+# Responses smaller than this are sent as-is: compressing them costs more than it saves
+COMPRESS_MIN_BYTES = 1024
+
+# Column order of the compact car rows (see _compact_trains)
+CAR_COLUMNS = ("type", "free", "price", "up", "down", "lateral_up", "lateral_down")
 
 
 # ─── CORS ────────────────────────────────────────────────────────────────────
@@ -89,9 +101,10 @@ async def _auth(request: web.Request) -> dict:
 
 # ─── Response helper ──────────────────────────────────────────────────────────
 
-def ok(data: dict, status: int = 200) -> web.Response:
+def ok(data: dict, status: int = 200, compact: bool = False) -> web.Response:
+    separators = (",", ":") if compact else None
     return web.Response(
-        text=json.dumps(data, ensure_ascii=False),
+        text=json.dumps(data, ensure_ascii=False, separators=separators),
         content_type="application/json",
         status=status,
         headers=_cors(),
@@ -107,6 +120,73 @@ def err(message: str, status: int = 400) -> web.Response:
     )
 
 
+# ─── Compression ──────────────────────────────────────────────────────────────
+
+def _accepts(request: web.Request, coding: str) -> bool:
+    for part in request.headers.get("Accept-Encoding", "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+@web.middleware
+async def compression_middleware(request: web.Request, handler):
+    """Negotiate br / gzip / deflate for JSON responses above COMPRESS_MIN_BYTES."""
+    resp = await handler(request)
+    if type(resp) is not web.Response or resp.body is None:
+        return resp
+    if len(resp.body) < COMPRESS_MIN_BYTES or "Content-Encoding" in resp.headers:
+        return resp
+    if brotli is not None and _accepts(request, "br"):
+        resp.body = brotli.compress(resp.body, quality=4)
+        resp.headers["Content-Encoding"] = "br"
+    else:
+        # aiohttp picks gzip or deflate from Accept-Encoding (no-op if neither)
+        resp.enable_compression()
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+
+# ─── Compact schema ───────────────────────────────────────────────────────────
+# Opt-in with ?compact=1: prices are numbers and each train's cars are sent as
+# {"cols": [...], "rows": [[...], ...]} instead of a list of repeated dicts.
+# ?fields=number,dep_time,cars_data projects train keys in either schema.
+
+def _wants_compact(request: web.Request) -> bool:
+    return request.rel_url.query.get("compact", "") in ("1", "true", "yes")
+
+
+def _requested_fields(request: web.Request) -> set | None:
+    raw = request.rel_url.query.get("fields", "").strip()
+    if not raw:
+        return None
+    return {f.strip() for f in raw.split(",") if f.strip()}
+
+
+def _trains_payload(request: web.Request, trains: list) -> list:
+    compact = _wants_compact(request)
+    fields = _requested_fields(request)
+    out = []
+    for train in trains:
+        item = {}
+        for key, value in train.items():
+            if fields is not None and key not in fields:
+                continue
+            if key == "cars_data" and compact:
+                value = {
+                    "cols": CAR_COLUMNS,
+                    "rows": [[car[c] if c != "price" else car["tariff"] for c in CAR_COLUMNS]
+                             for car in value],
+                }
+            elif key == "cars_data":
+                # Legacy schema: formatted price strings only
+                value = [{k: v for k, v in car.items() if k != "tariff"} for car in value]
+            item[key] = value
+        out.append(item)
+    return out
+
+
 # ─── Handlers ─────────────────────────────────────────────────────────────────
 
 async def api_user(request: web.Request) -> web.Response:
@@ -127,7 +207,7 @@ async def api_create_route(request: web.Request) -> web.Response:
 
     cnt = await count_routes(tid)
     if cnt >= MAX_ROUTES:
-        return err("Max routes reached (5)", 400)
+        return err(f"Max routes reached ({MAX_ROUTES})", 400)
 
     try:
         body = await request.json()
@@ -142,12 +222,17 @@ async def api_create_route(request: web.Request) -> web.Response:
         travel = datetime.strptime(body["travel_date"], "%Y-%m-%d").date()
         if travel < today:
             return err("Travel date has already passed", 400)
+        problem = (_range_error(travel, body.get("travel_date_to"), body.get("return_date"))
+                   or _filters_error(body.get("filters")))
+        if problem:
+            return err(problem, 400)
 
         route_id = await add_route(
             tid,
             body["from_code"], body["from_name"],
             body["to_code"],   body["to_name"],
-            body["travel_date"],
+            body["travel_date"], body.get("travel_date_to") or None, body.get("return_date") or None,
+            body.get("filters") or None,
         )
         routes = await list_routes(tid)
         route = next((r for r in routes if r["id"] == route_id), None)
@@ -172,18 +257,36 @@ async def api_update_route(request: web.Request) -> web.Response:
 
     try:
         body = await request.json()
-        allowed = {"from_code", "from_name", "to_code", "to_name", "travel_date"}
-
-        if "travel_date" in body:
+        required = {"from_code", "from_name", "to_code", "to_name", "travel_date"}
+        optional = {"travel_date_to", "return_date"}
+        empty = sorted(f for f in required & body.keys() if not body[f])
+        if empty:
+            return err(f"{', '.join(empty)}: cannot be empty", 400)
+
+        if body.keys() & {"travel_date", "travel_date_to", "return_date"}:
+            route = next(r for r in routes if r["id"] == route_id)
             tz_uz = timezone(timedelta(hours=5))
             today = datetime.now(tz_uz).date()
-            travel = datetime.strptime(body["travel_date"], "%Y-%m-%d").date()
-            if travel < today:
+            travel = datetime.strptime(body.get("travel_date", route["travel_date"]), "%Y-%m-%d").date()
+            if "travel_date" in body and travel < today:
                 return err("Travel date has already passed", 400)
+            problem = _range_error(travel, body.get("travel_date_to", route["travel_date_to"]),
+                                   body.get("return_date", route["return_date"]))
+            if problem:
+                return err(problem, 400)
+
+        if "filters" in body:
+            problem = _filters_error(body["filters"])
+            if problem:
+                return err(problem, 400)
+            await set_route_filters(route_id, body["filters"] or None)
 
         for field, value in body.items():
-            if field in allowed:
+            if field in required:
                 await update_route_field(route_id, field, str(value))
+            elif field in optional:
+                # null or "" turns the route back into a single date
+                await update_route_field(route_id, field, str(value) if value else None)
 
         routes = await list_routes(ctx["telegram_id"])
         route = next((r for r in routes if r["id"] == route_id), None)
@@ -211,6 +314,70 @@ async def api_delete_route(request: web.Request) -> web.Response:
     return ok({"ok": True})
 
 
+def _range_error(travel, travel_date_to, return_date=None) -> str:
+    if travel_date_to and return_date:
+        return "A round trip (return_date) cannot have a date range (travel_date_to)"
+    if travel_date_to:
+        last = datetime.strptime(travel_date_to, "%Y-%m-%d").date()
+        if last < travel or (last - travel).days >= MAX_RANGE_DAYS:
+            return f"travel_date_to must be within {MAX_RANGE_DAYS} days from travel_date"
+    if return_date and datetime.strptime(return_date, "%Y-%m-%d").date() < travel:
+        return "return_date must not be before travel_date"
+    return ""
+
+
+def _filters_error(filters) -> str:
+    # See scheduler.compile_filters for the format
+    if not filters:
+        return ""
+    if not isinstance(filters, dict) or set(filters) - {"car_types", "berths", "max_price", "trains"}:
+        return "filters: expected an object with car_types, berths, max_price, trains"
+    if set(filters.get("car_types") or ()) - set(CAR_CLASSES):
+        return f"filters.car_types: one of {', '.join(CAR_CLASSES)}"
+    if set(filters.get("berths") or ()) - set(BERTHS):
+        return f"filters.berths: one of {', '.join(BERTHS)}"
+    price = filters.get("max_price")
+    if price is not None and (isinstance(price, bool) or not isinstance(price, int) or price <= 0):
+        return "filters.max_price: expected a positive integer"
+    if not isinstance(filters.get("trains") or [], list):
+        return "filters.trains: expected a list of train numbers"
+    return ""
+
+
+async def _stored_results(request: web.Request, telegram_id: int) -> dict:
+    # Results younger than CHECK_MAX_AGE, unless the client asks for ?refresh=1
+    if CHECK_MAX_AGE <= 0 or request.query.get("refresh") == "1":
+        return {}
+    return await get_route_results(telegram_id, int(time.time()) - CHECK_MAX_AGE)
+
+
+async def _fetch_route(route: dict, lang: str, stored=None):
+    """
+    (available, trains, return trains, fetched at) like the scheduler sees
+    them: every day of a date range merged; a round trip's legs in one
+    request, available when both have seats. Return trains are None for
+    one-way routes. stored: (result, fetched at) to answer with instead of
+    fetching; a fetch goes through the scheduler's shared cache, ahead of
+    tick requests, and is stored for the next manual check.
+    """
+    if stored is not None:
+        result, fetched_at = stored
+    else:
+        result, fetched_at = await fetch_route_result(route, INTERACTIVE), int(time.time())
+        await save_route_result(route["id"], result, fetched_at)
+    legs = result["legs"]
+    available, trains_data, _ = legs[0]
+    trains_data = localise_trains(trains_data, UPSTREAM_LANG, lang)
+    if not route.get("return_date"):
+        return available, trains_data, None, fetched_at
+    back_available, back_trains, _ = legs[1] if len(legs) > 1 else (False, [], 0)
+    return available and back_available, trains_data, localise_trains(back_trains, UPSTREAM_LANG, lang), fetched_at
+
+
+def _checked_at(fetched_at: int) -> str:
+    return datetime.fromtimestamp(fetched_at, timezone(timedelta(hours=5))).isoformat(timespec="seconds")
+
+
 async def api_check_route(request: web.Request) -> web.Response:
     ctx = await _auth(request)
     route_id = int(request.match_info["id"])
@@ -224,17 +391,17 @@ async def api_check_route(request: web.Request) -> web.Response:
     lang = user.get("language", "ru")
 
     try:
-        api_json = await fetch_trains(
-            route["from_code"], route["to_code"], route["travel_date"], lang
-        )
-        available, trains_data, _ = parse_ticket_info(api_json)
-        tz_uz = timezone(timedelta(hours=5))
-        checked_at = datetime.now(tz_uz).isoformat(timespec="seconds")
-        return ok({
+        stored = (await _stored_results(request, ctx["telegram_id"])).get(route_id)
+        available, trains_data, back_trains, fetched_at = await _fetch_route(route, lang, stored)
+        result = {
             "available": available,
-            "trains": trains_data,
-            "checked_at": checked_at,
-        })
+            "trains": _trains_payload(request, trains_data),
+            "checked_at": _checked_at(fetched_at),
+            "cached": stored is not None,
+        }
+        if back_trains is not None:
+            result["return_trains"] = _trains_payload(request, back_trains)
+        return ok(result, compact=_wants_compact(request))
     except Exception as exc:
         logger.error("check_route error: %s", exc)
         return err(str(exc), 500)
@@ -248,25 +415,24 @@ async def api_check_all(request: web.Request) -> web.Response:
     routes = await list_routes(tid)
 
     results = []
-    tz_uz = timezone(timedelta(hours=5))
-    checked_at = datetime.now(tz_uz).isoformat(timespec="seconds")
+    stored = await _stored_results(request, tid)
 
     for route in routes:
         try:
-            api_json = await fetch_trains(
-                route["from_code"], route["to_code"], route["travel_date"], lang
-            )
-            available, trains_data, _ = parse_ticket_info(api_json)
+            available, trains_data, back_trains, fetched_at = await _fetch_route(route, lang, stored.get(route["id"]))
             results.append({
                 "route_id": route["id"],
                 "available": available,
-                "trains": trains_data,
-                "checked_at": checked_at,
+                "trains": _trains_payload(request, trains_data),
+                "checked_at": _checked_at(fetched_at),
+                "cached": route["id"] in stored,
             })
+            if back_trains is not None:
+                results[-1]["return_trains"] = _trains_payload(request, back_trains)
         except Exception as exc:
             results.append({"route_id": route["id"], "error": str(exc)})
 
-    return ok({"results": results})
+    return ok({"results": results}, compact=_wants_compact(request))
 
 
 async def api_update_settings(request: web.Request) -> web.Response:
@@ -309,13 +475,36 @@ async def api_stations(request: web.Request) -> web.Response:
         return ok({"stations": []})
 
 
+async def api_metrics(request: web.Request) -> web.Response:
+    from config import METRICS_TOKEN
+    if METRICS_TOKEN:
+        expected = f"Bearer {METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            raise web.HTTPUnauthorized(reason="Bad metrics token")
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+
+def create_metrics_app() -> web.Application:
+    """Bare /metrics app for METRICS_PORT, an internal port kept off the public network."""
+    app = web.Application(middlewares=[compression_middleware])
+    app.router.add_get("/metrics", api_metrics)
+    return app
+
+
 # ─── App factory ──────────────────────────────────────────────────────────────
 
-def create_app(bot=None, on_lang_change=None, on_route_change=None) -> web.Application:
-    app = web.Application()
+def create_app(bot=None, on_lang_change=None, on_route_change=None, webhook=None) -> web.Application:
+    from config import METRICS_TOKEN
+    app = web.Application(middlewares=[compression_middleware])
     app["bot"] = bot
     app["on_lang_change"] = on_lang_change
     app["on_route_change"] = on_route_change
+    if webhook is not None:
+        from config import WEBHOOK_PATH
+        app.router.add_post(WEBHOOK_PATH, webhook.handle)
+        app.on_startup.append(webhook.start)
+        app.on_cleanup.append(webhook.stop)
     app.router.add_route("OPTIONS", "/{path_info:.*}", handle_options)
     app.router.add_get   ("/api/user",               api_user)
     app.router.add_get   ("/api/routes",              api_get_routes)
@@ -326,4 +515,7 @@ def create_app(bot=None, on_lang_change=None, on_route_change=None) -> web.Appli
     app.router.add_post  ("/api/check-all",           api_check_all)
     app.router.add_patch ("/api/settings",            api_update_settings)
     app.router.add_get   ("/api/stations",            api_stations)
+    if METRICS_TOKEN:
+        # This is the public Mini App server: /metrics only behind the token, else on METRICS_PORT alone
+        app.router.add_get("/metrics", api_metrics)
     return app
@@ -0,0 +1,159 @@
+"""
+Parser / renderer micro-benchmarks over the response corpus.
+
+Times parse_ticket_info and build_route_message (cold, and as a render
+cache hit) for every corpus file and all three languages, plus format_duration, get_number_emoji and
+fmt_date_for_ui. Results are compared with benchmarks/baseline_render.json
+and the run fails (exit 1) when any case is slower than the baseline by
+more than --max-regression. Cases are compared as a cost relative to a
+fixed pure-Python calibration loop timed right next to them, so the check
+holds across machines and load levels:
+
+    python -m benchmarks.bench_render
+    python -m benchmarks.bench_render --update-baseline   # after an intended change
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, Tuple
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.corpus import load_corpus  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_render.json")
+LANGS = ("ru", "uz", "en")
+ROUTE = {"id": 1, "from_code": "2900000", "from_name": "Ташкент", "to_code": "2900700",
+         "to_name": "Самарканд", "travel_date": "2026-01-15"}
+
+
+def _calibration_workload() -> str:
+    # Dict lookups, str.format and joins: the same kind of work as rendering
+    parts = []
+    table = {i: f"k{i}" for i in range(32)}
+    for i in range(32):
+        parts.append("{} — {} — {:,}".format(table[i], i, i * 1000))
+    return "\n".join(parts)
+
+
+async def _loop(fn: Callable, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        r = fn()
+        if asyncio.iscoroutine(r):
+            await r
+    return (time.perf_counter() - start) / n
+
+
+async def _calls_for(fn: Callable, budget: float) -> int:
+    n = 1
+    while n < 1 << 20:
+        elapsed = await _loop(fn, n) * n
+        if elapsed >= budget / 4:
+            return max(1, int(n * budget / elapsed))
+        n *= 2
+    return n
+
+
+async def _measure(fn: Callable, min_time: float, repeat: int) -> Tuple[float, float]:
+    """
+    (microseconds per call, cost relative to the calibration workload).
+    Each repeat times the case and the calibration loop back to back and the
+    median ratio is kept, so drifting machine speed cancels out.
+    """
+    n = await _calls_for(fn, min_time)
+    n_cal = await _calls_for(_calibration_workload, min_time)
+    best, ratios = float("inf"), []
+    for _ in range(repeat):
+        t = await _loop(fn, n)
+        cal = await _loop(_calibration_workload, n_cal)
+        best = min(best, t)
+        ratios.append(t / cal)
+    return best * 1e6, statistics.median(ratios)
+
+
+def _cold_render(scheduler, lang: str, payload: Dict[str, Any], parsed) -> Any:
+    scheduler._render_cache.clear()
+    return scheduler.build_route_message(lang, dict(ROUTE), payload, parsed)
+
+
+async def run(min_time: float, repeat: int) -> Dict[str, Tuple[float, float]]:
+    import scheduler
+
+    results: Dict[str, Tuple[float, float]] = {}
+    for name, payload in load_corpus().items():
+        results[f"parse/{name}"] = await _measure(lambda p=payload: scheduler.parse_ticket_info(p), min_time, repeat)
+        parsed = scheduler.parse_ticket_info(payload)
+        for lang in LANGS:
+            results[f"render/{name}/{lang}"] = await _measure(
+                lambda p=payload, l=lang: _cold_render(scheduler, l, p, parsed), min_time, repeat)
+        # Every further subscriber of the route: render cache hit
+        results[f"render_cached/{name}/ru"] = await _measure(
+            lambda p=payload: scheduler.build_route_message("ru", dict(ROUTE), p, parsed), min_time, repeat)
+    for lang in LANGS:
+        results[f"format_duration/{lang}"] = await _measure(
+            lambda l=lang: scheduler.format_duration(l, "835"), min_time, repeat)
+        results[f"fmt_date_for_ui/{lang}"] = await _measure(
+            lambda l=lang: scheduler.fmt_date_for_ui(l, "2026-01-15"), min_time, repeat)
+    results["get_number_emoji/7"] = await _measure(lambda: scheduler.get_number_emoji(7), min_time, repeat)
+    results["get_number_emoji/42"] = await _measure(lambda: scheduler.get_number_emoji(42), min_time, repeat)
+    return results
+
+
+def compare(results: Dict[str, Tuple[float, float]], baseline: Dict[str, Any], max_regression: float) -> int:
+    failures = 0
+    print(f"{'case':<32} {'us/call':>10} {'x calib':>9} {'baseline':>9} {'change':>8}")
+    for case, (us, ratio) in results.items():
+        entry = baseline.get(case)
+        base = entry.get("ratio") if isinstance(entry, dict) else None
+        if base:
+            change = ratio / base - 1
+            flag = "  REGRESSION" if change > max_regression else ""
+            failures += bool(flag)
+            print(f"{case:<32} {us:>10.2f} {ratio:>9.3f} {base:>9.3f} {change:>+7.0%}{flag}")
+        else:
+            print(f"{case:<32} {us:>10.2f} {ratio:>9.3f} {'-':>9} {'new':>8}")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Parser / renderer micro-benchmarks")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per measurement")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-regression", type=float, default=0.30,
+                        help="allowed slowdown against the baseline (0.30 = 30%%)")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    gc.disable()
+    try:
+        results = asyncio.run(run(args.min_time, args.repeat))
+    finally:
+        gc.enable()
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE, encoding="utf-8") as f:
+            baseline = json.load(f)
+    failures = compare(results, baseline, args.max_regression)
+
+    if args.update_baseline:
+        with open(BASELINE, "w", encoding="utf-8") as f:
+            json.dump({k: {"us": round(us, 3), "ratio": round(ratio, 4)} for k, (us, ratio) in results.items()},
+                      f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {BASELINE}")
+        return 0
+    if failures:
+        print(f"{failures} case(s) regressed by more than {args.max_regression:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
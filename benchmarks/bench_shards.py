@@ -0,0 +1,236 @@
+"""
+Lease-based scheduler sharding across processes (`bot.py scheduler --leases`).
+
+Seeds a DB with "always"-mode users (one route each, no free seats, so every
+tick sends each user exactly one reminder), then runs scheduler workers as
+separate processes against the stub upstream and stub Bot API. A worker
+joins part-way through and another one is killed with SIGKILL later on:
+
+    python -m benchmarks.bench_shards --users 120 --workers 2 --ticks 12
+
+Each worker heartbeats its leases and runs scheduler_tick(leased=True) on
+a short tick. The report shows, per tick, the live workers, their slot
+counts, how many users got their reminder and how many got a second one in
+the same tick. The run fails (exit 1) on any double notification, or when
+a user is still missed after the dead worker's leases have expired.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+from benchmarks.stub_telegram import StubTelegram
+from benchmarks.stub_upstream import StubUpstream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def worker(tick: int) -> None:
+    """One scheduler worker: lease heartbeats and leased ticks until SIGTERM."""
+    import bot
+    import leases
+    import scheduler
+
+    tg = bot.make_bot()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+
+    async def beat():
+        while True:
+            await leases.heartbeat()
+            await asyncio.sleep(leases.HEARTBEAT_INTERVAL)
+
+    beats = asyncio.create_task(beat())
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        while True:
+            now = time.time()
+            started_at = (int(now) // tick + 1) * tick
+            await asyncio.wait({stopped}, timeout=started_at - now + 0.05)
+            if stop.is_set():
+                break
+            ticking = asyncio.create_task(scheduler.scheduler_tick(tg, started_at=started_at, leased=True))
+            await asyncio.wait({ticking, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if stop.is_set():
+                break
+        # Shut down the way run_scheduler does: let the tick reach a user boundary
+        await scheduler.drain(5)
+    finally:
+        beats.cancel()
+        stopped.cancel()
+        await leases.release()
+        await tg.session.close()
+
+
+def _env(tmp: str, args: argparse.Namespace, **extra: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": "123456:bench",
+        "DB_PATH": os.path.join(tmp, "shards.sqlite3"),
+        "LOG_FILE": os.path.join(tmp, "bot.log"),
+        "LOG_LEVEL": "WARNING",
+        "METRICS_PORT": "0",
+        "NOTIFY_INTERVAL": str(args.tick),
+        "TICK_INTERVAL": str(args.tick),
+        "LEASE_TTL": str(args.lease_ttl),
+    })
+    env.update(extra)
+    return env
+
+
+async def seed(env: Dict[str, str], users: int) -> None:
+    os.environ.update(env)
+    import db  # before bench_tick, which points DB_PATH at its own scratch DB
+    from benchmarks.bench_tick import seed_db
+
+    await db.init_db()
+    seed_db(env["DB_PATH"], users, 1, users)
+    con = sqlite3.connect(env["DB_PATH"])
+    con.execute("UPDATE users SET notify_mode = 'always'")
+    con.execute("UPDATE route_state SET next_notify_at = 0")
+    con.commit()
+    con.close()
+
+
+def live_workers(path: str) -> int:
+    con = sqlite3.connect(path)
+    try:
+        return con.execute("SELECT COUNT(*) FROM scheduler_workers").fetchone()[0]
+    finally:
+        con.close()
+
+
+def lease_counts(path: str) -> Dict[str, int]:
+    con = sqlite3.connect(path)
+    try:
+        rows = con.execute("SELECT worker, COUNT(*) FROM shard_leases WHERE expires_at > ? GROUP BY worker",
+                           (int(time.time()),)).fetchall()
+    finally:
+        con.close()
+    return {w.rsplit(":", 1)[1]: n for w, n in rows}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    tmp = tempfile.mkdtemp(prefix="railway_shards_")
+    upstream = await StubUpstream(latency=args.latency / 1000, free_ratio=0).start()
+    tg = await StubTelegram().start()
+    env = _env(tmp, args, TELEGRAM_API_URL=tg.base_url, **upstream.env())
+    await seed(env, args.users)
+
+    join_at, kill_at = args.ticks // 4, args.ticks // 2
+    procs: Dict[int, asyncio.subprocess.Process] = {}
+
+    async def spawn() -> None:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.bench_shards", "worker", "--tick", str(args.tick),
+            cwd=ROOT, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        procs[proc.pid] = proc
+
+    timeline: List[Dict[str, Any]] = []
+    try:
+        for _ in range(args.workers):
+            await spawn()
+        # Tick 0 is the first one after every worker has heartbeated
+        deadline = time.time() + args.timeout
+        while live_workers(env["DB_PATH"]) < args.workers:
+            if time.time() > deadline:
+                raise RuntimeError(f"workers did not start within {args.timeout}s")
+            await asyncio.sleep(0.2)
+        start = (int(time.time()) // args.tick + 2) * args.tick
+        until = start + args.ticks * args.tick
+        for i in range(args.ticks):
+            await asyncio.sleep(start + i * args.tick - time.time())
+            event = ""
+            if i == join_at:
+                await spawn()
+                event = "worker joins"
+            elif i == kill_at:
+                killed = next(iter(procs))
+                procs.pop(killed).send_signal(signal.SIGKILL)
+                event = f"worker {killed} killed"
+            # Ownership half a tick in, once the tick's sends are done
+            await asyncio.sleep(args.tick / 2)
+            timeline.append({"tick": i, "workers": len(procs), "slots": lease_counts(env["DB_PATH"]), "event": event})
+        await asyncio.sleep(until + args.tick / 2 - time.time())
+    finally:
+        for proc in procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+        for proc in procs.values():
+            try:
+                await asyncio.wait_for(proc.wait(), 15)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        await tg.stop()
+        await upstream.stop()
+
+    per_tick: Dict[int, Counter] = {i: Counter() for i in range(args.ticks)}
+    for chat_id, at in tg.sent:
+        i = int((at - start) // args.tick)
+        if 0 <= i < args.ticks:
+            per_tick[i][chat_id] += 1
+    for t in timeline:
+        sent = per_tick[t["tick"]]
+        t["notified"] = len(sent)
+        t["doubles"] = sum(1 for n in sent.values() if n > 1)
+    # The dead worker's slots are free after LEASE_TTL, and taken at the next heartbeat
+    recovered_by = kill_at + 1 + -(-(args.lease_ttl + args.lease_ttl / 3) // args.tick)
+    return {
+        "params": {k: v for k, v in vars(args).items() if k not in ("json", "cmd")},
+        "timeline": timeline,
+        "doubles": sum(t["doubles"] for t in timeline),
+        "missed_after_recovery": sum(args.users - t["notified"] for t in timeline[int(recovered_by):]),
+        "recovered_by_tick": int(recovered_by),
+        "upstream_requests": upstream.requests["trains"],
+        "telegram_calls": dict(tg.calls),
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    p = result["params"]
+    print(f"users={p['users']} workers={p['workers']} (+1 joins, 1 killed) tick={p['tick']}s "
+          f"lease ttl={p['lease_ttl']}s slots per live worker below")
+    print(f"{'tick':>4} {'workers':>8} {'notified':>9} {'doubles':>8}  slots")
+    for t in result["timeline"]:
+        slots = " ".join(f"{pid}:{n}" for pid, n in sorted(t["slots"].items()))
+        print(f"{t['tick']:>4} {t['workers']:>8} {t['notified']:>9} {t['doubles']:>8}  {slots}  {t['event']}")
+    print(f"double notifications: {result['doubles']}; users missed from tick {result['recovered_by_tick']} on: "
+          f"{result['missed_after_recovery']}; upstream requests: {result['upstream_requests']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Scheduler workers sharing routes through leases")
+    sub = parser.add_subparsers(dest="cmd")
+    w = sub.add_parser("worker", help="(internal) one scheduler worker process")
+    w.add_argument("--tick", type=int, required=True)
+    parser.add_argument("--users", type=int, default=120)
+    parser.add_argument("--workers", type=int, default=2, help="workers at start; one more joins, one is killed")
+    parser.add_argument("--ticks", type=int, default=12)
+    parser.add_argument("--tick", type=int, default=3, help="tick and reminder interval, seconds")
+    parser.add_argument("--lease-ttl", type=int, default=3, help="LEASE_TTL for the workers, seconds")
+    parser.add_argument("--latency", type=float, default=20, help="stub upstream latency, ms")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the workers to start")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "worker":
+        asyncio.run(worker(args.tick))
+        return 0
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["doubles"] or result["missed_after_recovery"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
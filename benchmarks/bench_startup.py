@@ -0,0 +1,137 @@
+"""
+Startup benchmark: import time and time to first reply.
+
+Import time is `python -c "import bot"` minus bare interpreter start, with
+the slowest modules bot imports directly, from `python -X importtime`.
+Time to first reply starts a real `bot.py poller` process against the stub
+Bot API and stub upstream, with a /start update waiting in getUpdates, and
+measures process spawn -> first sendMessage. The first run uses a fresh DB (migrations run),
+the others reuse it (schema already current):
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.stub_telegram import StubTelegram
+from benchmarks.stub_upstream import StubUpstream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env(tmp: str, **extra: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": "123456:bench",
+        "DB_PATH": os.path.join(tmp, "startup.sqlite3"),
+        "LOG_FILE": os.path.join(tmp, "bot.log"),
+        "LOG_LEVEL": "WARNING",
+        "BOT_MODE": "polling",
+        "METRICS_PORT": "0",
+    })
+    env.update(extra)
+    return env
+
+
+def _wall(args: List[str], env: Dict[str, str], runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_times(env: Dict[str, str], runs: int, top: int) -> Dict[str, Any]:
+    bare = _wall(["-c", "pass"], env, runs)
+    full = _wall(["-c", "import bot"], env, runs)
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stderr
+    modules: List[Tuple[str, int]] = []
+    for line in out.splitlines():
+        # "import time:  self [us] | cumulative | imported package", two spaces per nesting level;
+        # bot itself is level 0, so its direct imports are level 1
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]
+        if name.startswith("  ") and not name.startswith("   "):
+            modules.append((name.strip(), int(cumulative)))
+    modules.sort(key=lambda m: -m[1])
+    return {"interpreter_s": bare, "import_bot_s": full - bare, "top_imports_us": modules[:top]}
+
+
+async def first_reply(env: Dict[str, str], tg: StubTelegram, timeout: float) -> float:
+    tg.reset()
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(sys.executable, "bot.py", "poller", cwd=ROOT, env=env,
+                                                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        await asyncio.wait_for(tg.first_reply.wait(), timeout)
+        return tg.first_reply_at - start
+    finally:
+        proc.terminate()
+        await proc.wait()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    tmp = tempfile.mkdtemp(prefix="railway_startup_")
+    upstream = await StubUpstream(latency=args.latency / 1000).start()
+    tg = await StubTelegram().start()
+    env = _env(tmp, TELEGRAM_API_URL=tg.base_url, **upstream.env())
+    try:
+        imports = await asyncio.to_thread(import_times, env, args.runs, args.top)
+        cold = await first_reply(env, tg, args.timeout)
+        warm = [await first_reply(env, tg, args.timeout) for _ in range(args.runs)]
+    finally:
+        await tg.stop()
+        await upstream.stop()
+    return {
+        "params": {k: v for k, v in vars(args).items() if k != "json"},
+        "imports": imports,
+        "first_reply_fresh_db_s": cold,
+        "first_reply_s": warm,
+        "first_reply_median_s": statistics.median(warm),
+        "telegram_calls": dict(tg.calls),
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    imp = result["imports"]
+    print(f"interpreter start      {imp['interpreter_s'] * 1000:8.1f} ms")
+    print(f"import bot             {imp['import_bot_s'] * 1000:8.1f} ms")
+    for name, us in imp["top_imports_us"]:
+        print(f"  {name:<20} {us / 1000:8.1f} ms")
+    print(f"first reply, fresh DB  {result['first_reply_fresh_db_s'] * 1000:8.1f} ms")
+    print(f"first reply, median    {result['first_reply_median_s'] * 1000:8.1f} ms  "
+          f"({', '.join(f'{s * 1000:.0f}' for s in result['first_reply_s'])})")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import time and time to first reply")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest direct imports of bot to list")
+    parser.add_argument("--latency", type=float, default=20, help="stub upstream latency, ms")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for the first reply")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+End-to-end scheduler tick benchmark.
+
+Starts the stub upstream, seeds a temporary SQLite DB with N users x M
+routes, and runs scheduler_tick against a FakeBot:
+
+    python -m benchmarks.bench_tick --users 200 --routes 5 --latency 50 --ticks 3
+
+Reports tick time, route throughput, p50/p99 route latency (from the tick
+trace), time spent in db.* calls, upstream requests and Bot API calls.
+--json PATH also writes the numbers for comparison between runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+# Project modules read config at import time: point them at a scratch DB first
+_TMP = tempfile.mkdtemp(prefix="railway_bench_")
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ["DB_PATH"] = os.path.join(_TMP, "bench.sqlite3")
+os.environ["TRACE_PATH"] = os.path.join(_TMP, "trace.jsonl")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.fake_bot import FakeBot  # noqa: E402
+from benchmarks.payloads import STATIONS  # noqa: E402
+from benchmarks.stub_upstream import StubUpstream  # noqa: E402
+
+LANGS = ("ru", "uz", "en")
+MODES = ("always", "on_available")
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def seed_db(path: str, users: int, routes: int, distinct: int, seed: int = 1) -> int:
+    """Insert users and routes directly; returns the number of routes."""
+    from db import next_notify_at
+
+    rnd = random.Random(seed)
+    today = date.today()
+    pool = []
+    for _ in range(max(1, distinct)):
+        a, b = rnd.sample(STATIONS, 2)
+        pool.append((a, b, (today + timedelta(days=rnd.randrange(1, 30))).isoformat()))
+    ts = datetime.now().isoformat(timespec="seconds")
+    con = sqlite3.connect(path)
+    con.executemany(
+        "INSERT INTO users (telegram_id, language, notify_mode, created_at, updated_at) VALUES (?,?,?,?,?)",
+        [(uid, LANGS[uid % 3], MODES[uid % 2], ts, ts) for uid in range(1, users + 1)],
+    )
+    rows = []
+    for uid in range(1, users + 1):
+        for _ in range(routes):
+            (fc, fn), (tc, tn), d = rnd.choice(pool)
+            rows.append((uid, fc, fn, tc, tn, d, ts, ts))
+    con.executemany(
+        """INSERT INTO routes (telegram_id, from_code, from_name, to_code, to_name, travel_date, created_at, updated_at)
+           VALUES (?,?,?,?,?,?,?,?)""",
+        rows,
+    )
+    con.execute("INSERT INTO route_state (route_id, last_available, last_notified_at, next_notify_at) SELECT id, 0, ?, ? FROM routes",
+                (ts, next_notify_at(time.time())))
+    con.commit()
+    con.close()
+    return len(rows)
+
+
+def db_seconds() -> float:
+    import db
+    return sum(entry[1] for entry in db.DB_SECONDS._values.values())
+
+
+def read_trace(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    os.remove(path)
+    return lines
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = StubUpstream(latency=args.latency / 1000, jitter=args.jitter / 1000, trains=args.trains,
+                        cars=args.cars, free_ratio=args.free_ratio)
+    os.environ.update(stub.env())
+    await stub.start()
+
+    import db
+    import scheduler
+
+    await db.init_db()
+    n_routes = seed_db(os.environ["DB_PATH"], args.users, args.routes, args.distinct or args.users * args.routes)
+    bot = FakeBot(latency=args.bot_latency / 1000)
+
+    ticks = []
+    for i in range(args.ticks):
+        db_before = db_seconds()
+        calls_before = bot.sent
+        up_before = stub.requests["trains"]
+        start = time.perf_counter()
+        # One tick interval apart, so every route is due again
+        await scheduler.scheduler_tick(bot, started_at=int(time.time()) + i * scheduler.TICK_INTERVAL)
+        elapsed = time.perf_counter() - start
+        spans = [line for line in read_trace(os.environ["TRACE_PATH"]) if line["type"] == "route"]
+        route_ms = [s["total_ms"] for s in spans]
+        ticks.append({
+            "tick_s": elapsed,
+            "routes": len(spans),
+            "routes_per_s": len(spans) / elapsed if elapsed else 0.0,
+            "route_p50_ms": percentile(route_ms, 50),
+            "route_p99_ms": percentile(route_ms, 99),
+            "db_s": db_seconds() - db_before,
+            "upstream_requests": stub.requests["trains"] - up_before,
+            "bot_calls": bot.sent - calls_before,
+        })
+
+    await stub.stop()
+    summary = {k: statistics.median(t[k] for t in ticks) for k in ticks[0]}
+    return {
+        "params": {k: v for k, v in vars(args).items() if k != "json"},
+        "seeded_routes": n_routes,
+        "ticks": ticks,
+        "median": summary,
+        "bot_calls_by_method": dict(bot.calls),
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    p = result["params"]
+    print(f"users={p['users']} routes/user={p['routes']} seeded={result['seeded_routes']} "
+          f"upstream latency={p['latency']}ms trains/response={p['trains']}")
+    print(f"{'tick':>4} {'time s':>8} {'routes':>7} {'routes/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'db s':>7} {'upstream':>9} {'bot calls':>10}")
+    for i, t in enumerate(result["ticks"], 1):
+        print(f"{i:>4} {t['tick_s']:>8.2f} {t['routes']:>7} {t['routes_per_s']:>9.1f} {t['route_p50_ms']:>8.1f} "
+              f"{t['route_p99_ms']:>8.1f} {t['db_s']:>7.2f} {t['upstream_requests']:>9} {t['bot_calls']:>10}")
+    m = result["median"]
+    print(f" med {m['tick_s']:>8.2f} {m['routes']:>7.0f} {m['routes_per_s']:>9.1f} {m['route_p50_ms']:>8.1f} "
+          f"{m['route_p99_ms']:>8.1f} {m['db_s']:>7.2f} {m['upstream_requests']:>9.0f} {m['bot_calls']:>10.0f}")
+    print("bot calls by method:", result["bot_calls_by_method"])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark scheduler_tick against a local stub upstream")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--routes", type=int, default=3, help="routes per user")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="distinct (from, to, date) combinations; 0 = every route unique")
+    parser.add_argument("--latency", type=float, default=50, help="stub upstream latency, ms")
+    parser.add_argument("--jitter", type=float, default=0, help="stub upstream latency jitter, ms")
+    parser.add_argument("--trains", type=int, default=8, help="trains per response")
+    parser.add_argument("--cars", type=int, default=4, help="car types per train")
+    parser.add_argument("--free-ratio", type=float, default=0.5, help="share of cars with free seats")
+    parser.add_argument("--bot-latency", type=float, default=0, help="fake Bot API latency, ms")
+    parser.add_argument("--ticks", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Trains API response corpus for parser / renderer micro-benchmarks.
+
+benchmarks/corpus/*.json range from an empty response to a very large one.
+The shipped files are generated (deterministic, eticket-shaped, no user or
+session data). Real responses can be added with `record`, which keeps only
+the fields the bot reads, so cookies, tokens and passenger data never land
+in the repo:
+
+    python -m benchmarks.corpus generate
+    python -m benchmarks.corpus record 2900000 2900700 2026-01-15 tashkent_samarkand
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, Dict
+
+from benchmarks.payloads import trains_payload
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+# name -> (trains, cars per train, share of cars with free seats)
+GENERATED = {
+    "empty": (0, 0, 0.0),
+    "no_seats": (6, 4, 0.0),
+    "small": (2, 3, 1.0),
+    "medium": (10, 4, 0.6),
+    "large": (30, 5, 0.6),
+    "xlarge": (60, 6, 0.8),
+}
+
+TRAIN_KEYS = ("number", "brand", "type", "departureDate", "arrivalDate", "timeOnWay", "duration",
+              "departureStation", "arrivalStation", "originRoute", "cars")
+CAR_KEYS = ("type", "freeSeats", "tariff", "tariffs", "seatDetail")
+
+
+def sanitise(api_json: Dict[str, Any]) -> Dict[str, Any]:
+    directions = api_json.get("data", {}).get("directions", {})
+    items = directions.items() if isinstance(directions, dict) else enumerate(directions)
+    out = {}
+    for key, leg in items:
+        trains = []
+        for train in leg.get("trains", []) or []:
+            t = {k: train[k] for k in TRAIN_KEYS if k in train}
+            t["cars"] = [{k: car[k] for k in CAR_KEYS if k in car}
+                         for car in train.get("cars", []) if isinstance(car, dict)]
+            origin = train.get("originRoute") or {}
+            t["originRoute"] = {k: origin.get(k) for k in ("depStationName", "arvStationName")}
+            trains.append(t)
+        out[str(key)] = {"trains": trains}
+    if isinstance(directions, list):
+        return {"data": {"directions": [out[k] for k in sorted(out, key=int)]}}
+    return {"data": {"directions": out}}
+
+
+def _save(name: str, payload: Dict[str, Any]) -> str:
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    path = os.path.join(CORPUS_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def generate() -> None:
+    for name, (trains, cars, free_ratio) in GENERATED.items():
+        payload = trains_payload(trains, cars, seed=len(name), free_ratio=free_ratio)
+        print(_save(name, payload))
+    # Same trains, directions sent as a list (parse_ticket_info handles both)
+    medium = trains_payload(*GENERATED["medium"][:2], seed=len("medium"), free_ratio=GENERATED["medium"][2])
+    print(_save("medium_list", {"data": {"directions": [medium["data"]["directions"]["forward"]]}}))
+
+
+async def record(dep: str, arv: str, date: str, name: str, lang: str) -> None:
+    from api import fetch_trains, INTERACTIVE
+    print(_save(name, sanitise(await fetch_trains(dep, arv, date, lang, priority=INTERACTIVE))))
+
+
+def load_corpus() -> Dict[str, Dict[str, Any]]:
+    corpus = {}
+    for fname in sorted(os.listdir(CORPUS_DIR)):
+        if fname.endswith(".json"):
+            with open(os.path.join(CORPUS_DIR, fname), encoding="utf-8") as f:
+                corpus[fname[:-5]] = json.load(f)
+    return corpus
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the trains response corpus")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("generate", help="(re)write the generated corpus files")
+    rec = sub.add_parser("record", help="fetch a real response and store it sanitised")
+    rec.add_argument("dep")
+    rec.add_argument("arv")
+    rec.add_argument("date", help="YYYY-MM-DD")
+    rec.add_argument("name")
+    rec.add_argument("--lang", default="ru")
+    args = parser.parse_args(argv)
+    if args.cmd == "generate":
+        generate()
+    else:
+        asyncio.run(record(args.dep, args.arv, args.date, args.name, args.lang))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+Stand-in for aiogram's Bot: records outgoing Bot API calls instead of sending them.
+"""
+import asyncio
+import itertools
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, List, Tuple
+
+
+class FakeBot:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.messages: List[Tuple[int, str]] = []
+        self._ids = itertools.count(1)
+
+    async def _call(self, method: str) -> None:
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> SimpleNamespace:
+        await self._call("send_message")
+        self.messages.append((chat_id, text))
+        return SimpleNamespace(message_id=next(self._ids), chat=SimpleNamespace(id=chat_id), text=text)
+
+    async def edit_message_text(self, text: str, chat_id: int = None, message_id: int = None, **kwargs: Any):
+        await self._call("edit_message_text")
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id), text=text)
+
+    async def set_chat_menu_button(self, **kwargs: Any) -> bool:
+        await self._call("set_chat_menu_button")
+        return True
+
+    @property
+    def sent(self) -> int:
+        return sum(self.calls.values())
@@ -0,0 +1,68 @@
+"""
+Deterministic eticket-shaped payloads for the stub upstream and micro-benchmarks.
+
+Field names and nesting follow real trains/stations responses (the parts
+scheduler.parse_ticket_info reads); values are synthetic.
+"""
+import random
+from typing import Any, Dict, List
+
+STATIONS = [
+    ("2900000", "Ташкент"), ("2900700", "Самарканд"), ("2900800", "Бухара"),
+    ("2900680", "Андижан 1"), ("2900750", "Навои"), ("2900172", "Карши"),
+    ("2900255", "Джизак"), ("2900940", "Ургенч"), ("2900930", "Хива"),
+    ("2900970", "Кунград"), ("2900790", "Термез"), ("2900880", "Наманган"),
+]
+
+CAR_TYPES = ["Плацкартный", "Купе", "Люкс", "Сидячий", "Общий"]
+BRANDS = ["Afrosiyob", "Sharq", "Nasaf", "", "Пассажирский"]
+
+
+def trains_payload(n_trains: int, cars_per_train: int = 4, seed: int = 0, free_ratio: float = 1.0,
+                   date: str = "15.01.2026") -> Dict[str, Any]:
+    """Trains list response with n_trains trains; free_ratio of the cars have free seats."""
+    rnd = random.Random(seed)
+    trains: List[Dict[str, Any]] = []
+    for i in range(n_trains):
+        dep_h, dep_m = rnd.randrange(24), rnd.randrange(60)
+        dur = rnd.randrange(120, 900)
+        arr_h, arr_m = (dep_h + (dep_m + dur) // 60) % 24, (dep_m + dur) % 60
+        origin = rnd.sample(STATIONS, 2)
+        cars = []
+        for c in range(cars_per_train):
+            free = rnd.randrange(1, 120) if rnd.random() < free_ratio else 0
+            ctype = CAR_TYPES[(i + c) % len(CAR_TYPES)]
+            car: Dict[str, Any] = {
+                "type": ctype if c % 2 else {"name": ctype, "code": ctype[:2]},
+                "freeSeats": free,
+                "seatDetail": {
+                    "up": free // 3, "down": free // 3,
+                    "lateralUp": free // 6, "lateralDn": free - 2 * (free // 3) - free // 6,
+                },
+            }
+            tariff = rnd.randrange(50, 900) * 1000
+            if c % 3:
+                car["tariff"] = tariff
+            else:
+                car["tariffs"] = [{"tariff": tariff, "classServiceType": "2Э"}]
+            cars.append(car)
+        trains.append({
+            "number": f"{100 + i}{'ФЭСЧ'[i % 4]}",
+            "brand": BRANDS[i % len(BRANDS)],
+            "type": "Скорый",
+            "departureDate": f"{date} {dep_h:02d}:{dep_m:02d}",
+            "arrivalDate": f"{date} {arr_h:02d}:{arr_m:02d}",
+            "timeOnWay": f"{dur // 60:02d}:{dur % 60:02d}",
+            "duration": dur,
+            "departureStation": STATIONS[0][1],
+            "arrivalStation": STATIONS[1][1],
+            "originRoute": {"depStationName": origin[0][1], "arvStationName": origin[1][1]},
+            "cars": cars,
+        })
+    return {"data": {"directions": {"forward": {"trains": trains}}}}
+
+
+def stations_payload(query: str) -> Dict[str, Any]:
+    q = (query or "").lower()
+    found = [{"code": code, "name": name} for code, name in STATIONS if q[:2] in name.lower()]
+    return {"data": {"stations": found or [{"code": c, "name": n} for c, n in STATIONS[:3]]}}
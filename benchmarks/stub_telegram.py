@@ -0,0 +1,95 @@
+"""
+Local stand-in for the Telegram Bot API (point TELEGRAM_API_URL at it).
+
+Answers getMe / deleteWebhook / setChatMenuButton, hands out one /start update
+per reset() through getUpdates, and records when the first sendMessage
+arrives, so benchmarks can measure time to first reply of a real bot process.
+Every sendMessage is also kept in `sent` as (chat_id, unix time).
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from benchmarks.stub_upstream import free_port
+
+CHAT_ID = 424242
+
+
+class StubTelegram:
+    def __init__(self, port: Optional[int] = None):
+        self.port = port or free_port()
+        self.calls: Counter = Counter()
+        self.first_reply = asyncio.Event()
+        self.first_reply_at = 0.0
+        self.sent: List[Tuple[int, float]] = []
+        self._pending = False
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def reset(self) -> None:
+        """Queue a fresh /start update and forget the last reply."""
+        self.first_reply = asyncio.Event()
+        self.first_reply_at = 0.0
+        self._pending = True
+
+    def _start_update(self) -> Dict[str, Any]:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": CHAT_ID, "type": "private"},
+                "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Bench"},
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if method == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            if self._pending:
+                self._pending = False
+                result = [self._start_update()]
+            else:
+                await asyncio.sleep(0.5)  # short long-poll
+                result = []
+        elif method == "sendMessage":
+            if not self.first_reply.is_set():
+                self.first_reply_at = time.perf_counter()
+                self.first_reply.set()
+            form = await request.post()
+            self.sent.append((int(form.get("chat_id", CHAT_ID)), time.time()))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(form.get("chat_id", CHAT_ID)), "type": "private"},
+                "text": form.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self) -> "StubTelegram":
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._method)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
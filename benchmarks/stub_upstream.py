@@ -0,0 +1,100 @@
+"""
+Local stand-in for the eticket trains / stations API.
+
+Serves the two POST endpoints the bot calls with configurable latency and
+payload size, and counts requests so benchmarks can report upstream load.
+"""
+import asyncio
+import json
+import random
+import socket
+import zlib
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+from benchmarks.payloads import STATIONS, trains_payload, stations_payload
+
+TRAINS_PATH = "/api/v3/handbook/trains/list"
+STATIONS_PATH = "/api/v1/handbook/stations/list"
+STATION_NAMES = dict(STATIONS)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubUpstream:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, trains: int = 8, cars: int = 4,
+                 free_ratio: float = 0.5, port: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.trains = trains
+        self.cars = cars
+        self.free_ratio = free_ratio
+        self.port = port or free_port()
+        self.requests: Dict[str, int] = {"trains": 0, "stations": 0}
+        self._runner: Optional[web.AppRunner] = None
+        self._cache: Dict[Any, bytes] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment overrides pointing config.TRAINS_API / STATIONS_API at this stub."""
+        return {"TRAINS_API": self.base_url + TRAINS_PATH, "STATIONS_API": self.base_url + STATIONS_PATH}
+
+    async def _sleep(self) -> None:
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _trains(self, request: web.Request) -> web.Response:
+        self.requests["trains"] += 1
+        body = await request.json()
+        legs = body.get("directions", {})
+        # Same route + date -> same payload, different routes -> different trains;
+        # a round trip (forward + backward) is answered with both directions
+        key = tuple((name, leg.get("depStationCode"), leg.get("arvStationCode"), leg.get("date"))
+                    for name, leg in legs.items())
+        data = self._cache.get(key)
+        if data is None:
+            directions = {}
+            for name, dep, arv, day in key:
+                y, m, d = (day or "2026-01-15").split("-")
+                payload = trains_payload(self.trains, self.cars, seed=zlib.crc32(repr((dep, arv, day)).encode()),
+                                         free_ratio=self.free_ratio, date=f"{d}.{m}.{y}")
+                leg = directions[name] = payload["data"]["directions"]["forward"]
+                for train in leg["trains"]:
+                    train["departureStation"] = STATION_NAMES.get(dep, train["departureStation"])
+                    train["arrivalStation"] = STATION_NAMES.get(arv, train["arrivalStation"])
+            data = json.dumps({"data": {"directions": directions}}, ensure_ascii=False).encode()
+            self._cache[key] = data
+        await self._sleep()
+        return web.Response(body=data, content_type="application/json")
+
+    async def _stations(self, request: web.Request) -> web.Response:
+        self.requests["stations"] += 1
+        body = await request.json()
+        await self._sleep()
+        return web.json_response(stations_payload(body.get("name", "")))
+
+    async def _head(self, request: web.Request) -> web.Response:
+        return web.Response()
+
+    async def start(self) -> "StubUpstream":
+        app = web.Application()
+        app.router.add_post(TRAINS_PATH, self._trains)
+        app.router.add_post(STATIONS_PATH, self._stations)
+        app.router.add_route("HEAD", "/", self._head)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
@@ -1,6 +1,8 @@
+import argparse
 import asyncio
-import logging
+import functools
 import re
+import signal
 import time
 from typing import Dict, Any, List
 from datetime import datetime, timezone, timedelta
@@ -8,50 +10,44 @@ from datetime import datetime, timezone, timedelta
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, MenuButtonWebApp, WebAppInfo
 from aiogram.filters import Command
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiohttp import web
 
 # Import local simplified modules
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, API_PORT, API_WORKERS, TASK_POLL_INTERVAL, METRICS_PORT,
+    FSM_STORAGE, FSM_TTL, FSM_CACHE_SIZE,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+    TELEGRAM_API_URL, TICK_INTERVAL, FIRST_TICK_DELAY, SHUTDOWN_TIMEOUT, MAX_ROUTES, MAX_RANGE_DAYS, CHECK_MAX_AGE, KEYBOARD_DEBOUNCE,
+)
 from db import (
     init_db, ensure_user, get_user, set_language, count_routes, 
-    list_routes, add_route, update_route_field, delete_route, 
-    set_notify_mode
+    list_routes, add_route, update_route_field, delete_route, set_route_filters,
+    set_notify_mode, enqueue_task, pop_tasks, preload_users, forget_user,
+    get_keyboard_state, set_keyboard_state,
+)
+from api import search_stations, warmup as warmup_upstream, close_client
+import stations as station_catalogue
+import leases
+from scheduler import (
+    scheduler_tick, check_and_notify_for_user, update_route_names_for_language,
+    sweep_expired_routes, notify_route_expired, TZ_UZ, resume_tick, drain as drain_tick, next_tick_at,
+    CAR_CLASS_ICONS, BERTHS, SEAT_KEYS,
 )
-from api import search_stations
-from scheduler import scheduler_tick, check_and_notify_for_user, update_route_names_for_language
-from texts import t, TEXT
+from texts import t, TEXT, templates, type_name
+from metrics import TelegramMetricsMiddleware, Counter
 
 # Callback set in main() once bot is ready; used by handlers to refresh keyboard after route deletion
 _on_route_deleted = None
 
 # --- LOGGING ---
-from logging.handlers import RotatingFileHandler
-import sys
-
-# Configure logging with rotation (max 5MB per file, keep 2 backups)
-logger = logging.getLogger("railway_bot")
-logger.setLevel(logging.INFO)
-
-# Console handler
-console_handler = logging.StreamHandler(sys.stderr)
-console_handler.setLevel(logging.INFO)
-console_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(console_formatter)
-
-# File handler with rotation
-file_handler = RotatingFileHandler(
-    "railway_bot.log",
-    maxBytes=5*1024*1024,  # 5 MB
-    backupCount=2  # Keep 2 backup files
-)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(console_formatter)
+from log_setup import setup_logging
 
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# Console + rotating file (railway_bot.log), written from a background thread
+logger = setup_logging()
 
 # --- STATES ---
 class InitFSM(StatesGroup):
@@ -69,6 +65,7 @@ class RoutesFSM(StatesGroup):
     edit_from_query = State()
     edit_to_query = State()
     edit_date = State()
+    edit_filters = State()
     delete_confirm = State()
 
 class SettingsFSM(StatesGroup):
@@ -120,7 +117,7 @@ def kb_routes_inline(routes: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
     buttons = []
     for idx, r in enumerate(routes, start=1):
         # Callback data: "route_view:ID"
-        date_str = fmt_date_for_ui(r['travel_date'])
+        date_str = fmt_route_dates_for_ui(r)
         buttons.append([InlineKeyboardButton(
             text=f"{idx}. {r['from_name']} → {r['to_name']} ({date_str})",
             callback_data=f"route_view:{r['id']}"
@@ -143,6 +140,7 @@ def kb_route_edit_menu(lang: str) -> ReplyKeyboardMarkup:
             [KeyboardButton(text=t(lang, "edit_from"))],
             [KeyboardButton(text=t(lang, "edit_to"))],
             [KeyboardButton(text=t(lang, "edit_date"))],
+            [KeyboardButton(text=t(lang, "edit_filters"))],
             [KeyboardButton(text=t(lang, "back"))],
         ],
         resize_keyboard=True
@@ -199,6 +197,44 @@ def parse_date_ddmmyyyy(text: str) -> str:
     d, m, y = m.groups()
     return f"{y}-{m.zfill(2)}-{d.zfill(2)}"
 
+def parse_date_range(text: str):
+    # "DD.MM.YYYY" or "DD.MM.YYYY-DD.MM.YYYY" -> (YYYY-MM-DD, YYYY-MM-DD or None), or None
+    m = re.match(r"^\s*(\S+?)\s*(?:[—–]|\s-\s|-(?=\d{1,2}[./]))\s*(\S+)\s*$", text)
+    if not m:
+        date_api = parse_date_ddmmyyyy(text)
+        return (date_api, None) if date_api else None
+    start, end = parse_date_ddmmyyyy(m.group(1)), parse_date_ddmmyyyy(m.group(2))
+    if not start or not end:
+        return None
+    return start, (end if end != start else None)
+
+def parse_route_dates(text: str):
+    # "A", "A-B" (range) or "A, B" (there on A, back on B) -> (travel_date, travel_date_to, return_date), or None
+    there, sep, back = text.partition(",")
+    if sep:
+        start, end = parse_date_ddmmyyyy(there), parse_date_ddmmyyyy(back)
+        return (start, None, end) if start and end else None
+    dates = parse_date_range(text)
+    return (dates[0], dates[1], None) if dates else None
+
+def check_date_range(start: str, end, return_date=None) -> str:
+    # Returns the text key of what's wrong with parsed route dates, or "" if they can be watched
+    tz_uz = timezone(timedelta(hours=5))
+    today = datetime.now(tz_uz).date()
+    try:
+        first = datetime.strptime(start, "%Y-%m-%d").date()
+        last = datetime.strptime(end, "%Y-%m-%d").date() if end else first
+        back = datetime.strptime(return_date, "%Y-%m-%d").date() if return_date else first
+    except ValueError:
+        return "bad_date"
+    if first < today:
+        return "date_past"
+    if last < first or (last - first).days >= MAX_RANGE_DAYS:
+        return "bad_range"
+    if back < first:
+        return "bad_return"
+    return ""
+
 def fmt_date_for_ui(date_str: str) -> str:
     # YYYY-MM-DD -> DD.MM.YYYY
     try:
@@ -207,6 +243,77 @@ def fmt_date_for_ui(date_str: str) -> str:
     except:
         return date_str
 
+# Words accepted in the seat filter prompt (any language), matched as word prefixes
+FILTER_CAR_WORDS = {
+    "platskart": ("плацкарт", "plackart", "platskart", "sleeper"),
+    "kupe": ("купе", "kupe", "compartment", "coupe"),
+    "lux": ("люкс", "св", "lyuks", "sv", "lux", "deluxe"),
+    "seated": ("сидяч", "o'rindiq", "orindiq", "seated", "seat"),
+}
+FILTER_BERTH_WORDS = {
+    "down": ("нижн", "pastki", "lower", "bottom"),
+    "up": ("верхн", "yuqori", "upper", "top"),
+    "lateral": ("боков", "yon", "side", "lateral"),
+}
+FILTER_CLEAR_WORDS = {"-", "—", "нет", "yo'q", "no", "none"}
+CAR_CLASS_NAMES = {"platskart": "Плацкартный", "kupe": "Купе", "lux": "Люкс", "seated": "Сидячий"}
+
+def parse_filters(text: str):
+    # "купе, нижняя, 300000, 127Ф" -> ({"car_types": [...], "berths": [...], "max_price": ..., "trains": [...]}, "")
+    # or (None, unrecognised part); "-" clears -> ({}, "")
+    filters: Dict[str, Any] = {}
+    # Commas separate filters ("127,300" is a train and a price), so a price's
+    # thousands are grouped with spaces or dots only: 300 000 / 300.000
+    text = text.replace("’", "'").replace("‘", "'").lower()
+    for token in re.split(r"[,;\n]+", text):
+        token = re.sub(r"(?<=\d)[\s.](?=\d{3}\b)", "", token.strip())
+        if not token:
+            continue
+        if token in FILTER_CLEAR_WORDS:
+            return {}, ""
+        digits = re.sub(r"\D", "", token)
+        if len(digits) > 4:
+            filters["max_price"] = int(digits)
+            continue
+        if digits and re.fullmatch(r"№?\s*\d{1,4}\s*[^\W\d_]?", token):
+            filters.setdefault("trains", []).append(token.lstrip("№").strip().upper())
+            continue
+        for word in token.split():
+            car = next((c for c, words in FILTER_CAR_WORDS.items() if word.startswith(words)), None)
+            berth = next((b for b, words in FILTER_BERTH_WORDS.items() if word.startswith(words)), None)
+            if car:
+                filters.setdefault("car_types", []).append(car)
+            elif berth:
+                filters.setdefault("berths", []).append(berth)
+            else:
+                return None, token
+    return filters, ""
+
+def fmt_filters_for_ui(lang: str, filters: Dict[str, Any]) -> str:
+    tpl = templates(lang)
+    parts = [f"{CAR_CLASS_ICONS[c]} {type_name(CAR_CLASS_NAMES[c], lang)}" for c in filters.get("car_types", ())]
+    for berth in filters.get("berths", ()):
+        parts.extend(tpl.seat_prefixes[SEAT_KEYS.index(key)].rstrip(": ") for key in BERTHS[berth])
+    if filters.get("max_price"):
+        parts.append(f"≤ {filters['max_price']:,}")
+    parts.extend(f"№ {n}" for n in filters.get("trains", ()))
+    return ", ".join(parts)
+
+def route_view_text(lang: str, idx: int, route: Dict[str, Any]) -> str:
+    text = (f"{t(lang, 'route_view_title').format(n=idx)}\n"
+            f"{route['from_name']} → {route['to_name']}\n"
+            f"📅 {fmt_route_dates_for_ui(route)}")
+    if route.get("filters"):
+        text += "\n" + t(lang, "filters_label").format(f=fmt_filters_for_ui(lang, route["filters"]))
+    return text
+
+def fmt_route_dates_for_ui(route: Dict[str, Any]) -> str:
+    if route.get("return_date"):
+        return f"{fmt_date_for_ui(route['travel_date'])} ⇄ {fmt_date_for_ui(route['return_date'])}"
+    if route.get("travel_date_to"):
+        return f"{fmt_date_for_ui(route['travel_date'])} – {fmt_date_for_ui(route['travel_date_to'])}"
+    return fmt_date_for_ui(route["travel_date"])
+
 # --- HANDLERS: COMMON ---
 async def on_start(msg: Message, state: FSMContext):
     await state.clear()
@@ -230,7 +337,7 @@ async def on_lang_chosen(msg: Message, state: FSMContext):
 
     await state.clear()
     has_routes = (await count_routes(msg.from_user.id)) > 0
-    await msg.answer(t(new_lang, "menu_main"), reply_markup=kb_main(new_lang, has_routes))
+    await answer_main(msg, t(new_lang, "menu_main"), new_lang, has_routes)
 
 # --- RATE LIMITER (check routes) ---
 # Thresholds: minimum gap for immediate pass; next value = forced gap
@@ -288,13 +395,13 @@ async def on_cancel(msg: Message, state: FSMContext):
     lang = user["language"]
     await state.clear()
     has = (await count_routes(msg.from_user.id)) > 0
-    await msg.answer("❌", reply_markup=kb_main(lang, has))
+    await answer_main(msg, "❌", lang, has)
 
 async def on_add_route_start(msg: Message, state: FSMContext):
     user = await get_user(msg.from_user.id)
     lang = user["language"]
-    if await count_routes(msg.from_user.id) >= 5:
-        await msg.answer(t(lang, "max_routes"), reply_markup=kb_main(lang, has_routes=True))
+    if await count_routes(msg.from_user.id) >= MAX_ROUTES:
+        await answer_main(msg, t(lang, "max_routes").format(n=MAX_ROUTES), lang, True)
         await state.clear()
         return
     await state.clear()
@@ -327,7 +434,8 @@ async def on_check_routes(msg: Message):
         if task and not task.done():
             task.cancel()
         _record_check(user_id)
-        await check_and_notify_for_user(msg.bot, user_id, force_send=True, on_route_deleted=_on_route_deleted)
+        await check_and_notify_for_user(msg.bot, user_id, force_send=True, on_route_deleted=_on_route_deleted,
+                                        max_age=CHECK_MAX_AGE)
         return
 
     # Rate-limited: if a check is already pending, ignore this request
@@ -340,7 +448,8 @@ async def on_check_routes(msg: Message):
         try:
             await asyncio.sleep(delay)
             _record_check(user_id)
-            await check_and_notify_for_user(msg.bot, user_id, force_send=True, on_route_deleted=_on_route_deleted)
+            await check_and_notify_for_user(msg.bot, user_id, force_send=True, on_route_deleted=_on_route_deleted,
+                                            max_age=CHECK_MAX_AGE)
         finally:
             _pending_check.pop(user_id, None)
 
@@ -412,20 +521,19 @@ async def pick_to_station(cb: CallbackQuery, state: FSMContext):
 async def add_route_date(msg: Message, state: FSMContext):
     user = await get_user(msg.from_user.id)
     lang = user["language"]
-    date_api = parse_date_ddmmyyyy(msg.text or "")
-    if not date_api:
+    dates = parse_route_dates(msg.text or "")
+    if not dates:
         await msg.answer(t(lang, "bad_date"))
         return
-    tz_uz = timezone(timedelta(hours=5))
-    today = datetime.now(tz_uz).date()
-    if datetime.strptime(date_api, "%Y-%m-%d").date() < today:
-        await msg.answer(t(lang, "date_past"))
+    problem = check_date_range(*dates)
+    if problem:
+        await msg.answer(t(lang, problem).format(n=MAX_RANGE_DAYS))
         return
-    if await count_routes(msg.from_user.id) >= 5:
-        await msg.answer(t(lang, "max_routes"))
+    if await count_routes(msg.from_user.id) >= MAX_ROUTES:
+        await msg.answer(t(lang, "max_routes").format(n=MAX_ROUTES))
         await state.clear()
         has = (await count_routes(msg.from_user.id)) > 0
-        await msg.answer(t(lang, "menu_main"), reply_markup=kb_main(lang, has))
+        await answer_main(msg, t(lang, "menu_main"), lang, has)
         return
     data = await state.get_data()
     from_code, from_name = data.get("from_code"), data.get("from_name")
@@ -434,9 +542,9 @@ async def add_route_date(msg: Message, state: FSMContext):
         await msg.answer(t(lang, "unknown_error"))
         await state.clear()
         has = (await count_routes(msg.from_user.id)) > 0
-        await msg.answer(t(lang, "menu_main"), reply_markup=kb_main(lang, has))
+        await answer_main(msg, t(lang, "menu_main"), lang, has)
         return
-    new_route_id = await add_route(msg.from_user.id, from_code, from_name, to_code, to_name, date_api)
+    new_route_id = await add_route(msg.from_user.id, from_code, from_name, to_code, to_name, *dates)
     await msg.answer(t(lang, "saved"))
     
     # Immediate check for the new route
@@ -446,7 +554,7 @@ async def add_route_date(msg: Message, state: FSMContext):
     asyncio.create_task(check_and_notify_for_user(msg.bot, msg.from_user.id, force_send=True, specific_route_id=new_route_id, on_route_deleted=_on_route_deleted))
     await state.clear()
     has = (await count_routes(msg.from_user.id)) > 0
-    await msg.answer(t(lang, "menu_main"), reply_markup=kb_main(lang, has))
+    await answer_main(msg, t(lang, "menu_main"), lang, has)
 
 # --- ROUTES LIST ACTIONS ---
 async def routes_list_handler(msg: Message, state: FSMContext):
@@ -456,7 +564,7 @@ async def routes_list_handler(msg: Message, state: FSMContext):
     if txt == t(lang, "back"):
          await state.clear()
          has = (await count_routes(msg.from_user.id)) > 0
-         await msg.answer(t(lang, "menu_main"), reply_markup=kb_main(lang, has))
+         await answer_main(msg, t(lang, "menu_main"), lang, has)
          return
     m = re.match(r"^(\d+)\.\s+", txt)
     if not m: return
@@ -467,9 +575,7 @@ async def routes_list_handler(msg: Message, state: FSMContext):
     await state.update_data(route_id=route["id"], route_index=idx)
     await state.set_state(RoutesFSM.view)
     await msg.answer(
-        f"{t(lang, 'route_view_title').format(n=idx)}\n"
-        f"{route['from_name']} → {route['to_name']}\n"
-        f"📅 {fmt_date_for_ui(route['travel_date'])}",
+        route_view_text(lang, idx, route),
         reply_markup=kb_route_actions(lang),
     )
 
@@ -485,7 +591,7 @@ async def route_view_handler(msg: Message, state: FSMContext):
         
         # User wants "Main Menu buttons" to return.
         has = (await count_routes(msg.from_user.id)) > 0
-        await msg.answer(t(lang, "menu_main"), reply_markup=kb_main(lang, has))
+        await answer_main(msg, t(lang, "menu_main"), lang, has)
 
         routes = await list_routes(msg.from_user.id)
         await state.set_state(RoutesFSM.list)
@@ -517,9 +623,7 @@ async def route_edit_menu_handler(msg: Message, state: FSMContext):
         await state.set_state(RoutesFSM.view)
         if route:
             await msg.answer(
-                f"{t(lang, 'route_view_title').format(n=idx)}\n"
-                f"{route['from_name']} → {route['to_name']}\n"
-                f"📅 {fmt_date_for_ui(route['travel_date'])}",
+                route_view_text(lang, idx, route),
                 reply_markup=kb_route_actions(lang),
             )
         else:
@@ -539,6 +643,10 @@ async def route_edit_menu_handler(msg: Message, state: FSMContext):
         await state.set_state(RoutesFSM.edit_date)
         await msg.answer(t(lang, "enter_date"), reply_markup=kb_cancel(lang))
         return
+    if txt == t(lang, "edit_filters"):
+        await state.set_state(RoutesFSM.edit_filters)
+        await msg.answer(t(lang, "enter_filters"), reply_markup=kb_cancel(lang))
+        return
 
 async def edit_from_query_handler(msg: Message, state: FSMContext):
     user = await get_user(msg.from_user.id)
@@ -595,18 +703,32 @@ async def pick_edit_to(cb: CallbackQuery, state: FSMContext):
 async def edit_date_handler(msg: Message, state: FSMContext):
     user = await get_user(msg.from_user.id)
     lang = user["language"]
-    date_api = parse_date_ddmmyyyy(msg.text or "")
-    if not date_api:
+    dates = parse_route_dates(msg.text or "")
+    if not dates:
         await msg.answer(t(lang, "bad_date"))
         return
-    tz_uz = timezone(timedelta(hours=5))
-    today = datetime.now(tz_uz).date()
-    if datetime.strptime(date_api, "%Y-%m-%d").date() < today:
-        await msg.answer(t(lang, "date_past"))
+    problem = check_date_range(*dates)
+    if problem:
+        await msg.answer(t(lang, problem).format(n=MAX_RANGE_DAYS))
+        return
+    data = await state.get_data()
+    route_id = int(data.get("route_id", 0))
+    await update_route_field(route_id, "travel_date", dates[0])
+    await update_route_field(route_id, "travel_date_to", dates[1])
+    await update_route_field(route_id, "return_date", dates[2])
+    await state.set_state(RoutesFSM.edit_menu)
+    await msg.answer(t(lang, "updated"), reply_markup=kb_route_edit_menu(lang))
+
+async def edit_filters_handler(msg: Message, state: FSMContext):
+    user = await get_user(msg.from_user.id)
+    lang = user["language"]
+    filters, bad = parse_filters(msg.text or "")
+    if filters is None:
+        await msg.answer(t(lang, "bad_filters").format(w=bad))
         return
     data = await state.get_data()
     route_id = int(data.get("route_id", 0))
-    await update_route_field(route_id, "travel_date", date_api)
+    await set_route_filters(route_id, filters)
     await state.set_state(RoutesFSM.edit_menu)
     await msg.answer(t(lang, "updated"), reply_markup=kb_route_edit_menu(lang))
 
@@ -624,9 +746,7 @@ async def delete_confirm_handler(msg: Message, state: FSMContext):
         route = next((r for r in routes if r["id"] == route_id), None)
         if route:
             await msg.answer(
-                f"{t(lang, 'route_view_title').format(n=idx)}\n"
-                f"{route['from_name']} → {route['to_name']}\n"
-                f"📅 {fmt_date_for_ui(route['travel_date'])}",
+                route_view_text(lang, idx, route),
                 reply_markup=kb_route_actions(lang),
             )
         else:
@@ -651,7 +771,7 @@ async def delete_confirm_handler(msg: Message, state: FSMContext):
         
         # 3. Restore Main Menu Keyboard (so Yes/No is gone)
         # We send this with the "deleted" text
-        await msg.answer(t(lang, "route_deleted"), reply_markup=kb_main(lang, has_routes))
+        await answer_main(msg, t(lang, "route_deleted"), lang, has_routes)
         
         # 4. If routes exist, show them inline immediately
         if has_routes:
@@ -690,7 +810,7 @@ async def settings_menu_handler(msg: Message, state: FSMContext):
     if txt == t(lang, "back"):
         await state.clear()
         has = (await count_routes(msg.from_user.id)) > 0
-        await msg.answer(t(lang, "menu_main"), reply_markup=kb_main(lang, has))
+        await answer_main(msg, t(lang, "menu_main"), lang, has)
         return
 
 async def changing_notify_handler(msg: Message, state: FSMContext):
@@ -776,23 +896,152 @@ async def route_view_callback(cb: CallbackQuery, state: FSMContext):
     await state.set_state(RoutesFSM.view)
     
     await cb.message.answer(
-        f"{t(lang, 'route_view_title').format(n=idx)}\n"
-        f"{route['from_name']} → {route['to_name']}\n"
-        f"📅 {fmt_date_for_ui(route['travel_date'])}",
+        route_view_text(lang, idx, route),
         reply_markup=kb_route_actions(lang),
     )
     await cb.answer()
 
-# --- MAIN ---
-async def main():
-    logger.info("Starting bot...")
-    await init_db()
+# --- KEYBOARD REFRESH ---
+# Route and language changes made outside a chat handler (Mini App, scheduler
+# deletions, expiry) ask for a new main keyboard. Requests for a user within
+# KEYBOARD_DEBOUNCE seconds are merged into one, and nothing is sent when the
+# keyboard the user last got (users.keyboard, kept by KeyboardTrackingMiddleware)
+# is already the right one.
+KEYBOARD_REFRESHES = Counter("railway_keyboard_refresh_total", "Main keyboard refresh requests by outcome", ("result",))
+
+# telegram_id -> (bot, text key to send with the keyboard), while the user's refresh is pending
+_keyboard_pending: Dict[int, tuple] = {}
+_keyboard_tasks: Dict[int, asyncio.Task] = {}
+
+def keyboard_state(lang: str, has_routes: bool) -> str:
+    return f"{lang}:{int(has_routes)}"
+
+def _buttons(markup: ReplyKeyboardMarkup) -> tuple:
+    return tuple(tuple(b.text for b in row) for row in markup.keyboard)
+
+# Button texts of every main keyboard -> its keyboard_state
+_MAIN_KEYBOARDS = {_buttons(kb_main(lang, has)): keyboard_state(lang, has) for lang in TEXT for has in (False, True)}
+
+class KeyboardTrackingMiddleware(BaseRequestMiddleware):
+    """
+    aiogram session middleware: records in users.keyboard which reply keyboard
+    each chat was last sent - the main keyboard's state, or "" for any other
+    one (settings, route actions, cancel, ...), which replaces it on the client.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        response = await make_request(bot, method)
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, (ReplyKeyboardMarkup, ReplyKeyboardRemove)):
+            shown = _MAIN_KEYBOARDS.get(_buttons(markup), "") if isinstance(markup, ReplyKeyboardMarkup) else ""
+            try:
+                await set_keyboard_state(int(method.chat_id), shown)
+            except Exception as e:
+                logger.warning("set_keyboard_state error: %s", e)
+        return response
+
+async def answer_main(msg: Message, text: str, lang: str, has_routes: bool) -> None:
+    await msg.answer(text, reply_markup=kb_main(lang, has_routes))
+
+def request_keyboard_refresh(bot: Bot, telegram_id: int, notice: str = "menu_main") -> None:
+    pending = _keyboard_pending.get(telegram_id)
+    if pending is not None:
+        KEYBOARD_REFRESHES.inc("merged")
+        if notice == "settings_saved":  # a language change is worth saying so
+            _keyboard_pending[telegram_id] = (bot, notice)
+        return
+    _keyboard_pending[telegram_id] = (bot, notice)
+    _keyboard_tasks[telegram_id] = asyncio.create_task(_keyboard_refresh_later(telegram_id))
+
+async def _keyboard_refresh_later(telegram_id: int) -> None:
+    try:
+        await asyncio.sleep(KEYBOARD_DEBOUNCE)
+    except asyncio.CancelledError:
+        return  # drain_keyboard_refreshes sends it
+    _keyboard_tasks.pop(telegram_id, None)
+    await _send_keyboard(telegram_id, *_keyboard_pending.pop(telegram_id))
 
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+async def _send_keyboard(telegram_id: int, bot: Bot, notice: str) -> None:
+    try:
+        state = await get_keyboard_state(telegram_id)
+        if state is None:
+            return
+        lang, cnt, last_sent = state
+        current = keyboard_state(lang, cnt > 0)
+        if current == last_sent:
+            KEYBOARD_REFRESHES.inc("unchanged")
+            return
+        await bot.send_message(
+            telegram_id,
+            t(lang, notice),
+            reply_markup=kb_main(lang, has_routes=cnt > 0),
+            disable_notification=True,
+        )
+        KEYBOARD_REFRESHES.inc("sent")
+    except Exception as e:
+        logger.warning("Keyboard refresh error for %s: %s", telegram_id, e)
+
+async def drain_keyboard_refreshes() -> None:
+    """On shutdown: send the pending refreshes now instead of dropping them."""
+    for task in _keyboard_tasks.values():
+        task.cancel()
+    _keyboard_tasks.clear()
+    pending = list(_keyboard_pending.items())
+    _keyboard_pending.clear()
+    await asyncio.gather(*(_send_keyboard(tid, bot, notice) for tid, (bot, notice) in pending))
+
+async def refresh_keyboard(bot: Bot, telegram_id: int, lang: str) -> None:
+    """Called after a Mini App language change to update the reply keyboard."""
+    request_keyboard_refresh(bot, telegram_id, "settings_saved")
+
+async def refresh_keyboard_routes(bot: Bot, telegram_id: int) -> None:
+    """Called after route create/delete (API or scheduler) to update reply keyboard."""
+    request_keyboard_refresh(bot, telegram_id)
+
+# --- TASK QUEUE (cross-process) ---
+# API workers run without the bot's event loop, so they push follow-up work
+# into the `tasks` table and the scheduler worker executes it.
+async def enqueue_lang_change(telegram_id: int, lang: str) -> None:
+    await enqueue_task("refresh_keyboard", telegram_id, {"lang": lang})
+
+async def enqueue_route_change(telegram_id: int) -> None:
+    await enqueue_task("refresh_keyboard_routes", telegram_id)
+
+async def process_tasks(bot: Bot) -> None:
+    try:
+        tasks = await pop_tasks()
+    except Exception as e:
+        logger.warning("process_tasks: failed to claim tasks: %s", e)
+        return
+    expired_for = set()
+    for task in tasks:
+        kind, tid, payload = task["kind"], task["telegram_id"], task["payload"]
+        try:
+            if kind == "refresh_keyboard":
+                forget_user(tid)  # language was changed by another process
+                await refresh_keyboard(bot, tid, payload.get("lang", "ru"))
+            elif kind == "refresh_keyboard_routes":
+                await refresh_keyboard_routes(bot, tid)
+            elif kind == "route_expired":
+                await notify_route_expired(bot, tid, payload)
+                expired_for.add(tid)
+            else:
+                logger.warning("process_tasks: unknown task kind %r", kind)
+        except Exception as e:
+            logger.error("process_tasks: task %s (%s) failed: %s", task["id"], kind, e)
+    # One keyboard refresh per user, however many of their routes expired
+    for tid in expired_for:
+        await refresh_keyboard_routes(bot, tid)
+
+# --- MAIN ---
+def build_dispatcher() -> Dispatcher:
+    if FSM_STORAGE == "sqlite":
+        from fsm_storage import SQLiteStorage
+        dp = Dispatcher(storage=SQLiteStorage(ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE))
+    else:
+        dp = Dispatcher()
 
     # --- REGISTER HANDLERS ---
-    
     # 1. Global /start
     dp.message.register(on_start, Command("start"))
 
@@ -831,6 +1080,7 @@ async def main():
     dp.message.register(edit_to_query_handler, RoutesFSM.edit_to_query)
     dp.callback_query.register(pick_edit_to, F.data.startswith("pick:edit_to:"))
     dp.message.register(edit_date_handler, RoutesFSM.edit_date)
+    dp.message.register(edit_filters_handler, RoutesFSM.edit_filters)
     
     # Delete Confirm
     # Delete Confirm
@@ -843,7 +1093,9 @@ async def main():
     dp.message.register(changing_lang_handler, SettingsFSM.changing_lang)
     dp.message.register(changing_notify_handler, SettingsFSM.changing_notify)
 
-    # --- WEB APP MENU BUTTON ---
+    return dp
+
+async def setup_menu_button(bot: Bot) -> None:
     from config import WEBAPP_URL
     if WEBAPP_URL:
         try:
@@ -857,64 +1109,275 @@ async def main():
         except Exception as e:
             logger.warning("Could not set menu button: %s", e)
 
-    # --- API SERVER ---
-    from api_server import create_app as create_api_app
-    from config import API_PORT
-
-    async def refresh_keyboard(telegram_id: int, lang: str) -> None:
-        """Called by API server after language change to update reply keyboard."""
-        try:
-            cnt = await count_routes(telegram_id)
-            await bot.send_message(
-                telegram_id,
-                t(lang, "settings_saved"),
-                reply_markup=kb_main(lang, has_routes=cnt > 0),
-            )
-        except Exception as e:
-            logger.warning("refresh_keyboard error: %s", e)
-
-    async def refresh_keyboard_routes(telegram_id: int) -> None:
-        """Called after route create/delete (API or scheduler) to update reply keyboard."""
-        try:
-            user = await get_user(telegram_id)
-            if not user:
-                return
-            lang = user["language"]
-            cnt = await count_routes(telegram_id)
-            await bot.send_message(
-                telegram_id,
-                t(lang, "menu_main"),
-                reply_markup=kb_main(lang, has_routes=cnt > 0),
-                disable_notification=True,
-            )
-        except Exception as e:
-            logger.warning("refresh_keyboard_routes error: %s", e)
-
-    global _on_route_deleted
-    _on_route_deleted = refresh_keyboard_routes
+async def sweep_if_leader() -> None:
+    # Lease mode: the sweep runs on whichever worker holds slot 0
+    if 0 in leases.owned():
+        await sweep_expired_routes()
 
-    # --- SCHEDULER ---
+def start_scheduler(bot: Bot, shard=None, leased: bool = False) -> AsyncIOScheduler:
+    # leased: routes split between workers by leases (leases.py); call leases.heartbeat() once first
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(scheduler_tick, "cron", minute="*/5", second="30", id="tick_30m", replace_existing=True, args=[bot, refresh_keyboard_routes])
+    # First tick in the first slot FIRST_TICK_DELAY after start, once caches and the HTTP pool are warm
+    first_tick = datetime.fromtimestamp(next_tick_at(time.time() + FIRST_TICK_DELAY), TZ_UZ)
+    scheduler.add_job(scheduler_tick, "interval", seconds=TICK_INTERVAL, id="tick", replace_existing=True,
+                      start_date=first_tick,
+                      kwargs={"bot": bot, "on_route_deleted": _on_route_deleted, "shard": shard, "leased": leased})
+    scheduler.add_job(process_tasks, "interval", seconds=TASK_POLL_INTERVAL, id="tasks", replace_existing=True,
+                      args=[bot], max_instances=1, coalesce=True)
+    if leased:
+        scheduler.add_job(leases.heartbeat, "interval", seconds=leases.HEARTBEAT_INTERVAL, id="lease_heartbeat",
+                          replace_existing=True, max_instances=1, coalesce=True)
+        scheduler.add_job(sweep_if_leader, id="sweep_startup", replace_existing=True)
+        scheduler.add_job(sweep_if_leader, "cron", hour=0, minute=0, second=5, timezone=TZ_UZ,
+                          id="sweep_expired", replace_existing=True, max_instances=1, coalesce=True)
+    else:
+        # Rest of the current slot's tick, if the previous process was stopped in the middle of it
+        scheduler.add_job(resume_tick, id="tick_resume", replace_existing=True,
+                          kwargs={"bot": bot, "on_route_deleted": _on_route_deleted, "shard": shard})
+    if not leased and (not shard or shard[0] == 0):
+        # Expired routes: once now, then every night just after midnight in Tashkent
+        scheduler.add_job(sweep_expired_routes, id="sweep_startup", replace_existing=True)
+        scheduler.add_job(sweep_expired_routes, "cron", hour=0, minute=0, second=5, timezone=TZ_UZ,
+                          id="sweep_expired", replace_existing=True, max_instances=1, coalesce=True)
     scheduler.start()
-    logger.info("Scheduler started.")
+    if leased:
+        logger.info("Scheduler started (worker %s, %d slots held).", leases.WORKER_ID, len(leases.owned()))
+    elif shard:
+        logger.info("Scheduler started (shard %d/%d).", shard[0], shard[1])
+    else:
+        logger.info("Scheduler started.")
+    return scheduler
+
+async def stop_scheduler(scheduler: AsyncIOScheduler) -> None:
+    """No new jobs; the running tick gets SHUTDOWN_TIMEOUT to finish its current user."""
+    scheduler.shutdown(wait=False)
+    await drain_tick(SHUTDOWN_TIMEOUT)
+
+async def wait_for_shutdown() -> None:
+    """Block until SIGTERM (docker stop) or SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    logger.info("Shutdown signal received")
+
+async def start_api(on_lang_change, on_route_change, bot: Bot = None, reuse_port: bool = False,
+                    webhook=None, port: int = API_PORT) -> web.AppRunner:
+    from api_server import create_app as create_api_app
 
     api_runner = web.AppRunner(create_api_app(
         bot=bot,
-        on_lang_change=refresh_keyboard,
-        on_route_change=refresh_keyboard_routes,
+        on_lang_change=on_lang_change,
+        on_route_change=on_route_change,
+        webhook=webhook,
     ))
     await api_runner.setup()
-    await web.TCPSite(api_runner, "0.0.0.0", API_PORT).start()
-    logger.info("API server listening on port %d", API_PORT)
+    await web.TCPSite(api_runner, "0.0.0.0", port, reuse_port=reuse_port).start()
+    logger.info("API server listening on port %d", port)
+    return api_runner
+
+def make_webhook(dp: Dispatcher, bot: Bot):
+    from webhook import WebhookQueue
+    return WebhookQueue(dp, bot, WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE,
+                        drain_timeout=SHUTDOWN_TIMEOUT)
+
+async def set_webhook(dp: Dispatcher, bot: Bot) -> None:
+    await bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_WORKERS,
+    )
+    logger.info("Webhook set: %s%s", WEBHOOK_URL, WEBHOOK_PATH)
+
+def make_bot() -> Bot:
+    session = None
+    if TELEGRAM_API_URL:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    bot.session.middleware(KeyboardTrackingMiddleware())
+    return bot
+
+async def start_metrics_server(reuse_port: bool = False):
+    """/metrics on METRICS_PORT; the public API port serves it only with METRICS_TOKEN."""
+    if not METRICS_PORT:
+        return None
+    from api_server import create_metrics_app
+    runner = web.AppRunner(create_metrics_app())
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", METRICS_PORT, reuse_port=reuse_port).start()
+    logger.info("Metrics listening on port %d", METRICS_PORT)
+    return runner
+
+def _bind_route_deleted(bot: Bot) -> None:
+    global _on_route_deleted
+    _on_route_deleted = functools.partial(refresh_keyboard_routes, bot)
+
+async def warm_start() -> None:
+    """
+    Schema check (a no-op when current), then the station catalogue, user
+    cache and upstream HTTP pool are loaded concurrently.
+    """
+    start = time.perf_counter()
+    await init_db()
+    results = await asyncio.gather(station_catalogue.load(), preload_users(), warmup_upstream(), return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            logger.warning("Startup warmup step failed: %s", r)
+    logger.info("Warm start done in %.0f ms", (time.perf_counter() - start) * 1000)
 
+async def main():
+    """All roles (poller, scheduler, API) in one event loop."""
+    logger.info("Starting bot...")
+    bot = make_bot()
+    dp = build_dispatcher()
+    await asyncio.gather(warm_start(), setup_menu_button(bot))
+
+    _bind_route_deleted(bot)
+    scheduler = start_scheduler(bot)
+    webhook = make_webhook(dp, bot) if BOT_MODE == "webhook" else None
+    api_runner = await start_api(
+        on_lang_change=functools.partial(refresh_keyboard, bot),
+        on_route_change=_on_route_deleted,
+        bot=bot,
+        webhook=webhook,
+    )
+    metrics_runner = await start_metrics_server()
+
+    try:
+        if webhook:
+            await set_webhook(dp, bot)
+            await wait_for_shutdown()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)  # returns on SIGTERM / SIGINT
+    finally:
+        # API stops accepting requests and drains queued webhook updates while the tick drains
+        await asyncio.gather(stop_scheduler(scheduler), api_runner.cleanup())
+        await drain_keyboard_refreshes()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_client()
+        await bot.session.close()
+
+async def run_poller():
+    """Telegram updates only (polling, or the webhook endpoint on WEBHOOK_PORT); no scheduler tick."""
+    logger.info("Starting poller...")
+    bot = make_bot()
+    dp = build_dispatcher()
+    await asyncio.gather(warm_start(), setup_menu_button(bot))
+    _bind_route_deleted(bot)
+    metrics_runner = await start_metrics_server()
+    if BOT_MODE != "webhook":
+        try:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+        finally:
+            await drain_keyboard_refreshes()
+            if metrics_runner:
+                await metrics_runner.cleanup()
+            await close_client()
+        return
+    runner = await start_api(
+        enqueue_lang_change, enqueue_route_change, bot=bot,
+        webhook=make_webhook(dp, bot), port=WEBHOOK_PORT,
+    )
+    try:
+        await set_webhook(dp, bot)
+        await wait_for_shutdown()
+    finally:
+        await runner.cleanup()
+        await drain_keyboard_refreshes()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_client()
+        await bot.session.close()
+
+async def run_scheduler(shard=None, leased: bool = False):
+    """Scheduler tick and task queue worker; sends through the Bot API without polling."""
+    logger.info("Starting scheduler worker...")
+    await warm_start()
+    bot = make_bot()
+    _bind_route_deleted(bot)
+    if leased:
+        await leases.heartbeat()
+    scheduler = start_scheduler(bot, shard=shard, leased=leased)
+    metrics_runner = await start_metrics_server()
+    try:
+        await wait_for_shutdown()
+    finally:
+        await stop_scheduler(scheduler)
+        if leased:
+            await leases.release()
+        await drain_keyboard_refreshes()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_client()
+        await bot.session.close()
+
+async def run_api(reuse_port: bool = False):
+    """Mini App API only; keyboard refreshes are queued for the scheduler worker."""
+    logger.info("Starting API worker...")
+    await warm_start()
+    api_runner = await start_api(enqueue_lang_change, enqueue_route_change, reuse_port=reuse_port)
+    # Several API workers share METRICS_PORT like API_PORT; each scrape reaches one of them
+    metrics_runner = await start_metrics_server(reuse_port=reuse_port)
     try:
-        await dp.start_polling(bot)
+        await wait_for_shutdown()
     finally:
         await api_runner.cleanup()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_client()
+
+def _run_api_worker() -> None:
+    asyncio.run(run_api(reuse_port=True))
+
+def _parse_shard(value: str):
+    # "0/4" -> (0, 4)
+    idx, _, count = value.partition("/")
+    idx, count = int(idx), int(count)
+    if count < 1 or not 0 <= idx < count:
+        raise argparse.ArgumentTypeError("shard must be INDEX/COUNT with 0 <= INDEX < COUNT")
+    return idx, count
+
+def cli(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Railway tickets bot")
+    parser.add_argument("role", nargs="?", default="all", choices=["all", "poller", "scheduler", "api"])
+    parser.add_argument("--shard", type=_parse_shard, default=None,
+                        help="scheduler only: check routes of shard INDEX/COUNT")
+    parser.add_argument("--leases", action="store_true",
+                        help="scheduler only: share routes with the other --leases workers, rebalanced as they come and go")
+    parser.add_argument("--workers", type=int, default=API_WORKERS,
+                        help="api only: number of processes sharing API_PORT")
+    args = parser.parse_args(argv)
+    if args.leases and args.shard:
+        parser.error("--leases and --shard are alternatives")
 
-if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if args.role == "poller":
+            asyncio.run(run_poller())
+        elif args.role == "scheduler":
+            asyncio.run(run_scheduler(shard=args.shard, leased=args.leases))
+        elif args.role == "api" and args.workers > 1:
+            import multiprocessing
+            procs = [multiprocessing.Process(target=_run_api_worker, daemon=True) for _ in range(args.workers)]
+            for p in procs:
+                p.start()
+            # Pass SIGTERM on so every worker shuts down cleanly
+            signal.signal(signal.SIGTERM, lambda signum, frame: [p.terminate() for p in procs])
+            for p in procs:
+                p.join()
+        elif args.role == "api":
+            asyncio.run(run_api())
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped.")
+
+if __name__ == "__main__":
+    cli()
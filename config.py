@@ -1,3 +1,4 @@
+import hashlib
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -11,12 +12,100 @@ if not BOT_TOKEN:
 
 DB_PATH = os.getenv("DB_PATH", "db.sqlite3")
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "").strip().upper() or "INFO"
+LOG_FILE = os.getenv("LOG_FILE", "railway_bot.log")
+
+# Local Bot API server (https://github.com/tdlib/telegram-bot-api) base URL; empty = api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip().rstrip("/")
+
 # Telegram Mini App
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://railway-bot.netlify.app").strip()
 API_PORT   = int(os.getenv("API_PORT", "8080"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+
+# FSM storage: "sqlite" (persisted in DB_PATH) or "memory" (aiogram default)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower()
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 3600)))          # idle seconds before a state expires
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))   # states kept in memory
+
+# Bot updates: "polling" (getUpdates) or "webhook" (served by the API app)
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")   # public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", str(API_PORT)))     # used by the standalone poller role
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip() or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))          # updates processed concurrently
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")) # pending updates before answering 429
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_URL")
+
+# /metrics: served on METRICS_PORT (internal, 0 disables) by every role, and on the public API
+# port only when METRICS_TOKEN is set, behind that bearer token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Scheduler tracing: JSON lines per tick ("" disables); cProfile dump for ticks slower than the threshold (0 disables)
+TRACE_PATH = os.getenv("TRACE_PATH", "").strip()
+PROFILE_TICK_THRESHOLD = float(os.getenv("PROFILE_TICK_THRESHOLD", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# How often the scheduler worker drains the cross-process task queue (seconds)
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "2"))
+
+# Shutdown (SIGTERM): how long the running tick and queued webhook updates may take to finish (seconds)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "10"))
+
+# Scheduler ticks run every TICK_INTERVAL seconds, TICK_OFFSET seconds past each multiple
+# of it (:00:30, :05:30, ... by default); a checked route is due again half an interval later
+TICK_INTERVAL = int(os.getenv("TICK_INTERVAL", "300"))
+TICK_OFFSET = int(os.getenv("TICK_OFFSET", "30"))
+
+# Startup: first scheduler tick waits this long so warmup finishes first (seconds)
+FIRST_TICK_DELAY = float(os.getenv("FIRST_TICK_DELAY", "30"))
+
+# Scheduler workers started with --leases split routes between them: routes hash into
+# LEASE_SLOTS slots, each owned by one live worker for LEASE_TTL seconds and renewed by
+# a heartbeat every LEASE_TTL / 3; a dead worker's slots move to the others after LEASE_TTL
+LEASE_SLOTS = int(os.getenv("LEASE_SLOTS", "64"))
+LEASE_TTL = int(os.getenv("LEASE_TTL", "60"))
+# User profiles are cached in-process; changes made by other processes show up after this (seconds)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Upstream (eticket) HTTP pool shared by all requests of a process
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))   # idle seconds before a pooled connection is closed
+HTTP_WARMUP_CONNECTIONS = int(os.getenv("HTTP_WARMUP_CONNECTIONS", "2"))   # per upstream host, opened at startup
+# Trains requests running at once; the rest wait in line, manual checks ahead of scheduler ticks
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", str(HTTP_POOL_SIZE)))
+
+# Rendered route messages kept for reuse by subscribers of the same route and language
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "1024"))
+
+# Trains are fetched in this language once per (from, to, date) and localised per user from the
+# station catalogue and texts.TYPE_NAMES; a response is shared for TRAINS_CACHE_TTL seconds
+UPSTREAM_LANG = os.getenv("UPSTREAM_LANG", "ru").strip()
+TRAINS_CACHE_TTL = float(os.getenv("TRAINS_CACHE_TTL", "60"))
+
+# Manual checks ("Проверить маршруты", Mini App) answer from a route's stored result when it is
+# younger than this many seconds (0 = always fetch); CHECK_REFRESH=1 then fetches anew in the
+# background and edits the bot's message if anything changed
+CHECK_MAX_AGE = int(os.getenv("CHECK_MAX_AGE", "120"))
+CHECK_REFRESH = os.getenv("CHECK_REFRESH", "1").strip() == "1"
+# Keyboard refreshes after route / language changes outside the chat: requests for a user
+# within this many seconds are merged into one message
+KEYBOARD_DEBOUNCE = float(os.getenv("KEYBOARD_DEBOUNCE", "2.0"))
+# Manual checks post a placeholder and edit it as routes finish, at most once per this many seconds
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "1.0"))
+
+# "Every 30 minutes" mode: "no tickets" reminders go out on boundaries of this many seconds
+NOTIFY_INTERVAL = int(os.getenv("NOTIFY_INTERVAL", "1800"))
+
+# Routes per user; a route may cover a date range of up to MAX_RANGE_DAYS days (checked day by day)
+MAX_ROUTES = int(os.getenv("MAX_ROUTES", "5"))
+MAX_RANGE_DAYS = int(os.getenv("MAX_RANGE_DAYS", "7"))
 
-STATIONS_API = "https://eticket.railway.uz/api/v1/handbook/stations/list"
-TRAINS_API = "https://eticket.railway.uz/api/v3/handbook/trains/list"
+STATIONS_API = os.getenv("STATIONS_API", "https://eticket.railway.uz/api/v1/handbook/stations/list")
+TRAINS_API = os.getenv("TRAINS_API", "https://eticket.railway.uz/api/v3/handbook/trains/list")
 
 ETICKET_XSRF = os.getenv("ETICKET_XSRF", "").strip()
 ETICKET_COOKIE = os.getenv("ETICKET_COOKIE", "").strip()
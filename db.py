@@ -1,20 +1,43 @@
+import json
+import time
 import aiosqlite
 from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
-from config import DB_PATH
+from config import DB_PATH, USER_CACHE_TTL, NOTIFY_INTERVAL
+from metrics import Histogram, Counter, timed
+
+DB_SECONDS = Histogram("railway_db_call_seconds", "Time spent in db.* calls", ("op",))
+DB_ERRORS = Counter("railway_db_errors_total", "db.* calls that raised", ("op",))
+_timed = timed(DB_SECONDS, DB_ERRORS)
+
+# Stored in PRAGMA user_version once init_db has brought the file up to date.
+# Bump it with every change to the tables or migrations below.
+SCHEMA_VERSION = 10
+
+# telegram_id -> (user row, cached at); see get_user
+_users: Dict[int, Tuple[Dict[str, Any], float]] = {}
 
 def now_iso() -> str:
     return datetime.now().isoformat(timespec="seconds")
 
+def next_notify_at(after: float) -> int:
+    # First NOTIFY_INTERVAL boundary (:00 / :30 by default) after `after`, as a unix epoch
+    return (int(after) // NOTIFY_INTERVAL + 1) * NOTIFY_INTERVAL
+
+@_timed
 async def init_db() -> None:
     async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("PRAGMA user_version")
+        if (await cur.fetchone())[0] >= SCHEMA_VERSION:
+            return
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 telegram_id INTEGER PRIMARY KEY,
                 language TEXT NOT NULL DEFAULT 'ru',
                 notify_mode TEXT NOT NULL DEFAULT 'always',
                 created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
+                updated_at TEXT NOT NULL,
+                keyboard TEXT  -- "lang:has_routes" of the last main keyboard sent; NULL = unknown
             )
         """)
         await db.execute("PRAGMA journal_mode=WAL;")
@@ -27,6 +50,9 @@ async def init_db() -> None:
                 to_code TEXT NOT NULL,
                 to_name TEXT NOT NULL,
                 travel_date TEXT NOT NULL,   -- YYYY-MM-DD
+                travel_date_to TEXT,         -- last day of a date range; NULL = travel_date only
+                return_date TEXT,            -- round trip: way back (to -> from) on this day; NULL = one way
+                filters TEXT,                -- JSON, see scheduler.compile_filters; NULL = any seat
                 created_at TEXT NOT NULL,
                 updated_at TEXT NOT NULL,
                 FOREIGN KEY(telegram_id) REFERENCES users(telegram_id)
@@ -39,9 +65,65 @@ async def init_db() -> None:
                 last_checked_at TEXT,
                 notifications_sent INTEGER NOT NULL DEFAULT 0,
                 last_notified_at TEXT,
+                next_check_at INTEGER NOT NULL DEFAULT 0,  -- unix epoch; scheduler ticks pick up routes due by their start
+                next_notify_at INTEGER,                     -- unix epoch of the next "no tickets" reminder; NULL = none
+                last_result TEXT,                           -- JSON, scheduler.route_result() of the last fetch
+                last_fetched_at INTEGER,                    -- unix epoch of that fetch
                 FOREIGN KEY(route_id) REFERENCES routes(id)
             )
         """)
+        for column in ("travel_date_to", "return_date", "filters"):
+            try:
+                await db.execute(f"ALTER TABLE routes ADD COLUMN {column} TEXT")
+            except Exception:
+                pass
+        # Expiry sweeper looks routes up by their last day
+        await db.execute("DROP INDEX IF EXISTS idx_routes_travel_date")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_routes_last_date ON routes(COALESCE(travel_date_to, travel_date))")
+        # Cross-process work queue (API / poller -> scheduler worker)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                telegram_id INTEGER NOT NULL,
+                payload TEXT,
+                created_at TEXT NOT NULL
+            )
+        """)
+        # Persistent aiogram FSM (see fsm_storage.py); updated_at is a unix epoch
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                updated_at INTEGER NOT NULL
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at)")
+        # Scheduler workers in lease mode (see leases.py): who is alive, and which slot
+        # of routes each one owns until expires_at (unix epochs)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS scheduler_workers (
+                worker TEXT PRIMARY KEY,
+                seen_at INTEGER NOT NULL
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS shard_leases (
+                slot INTEGER PRIMARY KEY,
+                worker TEXT NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+        """)
+        # Station catalogue: code -> localized name, filled from stations API responses
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS stations (
+                code TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (code, lang)
+            )
+        """)
         # Migration for existing table
         try:
             await db.execute("ALTER TABLE route_state ADD COLUMN notifications_sent INTEGER NOT NULL DEFAULT 0")
@@ -51,8 +133,33 @@ async def init_db() -> None:
             await db.execute("ALTER TABLE route_state ADD COLUMN last_notified_at TEXT")
         except Exception:
             pass
+        try:
+            await db.execute("ALTER TABLE route_state ADD COLUMN next_check_at INTEGER NOT NULL DEFAULT 0")
+            await db.execute("ALTER TABLE route_state ADD COLUMN next_notify_at INTEGER")
+            # last_notified_at is local time
+            await db.execute(
+                "UPDATE route_state SET next_notify_at = (CAST(strftime('%s', last_notified_at, 'utc') AS INTEGER) / ? + 1) * ? "
+                "WHERE last_notified_at IS NOT NULL",
+                (NOTIFY_INTERVAL, NOTIFY_INTERVAL)
+            )
+        except Exception:
+            pass
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_route_state_next_check ON route_state(next_check_at)")
+        try:
+            await db.execute("ALTER TABLE users ADD COLUMN keyboard TEXT")
+        except Exception:
+            pass
+        try:
+            await db.execute("ALTER TABLE route_state ADD COLUMN last_result TEXT")
+            await db.execute("ALTER TABLE route_state ADD COLUMN last_fetched_at INTEGER")
+        except Exception:
+            pass
+        # Interrupted ticks resume from route_state.next_check_at now
+        await db.execute("DROP TABLE IF EXISTS tick_checkpoint")
+        await db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
         await db.commit()
 
+@_timed
 async def ensure_user(telegram_id: int) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute("SELECT telegram_id FROM users WHERE telegram_id=?", (telegram_id,))
@@ -65,7 +172,16 @@ async def ensure_user(telegram_id: int) -> None:
             )
             await db.commit()
 
+@_timed
 async def get_user(telegram_id: int) -> Dict[str, Any]:
+    # Cached for USER_CACHE_TTL: writes from this process update the cache,
+    # writes from other processes (API workers) show up once it expires
+    hit = _users.get(telegram_id)
+    if hit is not None and time.monotonic() - hit[1] < USER_CACHE_TTL:
+        return dict(hit[0])
+    return dict(await _load_user(telegram_id))
+
+async def _load_user(telegram_id: int) -> Dict[str, Any]:
     await ensure_user(telegram_id)
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
@@ -73,8 +189,31 @@ async def get_user(telegram_id: int) -> Dict[str, Any]:
             (telegram_id,)
         )
         row = await cur.fetchone()
-        return {"telegram_id": row[0], "language": row[1], "notify_mode": row[2]}
+        user = {"telegram_id": row[0], "language": row[1], "notify_mode": row[2]}
+    _users[telegram_id] = (user, time.monotonic())
+    return user
 
+@_timed
+async def preload_users() -> int:
+    """Fill the user cache from disk in one query (startup warmup)."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT telegram_id, language, notify_mode FROM users")
+        rows = await cur.fetchall()
+    now = time.monotonic()
+    for r in rows:
+        _users[r[0]] = ({"telegram_id": r[0], "language": r[1], "notify_mode": r[2]}, now)
+    return len(rows)
+
+def forget_user(telegram_id: int) -> None:
+    """Drop a cached profile changed by another process."""
+    _users.pop(telegram_id, None)
+
+def _update_cached_user(telegram_id: int, field: str, value: str) -> None:
+    hit = _users.get(telegram_id)
+    if hit is not None:
+        hit[0][field] = value
+
+@_timed
 async def set_language(telegram_id: int, lang: str) -> None:
     await ensure_user(telegram_id)
     async with aiosqlite.connect(DB_PATH) as db:
@@ -83,7 +222,9 @@ async def set_language(telegram_id: int, lang: str) -> None:
             (lang, now_iso(), telegram_id)
         )
         await db.commit()
+    _update_cached_user(telegram_id, "language", lang)
 
+@_timed
 async def set_notify_mode(telegram_id: int, mode: str) -> None:
     await ensure_user(telegram_id)
     async with aiosqlite.connect(DB_PATH) as db:
@@ -92,17 +233,39 @@ async def set_notify_mode(telegram_id: int, mode: str) -> None:
             (mode, now_iso(), telegram_id)
         )
         await db.commit()
+    _update_cached_user(telegram_id, "notify_mode", mode)
 
+@_timed
 async def count_routes(telegram_id: int) -> int:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute("SELECT COUNT(*) FROM routes WHERE telegram_id=?", (telegram_id,))
         (cnt,) = await cur.fetchone()
         return int(cnt)
 
+@_timed
+async def get_keyboard_state(telegram_id: int) -> Optional[Tuple[str, int, Optional[str]]]:
+    # (language, route count, last main keyboard sent) in one read, for the keyboard refresh; None = no such user
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "SELECT language, (SELECT COUNT(*) FROM routes WHERE telegram_id=?), keyboard FROM users WHERE telegram_id=?",
+            (telegram_id, telegram_id)
+        )
+        row = await cur.fetchone()
+    return (row[0], int(row[1]), row[2]) if row else None
+
+@_timed
+async def set_keyboard_state(telegram_id: int, keyboard: str) -> None:
+    # A no-op (nothing written) when the stored keyboard is already this one
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("UPDATE users SET keyboard=? WHERE telegram_id=? AND keyboard IS NOT ?",
+                         (keyboard, telegram_id, keyboard))
+        await db.commit()
+
+@_timed
 async def list_routes(telegram_id: int) -> List[Dict[str, Any]]:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
-            "SELECT id, from_code, from_name, to_code, to_name, travel_date FROM routes WHERE telegram_id=? ORDER BY id ASC",
+            "SELECT id, from_code, from_name, to_code, to_name, travel_date, travel_date_to, return_date, filters FROM routes WHERE telegram_id=? ORDER BY id ASC",
             (telegram_id,)
         )
         rows = await cur.fetchall()
@@ -115,76 +278,172 @@ async def list_routes(telegram_id: int) -> List[Dict[str, Any]]:
             "to_code": r[3],
             "to_name": r[4],
             "travel_date": r[5],
+            "travel_date_to": r[6],
+            "return_date": r[7],
+            "filters": json.loads(r[8]) if r[8] else {},
         })
     return out
 
-async def add_route(telegram_id: int, from_code: str, from_name: str, to_code: str, to_name: str, travel_date: str) -> int:
+@_timed
+async def add_route(telegram_id: int, from_code: str, from_name: str, to_code: str, to_name: str, travel_date: str, travel_date_to: Optional[str] = None, return_date: Optional[str] = None, filters: Optional[Dict[str, Any]] = None) -> int:
     ts = now_iso()
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
-            """INSERT INTO routes (telegram_id, from_code, from_name, to_code, to_name, travel_date, created_at, updated_at)
-               VALUES (?,?,?,?,?,?,?,?)""",
-            (telegram_id, from_code, from_name, to_code, to_name, travel_date, ts, ts)
+            """INSERT INTO routes (telegram_id, from_code, from_name, to_code, to_name, travel_date, travel_date_to, return_date, filters, created_at, updated_at)
+               VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
+            (telegram_id, from_code, from_name, to_code, to_name, travel_date, travel_date_to, return_date,
+             json.dumps(filters, ensure_ascii=False) if filters else None, ts, ts)
         )
         await db.commit()
         route_id = cur.lastrowid
         # Initialize route_state with current time for last_notified_at to prevent immediate notification
         await db.execute(
-            "INSERT OR IGNORE INTO route_state (route_id, last_available, last_notified_at) VALUES (?,0,?)", 
-            (route_id, ts)
+            "INSERT OR IGNORE INTO route_state (route_id, last_available, last_notified_at, next_notify_at) VALUES (?,0,?,?)", 
+            (route_id, ts, next_notify_at(time.time()))
         )
         await db.commit()
         return int(route_id)
 
-async def update_route_field(route_id: int, field: str, value: str) -> None:
-    if field not in {"from_code", "from_name", "to_code", "to_name", "travel_date"}:
+@_timed
+async def update_route_field(route_id: int, field: str, value: Optional[str]) -> None:
+    if field not in {"from_code", "from_name", "to_code", "to_name", "travel_date", "travel_date_to", "return_date"}:
         raise ValueError("Bad field")
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute(
             f"UPDATE routes SET {field}=?, updated_at=? WHERE id=?",
             (value, now_iso(), route_id)
         )
+        if field not in ("from_name", "to_name"):
+            # The stored result was fetched for the old stations / dates
+            await db.execute("UPDATE route_state SET last_result=NULL, last_fetched_at=NULL WHERE route_id=?", (route_id,))
+        await db.commit()
+
+@_timed
+async def set_route_filters(route_id: int, filters: Optional[Dict[str, Any]]) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE routes SET filters=?, updated_at=? WHERE id=?",
+            (json.dumps(filters, ensure_ascii=False) if filters else None, now_iso(), route_id)
+        )
+        await db.execute("UPDATE route_state SET last_result=NULL, last_fetched_at=NULL WHERE route_id=?", (route_id,))
         await db.commit()
 
+@_timed
 async def delete_route(route_id: int) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("DELETE FROM route_state WHERE route_id=?", (route_id,))
         await db.execute("DELETE FROM routes WHERE id=?", (route_id,))
         await db.commit()
 
+@_timed
 async def update_last_notified(route_id: int):
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE route_state SET last_notified_at=? WHERE route_id=?", (now_iso(), route_id))
+        await db.execute(
+            "UPDATE route_state SET last_notified_at=?, next_notify_at=? WHERE route_id=?",
+            (now_iso(), next_notify_at(time.time()), route_id)
+        )
         await db.commit()
 
-async def get_route_state(route_id: int) -> Tuple[int, str, int, str]:
+@_timed
+async def get_route_state(route_id: int) -> Tuple[int, str, int, Optional[int]]:
+    # (last_available, last_checked_at, notifications_sent, next_notify_at)
     async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT last_available, last_checked_at, notifications_sent, last_notified_at FROM route_state WHERE route_id=?", (route_id,))
+        cur = await db.execute("SELECT last_available, last_checked_at, notifications_sent, next_notify_at FROM route_state WHERE route_id=?", (route_id,))
         row = await cur.fetchone()
         if not row: return (0, None, 0, None)
         return (row[0], row[1], row[2], row[3])
 
-async def set_route_state(route_id: int, available: bool):
-    # This keeps existing values for others
-    # Actually we should use UPSERT logic properly or read-modify-write if UPSERT is complex for partial.
-    # But here we just want to update last_available and last_checked_at.
+@_timed
+async def set_route_state(route_id: int, available: bool, next_check_at: Optional[int] = None,
+                          result: Optional[Dict[str, Any]] = None, fetched_at: Optional[int] = None):
+    # Updates last_available and last_checked_at, next_check_at when given (scheduler ticks)
+    # and the stored result when the check fetched a new one
     now = now_iso()
+    result_json = json.dumps(result, ensure_ascii=False, separators=(",", ":")) if result is not None else None
     async with aiosqlite.connect(DB_PATH) as db:
         # Check existence
         cur = await db.execute("SELECT 1 FROM route_state WHERE route_id=?", (route_id,))
         exists = await cur.fetchone()
         if exists:
-            await db.execute("UPDATE route_state SET last_available=?, last_checked_at=? WHERE route_id=?", (1 if available else 0, now, route_id))
+            await db.execute(
+                "UPDATE route_state SET last_available=?, last_checked_at=?, next_check_at=COALESCE(?, next_check_at), "
+                "last_result=COALESCE(?, last_result), last_fetched_at=COALESCE(?, last_fetched_at) WHERE route_id=?",
+                (1 if available else 0, now, next_check_at, result_json, result_json and fetched_at, route_id)
+            )
         else:
-            await db.execute("INSERT INTO route_state(route_id, last_available, last_checked_at) VALUES (?,?,?)", (route_id, 1 if available else 0, now))
+            await db.execute(
+                "INSERT INTO route_state(route_id, last_available, last_checked_at, next_check_at, last_result, last_fetched_at) "
+                "VALUES (?,?,?,?,?,?)",
+                (route_id, 1 if available else 0, now, next_check_at or 0, result_json, result_json and fetched_at)
+            )
         await db.commit()
 
+@_timed
+async def save_route_result(route_id: int, result: Dict[str, Any], fetched_at: int) -> None:
+    # A fetch outside the scheduler (Mini App check): result only, notification state untouched
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE route_state SET last_result=?, last_fetched_at=? WHERE route_id=?",
+            (json.dumps(result, ensure_ascii=False, separators=(",", ":")), fetched_at, route_id)
+        )
+        await db.commit()
+
+@_timed
+async def get_route_results(telegram_id: int, fetched_since: int) -> Dict[int, Tuple[Dict[str, Any], int]]:
+    """route_id -> (stored result, fetched at) for the user's routes fetched at or after fetched_since."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            """SELECT s.route_id, s.last_result, s.last_fetched_at FROM route_state s
+               JOIN routes r ON r.id = s.route_id
+               WHERE r.telegram_id=? AND s.last_fetched_at >= ? AND s.last_result IS NOT NULL""",
+            (telegram_id, fetched_since)
+        )
+        rows = await cur.fetchall()
+    return {r[0]: (json.loads(r[1]), r[2]) for r in rows}
+
+@_timed
+async def list_due_routes(due_by: int) -> List[Dict[str, Any]]:
+    """
+    Every route with next_check_at <= due_by, with its user's language and
+    notify mode and its route_state, ordered by telegram_id then id.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            """SELECT r.id, r.from_code, r.from_name, r.to_code, r.to_name, r.travel_date, r.travel_date_to,
+                      r.return_date, r.filters, r.telegram_id, u.language, u.notify_mode,
+                      s.last_available, s.last_checked_at, s.notifications_sent, s.next_notify_at
+               FROM route_state s
+               JOIN routes r ON r.id = s.route_id
+               JOIN users u ON u.telegram_id = r.telegram_id
+               WHERE s.next_check_at <= ?
+               ORDER BY r.telegram_id, r.id""",
+            (due_by,)
+        )
+        rows = await cur.fetchall()
+    return [{
+        "id": r[0],
+        "from_code": r[1],
+        "from_name": r[2],
+        "to_code": r[3],
+        "to_name": r[4],
+        "travel_date": r[5],
+        "travel_date_to": r[6],
+        "return_date": r[7],
+        "filters": json.loads(r[8]) if r[8] else {},
+        "telegram_id": r[9],
+        "language": r[10],
+        "notify_mode": r[11],
+        "state": (r[12], r[13], r[14], r[15]),
+    } for r in rows]
+
+@_timed
 async def get_notification_count(route_id: int) -> int:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute("SELECT notifications_sent FROM route_state WHERE route_id=?", (route_id,))
         row = await cur.fetchone()
         return row[0] if row else 0
 
+@_timed
 async def increment_notification_count(route_id: int) -> int:
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("UPDATE route_state SET notifications_sent = notifications_sent + 1 WHERE route_id=?", (route_id,))
@@ -193,13 +452,196 @@ async def increment_notification_count(route_id: int) -> int:
         row = await cur.fetchone()
         return row[0] if row else 0
 
+@_timed
 async def reset_notification_count(route_id: int):
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("UPDATE route_state SET notifications_sent=0 WHERE route_id=?", (route_id,))
         await db.commit()
 
+@_timed
 async def list_users() -> List[int]:
     async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT telegram_id FROM users")
+        cur = await db.execute("SELECT telegram_id FROM users ORDER BY telegram_id")
         rows = await cur.fetchall()
     return [int(r[0]) for r in rows]
+
+
+@_timed
+async def enqueue_task(kind: str, telegram_id: int, payload: Optional[Dict[str, Any]] = None) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "INSERT INTO tasks (kind, telegram_id, payload, created_at) VALUES (?,?,?,?)",
+            (kind, telegram_id, json.dumps(payload or {}), now_iso())
+        )
+        await db.commit()
+
+@_timed
+async def pop_tasks(limit: int = 50) -> List[Dict[str, Any]]:
+    # Claim and remove in one write transaction so two workers never run the same task
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute(
+            "SELECT id, kind, telegram_id, payload FROM tasks ORDER BY id ASC LIMIT ?",
+            (limit,)
+        )
+        rows = await cur.fetchall()
+        if rows:
+            await db.executemany("DELETE FROM tasks WHERE id=?", [(r[0],) for r in rows])
+        await db.commit()
+    return [
+        {"id": r[0], "kind": r[1], "telegram_id": int(r[2]), "payload": json.loads(r[3] or "{}")}
+        for r in rows
+    ]
+
+@_timed
+async def expire_routes(before: str) -> int:
+    """
+    Delete every route whose last day (travel_date_to, else travel_date; a
+    round trip ends with its way out) is before `before` (YYYY-MM-DD) and
+    queue a "route_expired" task for each, all in one transaction. Returns the count.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute(
+            "SELECT telegram_id, from_name, to_name, travel_date, travel_date_to, return_date FROM routes WHERE COALESCE(travel_date_to, travel_date) < ?",
+            (before,)
+        )
+        rows = await cur.fetchall()
+        if rows:
+            ts = now_iso()
+            await db.executemany(
+                "INSERT INTO tasks (kind, telegram_id, payload, created_at) VALUES (?,?,?,?)",
+                [("route_expired", r[0], json.dumps({"from_name": r[1], "to_name": r[2], "travel_date": r[3], "travel_date_to": r[4], "return_date": r[5]}), ts)
+                 for r in rows]
+            )
+            await db.execute(
+                "DELETE FROM route_state WHERE route_id IN (SELECT id FROM routes WHERE COALESCE(travel_date_to, travel_date) < ?)",
+                (before,)
+            )
+            await db.execute("DELETE FROM routes WHERE COALESCE(travel_date_to, travel_date) < ?", (before,))
+        await db.commit()
+    return len(rows)
+
+@_timed
+async def checked_since(since: int) -> bool:
+    """Whether a scheduler tick has checked any route since `since` (next_check_at moved past it)."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT 1 FROM route_state WHERE next_check_at > ? LIMIT 1", (since,))
+        return await cur.fetchone() is not None
+
+@_timed
+async def renew_leases(worker: str, slots: int, ttl: int, now: int) -> List[int]:
+    """
+    One lease-mode heartbeat, in one write transaction: mark the worker
+    alive, extend its leases to now + ttl, then even out ownership - give up
+    slots beyond its fair share of the live workers, or take free and
+    expired ones up to it. Returns the slots the worker now owns.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await db.execute(
+            "INSERT INTO scheduler_workers (worker, seen_at) VALUES (?,?) ON CONFLICT(worker) DO UPDATE SET seen_at=excluded.seen_at",
+            (worker, now)
+        )
+        await db.execute("DELETE FROM scheduler_workers WHERE seen_at < ?", (now - ttl,))
+        cur = await db.execute("SELECT COUNT(*) FROM scheduler_workers")
+        (live,) = await cur.fetchone()
+        share = -(-slots // live)
+        await db.execute("UPDATE shard_leases SET expires_at=? WHERE worker=?", (now + ttl, worker))
+        cur = await db.execute("SELECT slot FROM shard_leases WHERE worker=? ORDER BY slot", (worker,))
+        mine = [r[0] for r in await cur.fetchall()]
+        if len(mine) > share:
+            await db.executemany("DELETE FROM shard_leases WHERE slot=?", [(slot,) for slot in mine[share:]])
+            mine = mine[:share]
+        elif len(mine) < share:
+            cur = await db.execute("SELECT slot FROM shard_leases WHERE expires_at >= ?", (now,))
+            taken = {r[0] for r in await cur.fetchall()}
+            free = [slot for slot in range(slots) if slot not in taken][:share - len(mine)]
+            await db.executemany(
+                "INSERT OR REPLACE INTO shard_leases (slot, worker, expires_at) VALUES (?,?,?)",
+                [(slot, worker, now + ttl) for slot in free]
+            )
+            mine = sorted(mine + free)
+        await db.commit()
+    return mine
+
+@_timed
+async def release_leases(worker: str) -> None:
+    # Clean shutdown: the other workers take the slots over on their next heartbeat
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("DELETE FROM shard_leases WHERE worker=?", (worker,))
+        await db.execute("DELETE FROM scheduler_workers WHERE worker=?", (worker,))
+        await db.commit()
+
+@_timed
+async def claim_due_routes(route_ids: List[int], due_by: int, hold_until: int) -> Dict[int, Tuple]:
+    """
+    Hold those routes still due by due_by until hold_until (release_routes
+    when checked) and return their current route_state, so each route is
+    checked by one worker at a time even while its slot changes hands.
+    """
+    if not route_ids:
+        return {}
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            f"UPDATE route_state SET next_check_at=? WHERE next_check_at <= ? AND route_id IN ({','.join('?' * len(route_ids))}) "
+            "RETURNING route_id, last_available, last_checked_at, notifications_sent, next_notify_at",
+            (hold_until, due_by, *route_ids)
+        )
+        claimed = {r[0]: tuple(r[1:]) for r in await cur.fetchall()}
+        await db.commit()
+    return claimed
+
+@_timed
+async def release_routes(route_ids: List[int], next_check_at: int) -> None:
+    if not route_ids:
+        return
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            f"UPDATE route_state SET next_check_at=? WHERE route_id IN ({','.join('?' * len(route_ids))})",
+            (next_check_at, *route_ids)
+        )
+        await db.commit()
+
+@_timed
+async def fsm_get(key: str) -> Optional[Tuple[Optional[str], Optional[str], int]]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT state, data, updated_at FROM fsm_state WHERE key=?", (key,))
+        row = await cur.fetchone()
+        return (row[0], row[1], int(row[2])) if row else None
+
+@_timed
+async def fsm_put(key: str, state: Optional[str], data: Optional[str], updated_at: int) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        if state is None and not data:
+            await db.execute("DELETE FROM fsm_state WHERE key=?", (key,))
+        else:
+            await db.execute(
+                """INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?,?,?,?)
+                   ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, updated_at=excluded.updated_at""",
+                (key, state, data, updated_at)
+            )
+        await db.commit()
+
+@_timed
+async def fsm_purge(older_than: int) -> int:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("DELETE FROM fsm_state WHERE updated_at < ?", (older_than,))
+        await db.commit()
+        return cur.rowcount
+
+@_timed
+async def save_stations(lang: str, rows: List[Tuple[str, str]]) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.executemany(
+            "INSERT OR REPLACE INTO stations (code, lang, name) VALUES (?,?,?)",
+            [(code, lang, name) for code, name in rows]
+        )
+        await db.commit()
+
+@_timed
+async def load_stations() -> List[Tuple[str, str, str]]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT code, lang, name FROM stations")
+        rows = await cur.fetchall()
+    return [(r[0], r[1], r[2]) for r in rows]
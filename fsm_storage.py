@@ -0,0 +1,123 @@
+"""
+aiogram FSM storage persisted in the bot's SQLite file.
+
+Reads are served from a write-through in-memory LRU, which also remembers
+keys with no state (most users, most of the time); every change is written
+to the `fsm_state` table, so a restart mid-conversation keeps the user's
+state. States not changed for longer than the TTL are dropped from both
+layers: both measure it from the last write (fsm_state.updated_at).
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import stations
+from db import fsm_get, fsm_put, fsm_purge
+
+# FSM data keys holding station search results; stored via stations.pack()
+STATION_LIST_KEYS = ("last_station_results",)
+PURGE_INTERVAL = 600  # seconds between sweeps of expired rows
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+
+def _dump(data: Dict[str, Any]) -> Optional[str]:
+    if not data:
+        return None
+    packed = dict(data)
+    for k in STATION_LIST_KEYS:
+        if isinstance(packed.get(k), list):
+            packed[k] = {"__stations__": stations.pack(packed[k])}
+    return json.dumps(packed, ensure_ascii=False, separators=(",", ":"))
+
+
+def _load(raw: Optional[str]) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    data = json.loads(raw)
+    for k in STATION_LIST_KEYS:
+        value = data.get(k)
+        if isinstance(value, dict) and "__stations__" in value:
+            data[k] = stations.unpack(value["__stations__"])
+    return data
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl: int = 86400, cache_size: int = 10000):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        # { key: (state, data, updated_at) }, updated_at as stored in fsm_state
+        self._cache: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any], int]]" = OrderedDict()
+        self._last_purge = 0.0
+
+    async def _entry(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        now = int(time.time())
+        hit = self._cache.get(key)
+        if hit is not None:
+            state, data, updated_at = hit
+            self._cache.move_to_end(key)
+            if state is None and not data:
+                return None, {}
+            if now - updated_at <= self.ttl:
+                return state, data
+            await self._write(key, None, {})
+            return None, {}
+
+        row = await fsm_get(key)
+        if row is None:
+            self._remember(key, None, {}, now)
+            return None, {}
+        state, raw, updated_at = row
+        if now - updated_at > self.ttl:
+            await self._write(key, None, {})
+            return None, {}
+        await stations.load()
+        data = _load(raw)
+        self._remember(key, state, data, updated_at)
+        return state, data
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any], updated_at: int) -> None:
+        self._cache[key] = (state, data, updated_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _write(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            hit = self._cache.get(key)
+            if hit is not None and hit[0] is None and not hit[1]:
+                return  # known to have nothing stored (state.clear() with no state)
+        now = int(time.time())
+        self._remember(key, state, data, now)
+        await fsm_put(key, state, _dump(data), now)
+        if now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            await fsm_purge(now - self.ttl)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _key(key)
+        _, data = await self._entry(k)
+        value = state.state if isinstance(state, State) else state
+        await self._write(k, value, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._entry(_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = _key(key)
+        state, _ = await self._entry(k)
+        await self._write(k, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._entry(_key(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,56 @@
+"""
+Lease-based route ownership for scheduler workers (`bot.py scheduler --leases`).
+
+Routes hash into LEASE_SLOTS slots with scheduler.route_shard, so identical
+routes share a worker and its trains cache. Each worker heartbeats every
+LEASE_TTL / 3 seconds (db.renew_leases): it extends its leases and evens out
+ownership with the other live workers, so a new worker gets its share within
+a heartbeat and a dead one's slots are taken over once its leases expire.
+
+Ownership only spreads the work. A worker still claims each user's due
+routes (db.claim_due_routes) before checking them, so a route whose slot
+changes hands mid-tick is never checked, or notified, twice.
+"""
+import logging
+import os
+import socket
+import time
+from typing import FrozenSet
+
+from config import LEASE_SLOTS, LEASE_TTL
+from db import renew_leases, release_leases
+
+logger = logging.getLogger("railway_bot")
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+HEARTBEAT_INTERVAL = max(1.0, LEASE_TTL / 3)
+
+_owned: FrozenSet[int] = frozenset()
+_valid_until = 0.0
+
+
+def owned() -> FrozenSet[int]:
+    """Slots this worker holds; empty once its leases may have expired (missed heartbeats)."""
+    return _owned if time.time() < _valid_until else frozenset()
+
+
+async def heartbeat() -> None:
+    global _owned, _valid_until
+    now = int(time.time())
+    try:
+        slots = frozenset(await renew_leases(WORKER_ID, LEASE_SLOTS, LEASE_TTL, now))
+    except Exception as e:
+        logger.warning("Lease heartbeat failed: %s", e)
+        return
+    if slots != _owned:
+        logger.info("Worker %s now owns %d/%d slots", WORKER_ID, len(slots), LEASE_SLOTS)
+    _owned, _valid_until = slots, now + LEASE_TTL
+
+
+async def release() -> None:
+    global _owned, _valid_until
+    _owned, _valid_until = frozenset(), 0.0
+    try:
+        await release_leases(WORKER_ID)
+    except Exception as e:
+        logger.warning("Lease release failed: %s", e)
@@ -0,0 +1,56 @@
+"""
+Non-blocking logging for the "railway_bot" logger tree.
+
+Log calls on the event loop only put the record on a queue (QueueHandler);
+a QueueListener thread formats it and does the console / rotating-file I/O.
+"""
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import LOG_LEVEL, LOG_FILE
+
+_listener = None
+
+_LEVELS = {"CRITICAL": logging.CRITICAL, "ERROR": logging.ERROR, "WARNING": logging.WARNING,
+           "INFO": logging.INFO, "DEBUG": logging.DEBUG}
+
+
+def setup_logging() -> logging.Logger:
+    global _listener
+    logger = logging.getLogger("railway_bot")
+    if _listener is not None:
+        return logger
+    level = _LEVELS.get(LOG_LEVEL, logging.INFO)
+    logger.setLevel(level)
+
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(level)
+    console_handler.setFormatter(formatter)
+
+    # File handler with rotation (max 5MB per file, keep 2 backups)
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=2)
+    file_handler.setLevel(level)
+    file_handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    if LOG_LEVEL not in _LEVELS:
+        logger.warning("Unknown LOG_LEVEL %r, using INFO (one of %s)", LOG_LEVEL, ", ".join(_LEVELS))
+    return logger
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
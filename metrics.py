@@ -0,0 +1,165 @@
+"""
+In-process metrics registry (counters, gauges, histograms) rendered in the
+Prometheus text exposition format at /metrics.
+
+Metrics are plain dicts keyed by label values: an update is a dict lookup and
+an add, so instrumentation stays on in production. Every process (API worker,
+scheduler worker) keeps its own registry.
+"""
+import bisect
+import functools
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Seconds; covers SQLite calls (sub-ms) through slow upstream requests and ticks
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: List["_Metric"] = []
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        out = super().render()
+        for key, value in self._values.items():
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {value}")
+        return out
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # { labels: [per-bucket counts (last one is +Inf), sum, count] }
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        out = super().render()
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _fmt_labels(self.labels, key, 'le="%s"' % le)
+                out.append(f"{self.name}_bucket{labels} {cumulative}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {count}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist: Histogram, labels: Tuple[str, ...]):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+def timed(hist: Histogram, errors: Counter = None):
+    """Decorator for coroutines: observe duration labelled with the function name."""
+    def decorator(fn):
+        label = fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(label)
+                raise
+            finally:
+                hist.observe(time.perf_counter() - start, label)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Telegram Bot API ---
+TELEGRAM_SECONDS = Histogram("railway_telegram_request_seconds", "Bot API request latency", ("method",))
+TELEGRAM_REQUESTS = Counter("railway_telegram_requests_total", "Bot API requests by outcome", ("method", "status"))
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """aiogram session middleware: times every Bot API call (send_message, ...)."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - start, name)
+            TELEGRAM_REQUESTS.inc(name, status)
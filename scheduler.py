@@ -1,73 +1,135 @@
+import asyncio
+import functools
+import hashlib
+import itertools
 import logging
-from typing import Dict, Any, Tuple, Optional, List
+import pickle
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, Optional, List, NamedTuple, Set
 from datetime import datetime, timezone, timedelta
 from aiogram import Bot
 
-from db import list_routes, set_route_state, get_route_state, list_users, get_user, update_route_field, increment_notification_count, delete_route, update_last_notified, reset_notification_count
-from api import fetch_trains
-from texts import t
+from db import list_routes, set_route_state, get_route_state, list_due_routes, get_route_results, get_user, update_route_field, increment_notification_count, delete_route, update_last_notified, reset_notification_count, expire_routes, checked_since, claim_due_routes, release_routes
+from api import fetch_trains_shared, INTERACTIVE, BACKGROUND
+from config import RENDER_CACHE_SIZE, UPSTREAM_LANG, CHECK_REFRESH, PROGRESS_EDIT_INTERVAL, LEASE_SLOTS, TICK_INTERVAL, TICK_OFFSET
+from texts import t, templates, type_name
+import stations as station_catalogue
+from metrics import Histogram, Counter, Gauge
+import tracing
+import leases
 
 logger = logging.getLogger("railway_bot")
 
+USER_CHECK_SECONDS = Histogram("railway_user_check_seconds", "check_and_notify_for_user duration", ("kind",))
+ROUTES_CHECKED = Counter("railway_routes_checked_total", "Route checks by outcome", ("outcome",))
+NOTIFICATIONS_SENT = Counter("railway_notifications_sent_total", "Route notifications sent", ("available",))
+TICK_SECONDS = Histogram("railway_scheduler_tick_seconds", "scheduler_tick duration")
+TICK_LAST = Gauge("railway_scheduler_last_tick_timestamp_seconds", "Unix time the last tick finished")
+TICK_USERS = Gauge("railway_scheduler_tick_users", "Users visited by the last tick")
+RENDER_CACHE = Counter("railway_render_cache_total", "build_route_message cache lookups", ("result",))
+DIGEST_MESSAGES = Counter("railway_digest_messages_total", "Telegram messages carrying route notifications")
+
+TZ_UZ = timezone(timedelta(hours=5))  # Tashkent
+MESSAGE_LIMIT = 4096  # Telegram rejects longer message texts
+SEAT_KEYS = ("up", "down", "lateral_up", "lateral_down")
+
 # Simple formatters moved here from utils/formatters.py
 def format_duration(lang: str, minutes_str: str) -> str:
     try:
         m = int(minutes_str)
     except:
         return minutes_str
-    
-    hours = m // 60
-    mins = m % 60
-    
-    # Use keys from texts.py for full words
-    fmt = t(lang, "time_h_m") # "{h} часов {m} минут"
-    return fmt.format(h=hours, m=mins)
+    return templates(lang).time_h_m(h=m // 60, m=m % 60)
 
-def get_number_emoji(n: int) -> str:
-    # 0-9
-    keycap_map = {
-        0: "0️⃣", 1: "1️⃣", 2: "2️⃣", 3: "3️⃣", 4: "4️⃣",
-        5: "5️⃣", 6: "6️⃣", 7: "7️⃣", 8: "8️⃣", 9: "9️⃣", 10: "🔟"
-    }
-    if n <= 10:
-        return keycap_map.get(n, str(n))
-    
+_KEYCAPS = ("0️⃣", "1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣")
+
+def _number_emoji(n: int) -> str:
+    if n == 10:
+        return "🔟"
+    if 0 <= n < 10:
+        return _KEYCAPS[n]
+    if n < 0:
+        return str(n)
     # For > 10, combine digits: 12 -> 1️⃣2️⃣
-    s = str(n)
-    res = ""
-    for char in s:
-        digit = int(char)
-        res += keycap_map.get(digit, char)
-    return res
+    return "".join(_KEYCAPS[int(d)] for d in str(n))
 
+# A route never lists more trains than this, so the common case is a lookup
+_NUMBER_EMOJI = tuple(_number_emoji(n) for n in range(100))
+
+def get_number_emoji(n: int) -> str:
+    if 0 <= n < 100:
+        return _NUMBER_EMOJI[n]
+    return _number_emoji(n)
+
+CAR_CLASSES = ("platskart", "kupe", "lux", "seated")
+CAR_CLASS_ICONS = {"platskart": "🛏", "kupe": "🚪", "lux": "💎", "seated": "💺", "other": "🚃"}
+
+@functools.lru_cache(maxsize=256)
+def car_class(ctype: str) -> str:
+    # Basic mapping; covers the texts.TYPE_NAMES translations too
+    ctype = ctype.lower()
+    if "плацкарт" in ctype or "plackart" in ctype or "sleeper" in ctype:
+        return "platskart"
+    if "купе" in ctype or "kupe" in ctype or "compartment" in ctype:
+        return "kupe"
+    if "люкс" in ctype or "sv" in ctype or "lyuks" in ctype:
+        return "lux"
+    if "сидяч" in ctype or "o'rindiq" in ctype or "seated" in ctype:
+        return "seated"
+    return "other"
+
+@functools.lru_cache(maxsize=256)
 def car_icon(ctype: str) -> str:
-    # Basic mapping
-    if "плацкарт" in ctype.lower() or "plackart" in ctype.lower():
-        return "🛏"
-    if "купе" in ctype.lower() or "kupe" in ctype.lower():
-        return "🚪"
-    if "люкс" in ctype.lower() or "sv" in ctype.lower():
-        return "💎"
-    if "сидяч" in ctype.lower() or "o'rindiq" in ctype.lower():
-        return "💺"
-    return "🚃"
-
-def parse_ticket_info(api_json: Dict[str, Any]) -> Tuple[bool, List[Dict[str, Any]], int]:
-    # Returns (is_available, [list of trains], travel_time_min)
-    
-    data = api_json.get("data", {})
-    directions = data.get("directions", [])
+    return CAR_CLASS_ICONS[car_class(ctype)]
+
+# Route filters (routes.filters), every key optional:
+#   {"car_types": ["kupe", ...CAR_CLASSES], "berths": ["down", "up", "lateral"],
+#    "max_price": 300000, "trains": ["127Ф", ...]}
+# compile_filters() turns them into what _parse_leg checks per car, so cars
+# and trains the user doesn't want are dropped while parsing.
+BERTHS = {"up": ("up",), "down": ("down",), "lateral": ("lateral_up", "lateral_down")}
+_SEAT_DETAIL_KEYS = {"up": "up", "down": "down", "lateral_up": "lateralUp", "lateral_down": "lateralDn"}
+Filters = Tuple[Optional[frozenset], Optional[Tuple[str, ...]], int, Optional[frozenset]]
+
+def train_number_key(number: Any) -> str:
+    # "053Ф", "53F" and "53" are the same train: users can't be expected to type the letter in Cyrillic
+    return "".join(ch for ch in str(number) if ch.isdigit()).lstrip("0")
+
+def compile_filters(filters: Optional[Dict[str, Any]]) -> Optional[Filters]:
+    if not filters:
+        return None
+    classes = frozenset(filters.get("car_types") or ()) or None
+    berths = tuple(key for b in filters.get("berths") or () for key in BERTHS.get(b, ())) or None
+    max_price = int(filters.get("max_price") or 0)
+    trains = frozenset(filter(None, (train_number_key(n) for n in filters.get("trains") or ()))) or None
+    if not (classes or berths or max_price or trains):
+        return None
+    return classes, berths, max_price, trains
+
+def _legs(api_json: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Directions in request order: forward, then backward for a round trip
+    directions = api_json.get("data", {}).get("directions", [])
     if isinstance(directions, dict):
-        if not directions: return False, [], 0
-        logger.info(f"Directions keys: {list(directions.keys())}")
-        forward = next(iter(directions.values()))
-    elif isinstance(directions, list):
-        if not directions: return False, [], 0
-        forward = directions[0]
-    else:
-        return False, [], 0
+        if "forward" in directions:
+            return [directions[k] for k in ("forward", "backward") if k in directions]
+        return list(directions.values())
+    return directions if isinstance(directions, list) else []
 
-    trains = forward.get("trains", [])
+def parse_ticket_info(api_json: Dict[str, Any], filters: Optional[Filters] = None) -> Tuple[bool, List[Dict[str, Any]], int]:
+    # Returns (is_available, [list of trains], travel_time_min)
+    # filters: compile_filters() of the route; only matching seats count as available
+    legs = _legs(api_json)
+    return _parse_leg(legs[0], filters) if legs else (False, [], 0)
+
+def parse_round_trip(api_json: Dict[str, Any], filters: Optional[Filters] = None) -> List[Tuple[bool, List[Dict[str, Any]], int]]:
+    """parse_ticket_info for every leg of the response: [forward] or [forward, backward]."""
+    return [_parse_leg(leg, filters) for leg in _legs(api_json)] or [(False, [], 0)]
+
+def _parse_leg(leg: Dict[str, Any], filters: Optional[Filters] = None) -> Tuple[bool, List[Dict[str, Any]], int]:
+    trains = leg.get("trains", [])
+    classes, berths, max_price, numbers = filters or (None, None, 0, None)
     
     found_any = False
     result_trains = []
@@ -78,6 +140,8 @@ def parse_ticket_info(api_json: Dict[str, Any]) -> Tuple[bool, List[Dict[str, An
         cars = train.get("cars", [])
         if not cars:
             continue
+        if numbers and train_number_key(train.get("number", "")) not in numbers:
+            continue
             
         train_cars_data = [] # List of dicts
         has_seats_train = False
@@ -87,9 +151,6 @@ def parse_ticket_info(api_json: Dict[str, Any]) -> Tuple[bool, List[Dict[str, An
             
             free = car.get("freeSeats", 0)
             if free > 0:
-                has_seats_train = True
-                found_any = True
-                
                 # Fix: type can be string "Плацкартный" or dict {"name": "..."}
                 raw_type = car.get("type", "Gen")
                 if isinstance(raw_type, dict):
@@ -113,10 +174,28 @@ def parse_ticket_info(api_json: Dict[str, Any]) -> Tuple[bool, List[Dict[str, An
                 try: price_fmt = "{:,}".format(int(tariff))
                 except: price_fmt = str(tariff)
 
+                try: tariff_num = int(tariff)
+                except: tariff_num = 0
+
+                if filters is not None:
+                    if classes and car_class(ctype) not in classes:
+                        continue
+                    if max_price and tariff_num > max_price:
+                        continue
+                    if berths:
+                        # Only the wanted berths are counted and listed
+                        seat_detail = {_SEAT_DETAIL_KEYS[k]: seat_detail.get(_SEAT_DETAIL_KEYS[k], 0) for k in berths}
+                        free = sum(seat_detail.values())
+                        if free <= 0:
+                            continue
+                has_seats_train = True
+                found_any = True
+
                 train_cars_data.append({
                     "type": ctype,
                     "free": free,
                     "price": price_fmt,
+                    "tariff": tariff_num,
                     "up": seat_detail.get("up", 0),
                     "down": seat_detail.get("down", 0),
                     "lateral_up": seat_detail.get("lateralUp", 0),
@@ -155,195 +234,258 @@ def parse_ticket_info(api_json: Dict[str, Any]) -> Tuple[bool, List[Dict[str, An
 
     return found_any, result_trains, min_time
 
+def merge_ticket_info(results: List[Tuple[bool, List[Dict[str, Any]], int]]) -> Tuple[bool, List[Dict[str, Any]], int]:
+    # parse_ticket_info results of one route on several dates, in date order
+    if len(results) == 1:
+        return results[0]
+    trains = [train for _, trains_data, _ in results for train in trains_data]
+    min_time = next((m for available, _, m in results if available), 0)
+    return any(r[0] for r in results), trains, min_time
+
+def route_dates(route: Dict[str, Any], today: Optional[str] = None) -> List[str]:
+    """Dates to fetch for a route: travel_date, or the days of its range from today on."""
+    end = route.get("travel_date_to")
+    if not end or end <= route["travel_date"]:
+        return [route["travel_date"]]
+    today = today or datetime.now(TZ_UZ).date().isoformat()
+    day = max(datetime.strptime(route["travel_date"], "%Y-%m-%d").date(),
+              datetime.strptime(min(today, end), "%Y-%m-%d").date())
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    out = []
+    while day <= last:
+        out.append(day.isoformat())
+        day += timedelta(days=1)
+    return out
+
+def route_result(route: Dict[str, Any], responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    What a check of a route found, as stored in route_state.last_result:
+    "legs" - the route's filters applied, days of a range merged, then the
+    way back of a round trip, all in UPSTREAM_LANG; "stations" - the searched
+    stations' names per leg as upstream spelled them, None when it had no trains.
+    """
+    filters = compile_filters(route.get("filters"))
+    days = [parse_round_trip(r, filters) for r in responses]
+    legs = [merge_ticket_info([day[0] for day in days])]
+    if route.get("return_date"):
+        legs.append(days[0][1] if len(days[0]) > 1 else (False, [], 0))
+    # Station names are read from the first day that has trains
+    api_json = next((r for r in responses if _forward_trains(r)), responses[0])
+    stations = []
+    for leg in range(len(legs)):
+        trains = _forward_trains(api_json, leg)
+        stations.append([trains[0].get("departureStation", ""), trains[0].get("arrivalStation", "")] if trains else None)
+    return {"legs": legs, "stations": stations}
+
+def result_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    # Just enough of a trains response for _localised_names: one train per leg carrying the station names
+    directions = {}
+    for key, names in zip(("forward", "backward"), result["stations"]):
+        directions[key] = {"trains": [{"departureStation": names[0], "arrivalStation": names[1]}] if names else []}
+    return {"data": {"directions": directions}}
+
+def localise_trains(trains_data: List[Dict[str, Any]], from_lang: str, lang: str) -> List[Dict[str, Any]]:
+    """Parsed trains fetched in from_lang, with train / car types and origin stations in lang."""
+    if lang == from_lang:
+        return trains_data
+    out = []
+    for train in trains_data:
+        dep, sep, arv = train["route_name"].partition(" - ")
+        out.append(dict(
+            train,
+            type=type_name(train["type"], lang),
+            route_name=(f"{station_catalogue.translate(dep, from_lang, lang)} - "
+                        f"{station_catalogue.translate(arv, from_lang, lang)}") if sep else train["route_name"],
+            cars_data=[dict(car, type=type_name(car["type"], lang)) for car in train["cars_data"]],
+        ))
+    return out
+
 def fmt_date_for_ui(lang: str, date_str: str) -> str:
     # YYYY-MM-DD -> 15 Января 2026 года (if supported)
     try:
         parts = date_str.split("-")
         day = int(parts[2])
         month_idx = int(parts[1])
-        year = parts[0]
-        
-        # Simple helper in texts.py or inline here? 
-        # I cannot import get_month_name easily as it's not exported, assuming I added it or I'll implement lookup here
-        # Actually I added "months" list to TEXT dict.
-        from texts import t, TEXT
-        months = TEXT.get(lang, TEXT["ru"]).get("months", [])
-        m_name = months[month_idx] if 0 < month_idx < len(months) else parts[1]
-        
-        suffix = t(lang, "year_suffix")
-        
-        return f"{day} {m_name} {year}{suffix}"
+        tpl = templates(lang)
+        m_name = tpl.months[month_idx] if 0 < month_idx < len(tpl.months) else parts[1]
+        return f"{day} {m_name} {parts[0]}{tpl.year_suffix}"
     except:
         return date_str
 
-async def build_route_message(lang: str, route: Dict[str, Any], api_json: Dict[str, Any]) -> Tuple[bool, str]:
-    available, trains_data, time_on_way = parse_ticket_info(api_json)
+def fmt_route_dates(lang: str, travel_date: str, travel_date_to: Optional[str] = None,
+                    return_date: Optional[str] = None) -> str:
+    # A round trip shows there and back like the route list (⇄), a date range with a dash
+    if return_date:
+        return f"{fmt_date_for_ui(lang, travel_date)} ⇄ {fmt_date_for_ui(lang, return_date)}"
+    if travel_date_to and travel_date_to != travel_date:
+        return f"{fmt_date_for_ui(lang, travel_date)} — {fmt_date_for_ui(lang, travel_date_to)}"
+    return fmt_date_for_ui(lang, travel_date)
 
-    # Tashkent Time (UTC+5)
-    tz_uz = timezone(timedelta(hours=5))
-    ts = datetime.now(tz_uz).strftime("%H:%M")
-    chk_line = t(lang, "check_time").format(ts=ts)
-    
-    # Header date
-    date_ui = fmt_date_for_ui(lang, route["travel_date"])
-    
-    # Try to get localized route names from API if possible
-    # parse_ticket_info returns a list of results, we can check the originRoute of the first train
-    # BUT, originRoute is where the train started, which might be different from our search.
-    # We should look at "from" and "to" in api_json root if available, but usually it's not.
-    # However, api_json['data']['directions'] (list or dict)
-    
-    # HEURISTIC: Use the first train's departure station and arrival station from the search result segments
-    # Actually, parse_ticket_info > trains > "station0" and "station1" in the train data? No.
-    # The API returns trains that match the search.
-    # api_json data structure:
-    # "data": { "directions": [ { "trains": [ { "departureStation": "NAME", "arrivalStation": "NAME" ... } ] } ] }
-    # These names are usually localized to the requested lang.
-    
-    from_name_loc = route["from_name"]
-    to_name_loc = route["to_name"]
-    
-    if available and trains_data:
-        # Use the first train's station names as they are likely what we searched for (or close enough)
-        # We need to dig into api_json again or just use what we have in trains_data?
-        # trains_data has "cars_data" etc, but not the station names of the query (it has route_name "Andijan - Kungrad" which is origin-destination of train).
-        # Let's peek into api_json directly here since we have it.
-        try:
-            data = api_json.get("data", {})
-            dur = data.get("directions", [])
-            forward = []
-            if isinstance(dur, list) and dur: forward = dur[0]
-            elif isinstance(dur, dict) and dur: forward = next(iter(dur.values()))
-            
-            if forward:
-                # The 'trains' list contains trains. 
-                # usually each train object has 'departureStation' and 'arrivalStation' fields which are the ONES WE SEARCHED FOR (station0, station1).
-                # ex: "departureStation": "TASHKENT", "arrivalStation": "SAMARKAND"
-                ftrain = forward.get("trains", [])[0]
-                fn = ftrain.get("departureStation", "")
-                tn = ftrain.get("arrivalStation", "")
-                if fn and tn:
-                    from_name_loc = fn
-                    to_name_loc = tn
-        except:
-             pass
-
-    cars_text_parts = []
-    if available:
-        for idx, train in enumerate(trains_data, start=1):
-            # 1️⃣. 🚈 Поезд 127Ф (Пассажирский)
-            num = train["number"]
-            ttype = train["type"] # e.g. "Afrosiyob" or "(Пассажирский)"
-            
-            # Number icon
-            idx_emoji = get_number_emoji(idx)
-            
-            # Request: Change 🚈 to 🚄
-            header_str = f"{idx_emoji}. 🚄 {t(lang, 'train_number').format(num=num).replace('🚄 ', '')}"
-            
-            # Append Type to Header line if present
-            if ttype and ttype not in ["Gen"]:
-                 # If it already has parens, don't add more?
-                 # API sometimes returns "Пассажирский" (no parens) or "(Пассажирский)"
-                 if "(" not in ttype:
-                     header_str += f" ({ttype})"
-                 else:
-                     header_str += f" {ttype}"
-
-            # 🛤 Андижан 1 - Кунград
-            route_line_str = f"🛤 {train['route_name']}"
-            
-            # 🟢 Отбытие - 15.01.2026 - 21:13
-            # 🔴 Прибытие - 16.01.2026 - 01:09
-            dep_label = t(lang, "dep_time_label")
-            arr_label = t(lang, "arr_time_label")
-            dep_line = f"{dep_label} - {train['dep_time']}"
-            arr_line = f"{arr_label} - {train['arr_time']}"
-            
-            # ⏳ Время в пути: 4 часа 15 минут
-            dur_str = train["duration"]
-            try:
-                h, m = map(int, dur_str.split(":"))
-                dur_fmt = format_duration(lang, str(h*60+m))
-            except: 
-                dur_fmt = dur_str
-            dur_line = f"{t(lang, 'travel_time_label')}: {dur_fmt}"
-
-            # SEATS
-            # 🛏 Плацкартный — 222 мест — 142,980 сум 
-            # ⬆️ Верхние: 68
-            # ⬇️ Нижние: 64
-            # ↖️ Боковые верхние: 45
-            # ↙️ Боковые нижние: 45
-
-            seat_lines = []
-            for car in train["cars_data"]:
-                ctype = car["type"]
-                free = car["free"]
-                price = car["price"]
-                
-                icon = car_icon(ctype)
-                # Note: user wants "142,980 сум" -> handled in parse_ticket_info
-                
-                # Base line
-                # "🛏 Плацкартный — 222 мест — 142,980 сум"
-                # Using existing 'car_line' template? It was "{icon} {type_} — {seats} ta — {price} so‘mdan"
-                # UPDATE: User manually patched texts.py to match their need.
-                # However, car_line placeholders are {type_}, {seats}, {price}.
-                
-                # Format localized words for 'seats' (mest/ta) and currency
-                currency = "сум"
-                if lang == "uz": currency = "so‘m" # Updated to match user's explicit change in texts.py (implied)
-                elif lang == "en": currency = "UZS"
-                
-                mest = "мест"
-                if lang == "uz": mest = "ta"
-                elif lang == "en": mest = "seats"
-                
-                # We CAN use the template from texts.py, but I'm building it manually here to be safe and match logic 100%
-                # Actually, relying on texts.py template is better if it fits.
-                # User edited texts.py car_line to: "{icon} {type_} — {seats} ta — {price} so‘m"
-                # But that only works for UZ. The RU one is: "{icon} {type_} — {seats} мест — от {price} сум"
-                # The user edit in 582 was generic? No, TEXT is dict. User likely edited just UZ or ALL?
-                # User diff showed changes in "uz" block.
-                # I will try to use t(lang, 'car_line') and pass args.
-                
-                s_line = t(lang, "car_line").format(icon=icon, type_=ctype, seats=free, price=price)
-                seat_lines.append(s_line)
-                
-                # Directions
-                # ⬆️ Верхние: 68
-                up = car["up"]
-                down = car["down"]
-                l_up = car["lateral_up"]
-                l_dn = car["lateral_down"]
-                
-                if up > 0: seat_lines.append(f"⬆️ {t(lang, 'seats_up')}: {up}")
-                if down > 0: seat_lines.append(f"⬇️ {t(lang, 'seats_down')}: {down}")
-                if l_up > 0: seat_lines.append(f"↖️ {t(lang, 'seats_lateral_up')}: {l_up}")
-                if l_dn > 0: seat_lines.append(f"↙️ {t(lang, 'seats_lateral_down')}: {l_dn}")
-                
-                seat_lines.append("") # Empty line between car types
+def return_leg(route: Dict[str, Any]) -> Dict[str, Any]:
+    """The way back of a round-trip route, as a one-way route."""
+    return dict(route, from_code=route["to_code"], from_name=route["to_name"],
+                to_code=route["from_code"], to_name=route["from_name"],
+                travel_date=route["return_date"], travel_date_to=None, return_date=None)
 
-            full_block = f"{header_str}\n{route_line_str}\n{dep_line}\n{arr_line}\n{dur_line}\n\n" + "\n".join(seat_lines)
-            cars_text_parts.append(full_block)
-        
-        cars_text = "\n".join(cars_text_parts)
+def _train_block(tpl, idx: int, train: Dict[str, Any]) -> str:
+    # 1️⃣. 🚄 Поезд 127Ф (Пассажирский)
+    header = f"{get_number_emoji(idx)}. 🚄 {tpl.train_header(num=train['number'])}"
+    ttype = train["type"] # e.g. "Afrosiyob" or "(Пассажирский)"
+    if ttype and ttype != "Gen":
+        # API sometimes returns "Пассажирский" (no parens) or "(Пассажирский)"
+        header += f" ({ttype})" if "(" not in ttype else f" {ttype}"
+
+    # ⏳ Время в пути: 4 часа 15 минут
+    dur = train["duration"]
+    try:
+        h, m = map(int, dur.split(":"))
+        total = h * 60 + m
+        dur = tpl.time_h_m(h=total // 60, m=total % 60)
+    except:
+        pass
+
+    # 🛏 Плацкартный — 222 мест — 142,980 сум
+    # ⬆️ Верхние: 68 ... one line per non-empty direction, blank line after each car
+    seat_lines = []
+    for car in train["cars_data"]:
+        ctype = car["type"]
+        seat_lines.append(tpl.car_line(icon=car_icon(ctype), type_=ctype, seats=car["free"], price=car["price"]))
+        for key, prefix in zip(SEAT_KEYS, tpl.seat_prefixes):
+            if car[key] > 0:
+                seat_lines.append(f"{prefix}{car[key]}")
+        seat_lines.append("")
+
+    return (f"{header}\n🛤 {train['route_name']}\n"
+            f"{tpl.dep_prefix}{train['dep_time']}\n{tpl.arr_prefix}{train['arr_time']}\n"
+            f"{tpl.travel_prefix}{dur}\n\n" + "\n".join(seat_lines))
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    # Break between paragraphs where possible, else between lines
+    if len(text) <= limit:
+        return [text]
+    parts, cur = [], ""
+    for para in text.split("\n\n"):
+        joined = f"{cur}\n\n{para}" if cur else para
+        if len(joined) <= limit:
+            cur = joined
+            continue
+        if cur:
+            parts.append(cur)
+        while len(para) > limit:
+            cut = para.rfind("\n", 0, limit)
+            cut = cut if cut > 0 else limit
+            parts.append(para[:cut])
+            para = para[cut:].lstrip("\n")
+        cur = para
+    if cur:
+        parts.append(cur)
+    return parts
+
+def _forward_trains(api_json: Dict[str, Any], leg: int = 0) -> List[Dict[str, Any]]:
+    legs = _legs(api_json)
+    return (legs[leg].get("trains") or []) if len(legs) > leg else []
+
+def _localised_names(route: Dict[str, Any], api_json: Dict[str, Any], leg: int = 0) -> Tuple[str, str]:
+    # Trains carry the searched stations as departureStation / arrivalStation,
+    # localised to the request language; fall back to the names stored on the route.
+    try:
+        trains = _forward_trains(api_json, leg)
+        if trains:
+            ftrain = trains[0]
+            fn = ftrain.get("departureStation", "")
+            tn = ftrain.get("arrivalStation", "")
+            if fn and tn:
+                return fn, tn
+    except:
+        pass
+    return route["from_name"], route["to_name"]
+
+# Subscribers of the same route in the same language get the same text apart
+# from the check-time line, so messages are cached with a placeholder there:
+# (result digest, lang, station names, dates) -> (available, head, tail)
+_CHK = "\x00"
+_render_cache: "OrderedDict[Tuple[Any, ...], Tuple[bool, str, str]]" = OrderedDict()
+
+def _render(lang: str, from_name: str, to_name: str, travel_date: str, travel_date_to: Optional[str], available: bool, trains_data: List[Dict[str, Any]], chk: str) -> str:
+    tpl = templates(lang)
+    if available:
+        cars_text = "\n".join([_train_block(tpl, idx, train) for idx, train in enumerate(trains_data, start=1)])
     else:
-        cars_text = t(lang, "ticket_none")
+        cars_text = tpl.ticket_none
 
-    text = t(lang, "route_line").format(
-        from_=from_name_loc,
-        to_=to_name_loc,
-        date=date_ui,
-        chk=chk_line,
+    return tpl.route_line(
+        from_=from_name,
+        to_=to_name,
+        date=fmt_route_dates(lang, travel_date, travel_date_to),
+        chk=chk,
         status="",
         cars=cars_text,
     ).strip() # Remove extra newlines if status is empty
 
+async def build_route_message(lang: str, route: Dict[str, Any], api_json: Dict[str, Any], parsed: Optional[Tuple[bool, List[Dict[str, Any]], int]] = None, api_lang: Optional[str] = None, leg: int = 0,
+                              checked_at: Optional[float] = None) -> Tuple[bool, str]:
+    # parsed: result of parse_ticket_info(api_json) if the caller already has it, localised to lang
+    # api_lang: language api_json was fetched in, if not lang; the header then uses the route's names
+    # leg: 1 renders the backward direction of a round trip (route as returned by return_leg())
+    # checked_at: unix time the data was fetched, for the check-time line (default: now)
+    if parsed is None:
+        legs = parse_round_trip(api_json)
+        parsed = legs[leg] if leg < len(legs) else (False, [], 0)
+    available, trains_data, time_on_way = parsed
+
+    if available and trains_data and (api_lang or lang) == lang:
+        from_name, to_name = _localised_names(route, api_json, leg)
+    else:
+        from_name, to_name = route["from_name"], route["to_name"]
+    checked = datetime.fromtimestamp(checked_at, TZ_UZ) if checked_at else datetime.now(TZ_UZ)
+    chk = templates(lang).check_time(ts=checked.strftime("%H:%M"))
+    dates = route["travel_date"], route.get("travel_date_to")
+    if RENDER_CACHE_SIZE <= 0:
+        return available, _render(lang, from_name, to_name, *dates, available, trains_data, chk)
+
+    # pickle is ~4x cheaper than repr() on the parsed model
+    digest = hashlib.blake2b(pickle.dumps((available, trains_data), pickle.HIGHEST_PROTOCOL), digest_size=16).digest()
+    key = (digest, lang, from_name, to_name, dates)
+    cached = _render_cache.get(key)
+    if cached is not None:
+        _render_cache.move_to_end(key)
+        RENDER_CACHE.inc("hit")
+    else:
+        RENDER_CACHE.inc("miss")
+        head, _, tail = _render(lang, from_name, to_name, *dates, available, trains_data, _CHK).partition(_CHK)
+        cached = _render_cache[key] = (available, head, tail)
+        if len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return cached[0], cached[1] + chk + cached[2]
 
+async def render_result(lang: str, route: Dict[str, Any], result: Dict[str, Any], checked_at: Optional[float] = None) -> Tuple[bool, str]:
+    """The message for a route_result(): both legs of a round trip, available only when both have seats."""
+    api_json = result_response(result)
+    legs = result["legs"]
+    available, trains_data, time_on_way = legs[0]
+    parsed = available, localise_trains(trains_data, UPSTREAM_LANG, lang), time_on_way
+    available, text = await build_route_message(lang, route, api_json, parsed, api_lang=UPSTREAM_LANG, checked_at=checked_at)
+    if route.get("return_date"):
+        back_available, back_trains, back_time = legs[1] if len(legs) > 1 else (False, [], 0)
+        back = back_available, localise_trains(back_trains, UPSTREAM_LANG, lang), back_time
+        back_available, back_text = await build_route_message(
+            lang, return_leg(route), api_json, back, api_lang=UPSTREAM_LANG, leg=1, checked_at=checked_at)
+        available = available and back_available
+        text = f"{text}\n\n{back_text}"
     return available, text
 
+async def fetch_route_result(route: Dict[str, Any], priority: int, span=tracing.NULL_SPAN) -> Dict[str, Any]:
+    # One request per route and date for all users, whatever their language;
+    # the days of a date range are fetched concurrently through the same cache,
+    # both legs of a round trip come in one request
+    with span.phase("fetch"):
+        responses = await asyncio.gather(*(
+            fetch_trains_shared(route["from_code"], route["to_code"], day, return_date=route.get("return_date"), priority=priority)
+            for day in route_dates(route)
+        ))
+    with span.phase("parse"):
+        return route_result(route, responses)
+
 
 async def update_route_names_for_language(telegram_id: int, lang: str) -> None:
     """
@@ -353,7 +495,7 @@ async def update_route_names_for_language(telegram_id: int, lang: str) -> None:
     from api import search_stations
     
     routes = await list_routes(telegram_id)
-    logger.info(f"Updating route names for user {telegram_id} to language {lang}")
+    logger.info("Updating route names for user %s to language %s", telegram_id, lang)
     
     for route in routes:
         try:
@@ -376,84 +518,90 @@ async def update_route_names_for_language(telegram_id: int, lang: str) -> None:
                         loc_to = s.get("name")
                         break
             except Exception as e:
-                logger.warning(f"Failed to search stations for route {route['id']}: {e}")
+                logger.warning("Failed to search stations for route %s: %s", route["id"], e)
                 continue
             
             # Apply updates
             if loc_from and loc_from != route["from_name"]:
                 await update_route_field(route["id"], "from_name", loc_from)
                 try:
-                    logger.info(f"Updated route {route['id']} from_name: {route['from_name'].encode('ascii', 'ignore')} -> {loc_from.encode('ascii', 'ignore')}")
+                    logger.info("Updated route %s from_name: %s -> %s", route["id"], route["from_name"].encode("ascii", "ignore"), loc_from.encode("ascii", "ignore"))
                 except:
                     pass
             
             if loc_to and loc_to != route["to_name"]:
                 await update_route_field(route["id"], "to_name", loc_to)
                 try:
-                    logger.info(f"Updated route {route['id']} to_name: {route['to_name'].encode('ascii', 'ignore')} -> {loc_to.encode('ascii', 'ignore')}")
+                    logger.info("Updated route %s to_name: %s -> %s", route["id"], route["to_name"].encode("ascii", "ignore"), loc_to.encode("ascii", "ignore"))
                 except:
                     pass
                 
         except Exception as e:
-            logger.error(f"Error updating route {route['id']} names: {e}")
+            logger.error("Error updating route %s names: %s", route["id"], e)
             continue
 
 
-async def check_and_notify_for_user(bot: Bot, telegram_id: int, force_send: bool = False, update_names: bool = False, specific_route_id: int = None, on_route_deleted=None) -> int:
+def route_shard(route: Dict[str, Any], shard_count: int) -> int:
+    # Identical (from, to, date) routes always land on the same worker
+    key = f"{route['from_code']}:{route['to_code']}:{route['travel_date']}"
+    return zlib.crc32(key.encode()) % shard_count
+
+
+async def check_and_notify_for_user(bot: Bot, telegram_id: int, force_send: bool = False, update_names: bool = False, specific_route_id: int = None, on_route_deleted=None, shard: Optional[Tuple[int, int]] = None,
+                                    due_routes: Optional[List[Dict[str, Any]]] = None, next_check_at: Optional[int] = None, max_age: int = 0) -> int:
+    with USER_CHECK_SECONDS.time("manual" if force_send else "scheduled"):
+        return await _check_and_notify_for_user(bot, telegram_id, force_send, update_names, specific_route_id, on_route_deleted, shard, due_routes, next_check_at, max_age)
+
+
+async def _check_and_notify_for_user(bot: Bot, telegram_id: int, force_send: bool, update_names: bool, specific_route_id: Optional[int], on_route_deleted, shard: Optional[Tuple[int, int]],
+                                     due_routes: Optional[List[Dict[str, Any]]], next_check_at: Optional[int], max_age: int) -> int:
     # force_send: if True, sends message regardless of state/schedule (manual check)
     # update_names: if True, tries to resolve localized station names even if tickets not found
     # specific_route_id: if set, only check/notify this route (used for "immediate check" on creation)
-    
-    user = await get_user(telegram_id)
+    # shard: (index, count) - only check routes whose route_shard() equals index
+    # due_routes: this user's rows from list_due_routes (scheduler ticks), with user and state included
+    # next_check_at: stored on every checked route; the route is due again from then on
+    # max_age: manual checks reuse a route's stored result up to this many seconds old, and with
+    #          CHECK_REFRESH fetch it again after sending and edit the message if it changed
+
+    if due_routes:
+        user = {"telegram_id": telegram_id, "language": due_routes[0]["language"], "notify_mode": due_routes[0]["notify_mode"]}
+    else:
+        user = await get_user(telegram_id)
     lang = user["language"]
     mode = user["notify_mode"]
 
-    routes = await list_routes(telegram_id)
-    logger.info(f"Checking routes for {telegram_id}: found {len(routes)} routes")
+    routes = due_routes or await list_routes(telegram_id)
+    logger.debug("Checking routes for %s: found %d routes", telegram_id, len(routes))
     if not routes:
         if force_send and not specific_route_id:
             await bot.send_message(telegram_id, t(lang, "no_routes"))
         return 0
 
+    if specific_route_id:
+        routes = [r for r in routes if r["id"] == specific_route_id]
+    if shard:
+        routes = [r for r in routes if route_shard(r, shard[1]) == shard[0]]
+
     sent_count = 0
+    stored_results = await get_route_results(telegram_id, int(time.time()) - max_age) if force_send and max_age > 0 else {}
     from api import search_stations # Import locally to avoid circular if any
 
-    for route in routes:
-        if specific_route_id and route["id"] != specific_route_id:
-            continue
+    async def check_route(route: Dict[str, Any]) -> Optional[_Due]:
+        # The route's notification if one is due
+        span = tracing.route_span(telegram_id, route["id"])
 
-        # --- EXPIRED ROUTE CHECK ---
-        # Delete route if travel date has already passed (Tashkent time UTC+5)
+        logger.debug("Checking route %s...", route["id"])
         try:
-            tz_uz = timezone(timedelta(hours=5))
-            today = datetime.now(tz_uz).date()
-            travel_date = datetime.strptime(route["travel_date"], "%Y-%m-%d").date()
-            if travel_date < today:
-                await delete_route(route["id"])
-                logger.info(f"Route {route['id']} deleted: travel date {route['travel_date']} has passed")
-                try:
-                    date_ui = fmt_date_for_ui(lang, route["travel_date"])
-                    expired_text = t(lang, "route_expired").format(
-                        from_=route["from_name"],
-                        to_=route["to_name"],
-                        date=date_ui,
-                    )
-                    await bot.send_message(telegram_id, expired_text)
-                except Exception as e:
-                    logger.warning(f"Failed to send expired route notification: {e}")
-                if on_route_deleted:
-                    try:
-                        await on_route_deleted(telegram_id)
-                    except Exception as e:
-                        logger.warning(f"on_route_deleted callback error: {e}")
-                continue
-        except Exception as e:
-            logger.error(f"Error checking expiry for route {route['id']}: {e}")
-        # --- END EXPIRED ROUTE CHECK ---
-
-        logger.info(f"Checking route {route['id']}...")
-        try:
-            api_json = await fetch_trains(route["from_code"], route["to_code"], route["travel_date"], lang)
+            stored = stored_results.get(route["id"])
+            if stored is not None:
+                # Manual check right after another one: answer with what that found
+                result, fetched_at = stored
+            else:
+                # Manual checks go ahead of ticks for upstream slots
+                result = await fetch_route_result(route, INTERACTIVE if force_send else BACKGROUND, span)
+                fetched_at = int(time.time())
+            api_json = result_response(result)
             
             # --- START LOCALIZATION UPDATE ---
             loc_from = ""
@@ -462,73 +610,67 @@ async def check_and_notify_for_user(bot: Bot, telegram_id: int, force_send: bool
             # 1. FORCE UPDATE (Language Switch)
             # User strategy: take existing name, search with new lang, find matching code.
             if update_names:
-                try:
-                    # FROM
-                    res = await search_stations(route["from_name"], lang)
-                    for s in res:
-                        if str(s.get("code")) == str(route["from_code"]):
-                            loc_from = s.get("name")
-                            break
-                    # TO
-                    res = await search_stations(route["to_name"], lang)
-                    for s in res:
-                        if str(s.get("code")) == str(route["to_code"]):
-                            loc_to = s.get("name")
-                            break
-                except Exception as e:
-                    logger.warning(f"Force localization search failed: {e}")
-
-            # 2. Extract from API Response (Normal Operation)
+                with span.phase("fetch"):
+                    try:
+                        # FROM
+                        res = await search_stations(route["from_name"], lang)
+                        for s in res:
+                            if str(s.get("code")) == str(route["from_code"]):
+                                loc_from = s.get("name")
+                                break
+                        # TO
+                        res = await search_stations(route["to_name"], lang)
+                        for s in res:
+                            if str(s.get("code")) == str(route["to_code"]):
+                                loc_to = s.get("name")
+                                break
+                    except Exception as e:
+                        logger.warning("Force localization search failed: %s", e)
+
+            # 2. Extract from API Response (Normal Operation), which is in UPSTREAM_LANG
             # Only if not already set by forced update
-            if not loc_from or not loc_to:
+            if (not loc_from or not loc_to) and lang == UPSTREAM_LANG:
                 try:
-                    data = api_json.get("data", {})
-                    directions = data.get("directions", [])
-                    forward = None
-                    if isinstance(directions, list) and directions: forward = directions[0]
-                    elif isinstance(directions, dict) and directions: forward = next(iter(directions.values()))
-                    
-                    if forward:
-                        trains = forward.get("trains", [])
-                        if trains:
-                            ft = trains[0]
-                            # Only update if still empty
-                            if not loc_from:
-                                loc_from = ft.get("departureStation", "")
-                            if not loc_to:
-                                loc_to = ft.get("arrivalStation", "")
+                    trains = _forward_trains(api_json)
+                    if trains:
+                        ft = trains[0]
+                        # Only update if still empty
+                        if not loc_from:
+                            loc_from = ft.get("departureStation", "")
+                        if not loc_to:
+                            loc_to = ft.get("arrivalStation", "")
                 except:
                     pass
 
+            # 3. Station catalogue (names seen in stations responses), for the other languages
+            if not loc_from:
+                loc_from = station_catalogue.name_for(route["from_code"], lang) or ""
+            if not loc_to:
+                loc_to = station_catalogue.name_for(route["to_code"], lang) or ""
+
             # Apply updates
-            if loc_from and loc_from != route["from_name"]:
-                await update_route_field(route["id"], "from_name", loc_from)
-                route["from_name"] = loc_from
-            
-            if loc_to and loc_to != route["to_name"]:
-                await update_route_field(route["id"], "to_name", loc_to)
-                route["to_name"] = loc_to
+            with span.phase("state_write"):
+                if loc_from and loc_from != route["from_name"]:
+                    await update_route_field(route["id"], "from_name", loc_from)
+                    route["from_name"] = loc_from
+                
+                if loc_to and loc_to != route["to_name"]:
+                    await update_route_field(route["id"], "to_name", loc_to)
+                    route["to_name"] = loc_to
             # --- END LOCALIZATION UPDATE ---
 
-            available, text = await build_route_message(lang, route, api_json)
-            logger.info(f"Available: {available}, Text len: {len(text)}")
+            with span.phase("render"):
+                available, text = await render_result(lang, route, result, fetched_at)
+            logger.debug("Route %s: available=%s, text len=%d", route["id"], available, len(text))
             
             # State & Notification Logic
-            last_av, last_check, notif_sent, last_notified_iso = await get_route_state(route["id"])
+            with span.phase("state_read"):
+                if "state" in route:
+                    last_av, last_check, notif_sent, notify_at = route["state"]
+                else:
+                    last_av, last_check, notif_sent, notify_at = await get_route_state(route["id"])
             
-            emoji_to_send = "🎉" if available else "😔"
-
             user_notify_mode = user.get("notify_mode", "always")
-            
-            last_notified_time = None
-            if last_notified_iso:
-                try: 
-                    last_notified_time = datetime.fromisoformat(last_notified_iso)
-                    logger.info(f"Route {route['id']}: last_notified_iso={last_notified_iso}, parsed to {last_notified_time}")
-                except Exception as e:
-                    logger.error(f"Route {route['id']}: Failed to parse last_notified_iso={last_notified_iso}: {e}")
-            else:
-                logger.info(f"Route {route['id']}: last_notified_iso is NULL/None")
 
             should_send = False
             
@@ -547,30 +689,13 @@ async def check_and_notify_for_user(bot: Bot, telegram_id: int, force_send: bool
                     # Always send "no tickets" every 30 minutes
                     # Reset streak counter if it was active
                     if notif_sent > 0:
-                        await reset_notification_count(route["id"])
+                        with span.phase("state_write"):
+                            await reset_notification_count(route["id"])
                     
-                    # Check 30-minute throttle
-                    if not last_notified_time:
-                         # New route - don't send immediately.
-                         should_send = False
-                         logger.info(f"Route {route['id']}: New route, waiting for next boundary")
-                    else:
-                         now = datetime.now()
-                         # Determine the most recent 30-minute boundary
-                         if now.minute < 30:
-                             boundary = now.replace(minute=0, second=0, microsecond=0)
-                         else:
-                             boundary = now.replace(minute=30, second=0, microsecond=0)
-                         
-                         # If last notification was BEFORE this boundary, it means we entered a new block
-                         if last_notified_time < boundary:
-                             should_send = True
-                             logger.info(f"Route {route['id']}: Boundary {boundary} passed (last: {last_notified_time}). Sending.")
-                         else:
-                             should_send = False
-                             minutes_until_next = 30 - (now.minute % 30)
-                             if (now.minute % 5) == 0:
-                                 logger.info(f"Route {route['id']}: Waiting for next boundary ({minutes_until_next} min left). Last: {last_notified_time}")
+                    # 30-minute throttle: next_notify_at is the first boundary after the last
+                    # notification (NULL = never notified, wait until tickets show up)
+                    should_send = notify_at is not None and time.time() >= notify_at
+                    logger.debug("Route %s: next reminder at %s, sending=%s", route["id"], notify_at, should_send)
                 
                 elif user_notify_mode == "on_available":
                     # MODE 2: "Только при появлении билетов"
@@ -579,58 +704,363 @@ async def check_and_notify_for_user(bot: Bot, telegram_id: int, force_send: bool
                     if notif_sent > 0:
                         # Tickets disappeared during active streak - send ONE notification
                         should_send = True
-                        logger.info(f"Route {route['id']}: Tickets disappeared during streak (count was {notif_sent}), sending ONE 'no tickets' message")
-                        await reset_notification_count(route["id"])
+                        logger.info("Route %s: Tickets disappeared during streak (count was %d), sending ONE 'no tickets' message", route["id"], notif_sent)
+                        with span.phase("state_write"):
+                            await reset_notification_count(route["id"])
                     else:
                         # No active streak - stay silent
                         should_send = False
 
-            if should_send:
-                try:
-                    logger.info(f"Route {route['id']}: SENDING notification (available={available}, mode={user_notify_mode}, count={notif_sent})")
-                    await bot.send_message(telegram_id, text)
-                    sent_count += 1
-                    
-                    # Update last_notified
-                    await update_last_notified(route["id"])
+            # Update state
+            with span.phase("state_write"):
+                await set_route_state(route["id"], available, next_check_at, None if stored else result, fetched_at)
+            ROUTES_CHECKED.inc("available" if available else "none")
 
-                    # Send emoji as separate message
-                    await bot.send_message(telegram_id, emoji_to_send)
-                    
-                    if available:
-                        # Increment count
-                        count = await increment_notification_count(route["id"])
-                        logger.info(f"Route {route['id']}: Notification count now {count}/5")
-                        if count >= 5: # Limit reached
-                            # Auto-delete
-                            await delete_route(route["id"])
-                            # Send ✅ as separate message
-                            await bot.send_message(telegram_id, "✅")
-                            logger.info(f"Route {route['id']}: Deleted after 5 notifications")
-                            if on_route_deleted:
-                                try:
-                                    await on_route_deleted(telegram_id)
-                                except Exception as e:
-                                    logger.warning(f"on_route_deleted callback error: {e}")
-                except Exception as e:
-                    logger.error(f"Send error: {e}")
+            if should_send:
+                logger.info("Route %s: notification due (available=%s, mode=%s, count=%d)", route["id"], available, user_notify_mode, notif_sent)
+                return _Due(route, span, text, available, notif_sent, stored is not None)
             else:
-                logger.info(f"Route {route['id']}: SKIPPING notification (available={available}, mode={user_notify_mode}, last_notified={last_notified_iso})")
-            
-            # Update state
-            await set_route_state(route["id"], available)
+                logger.debug("Route %s: SKIPPING notification (available=%s, mode=%s, next_notify_at=%s)", route["id"], available, user_notify_mode, notify_at)
+                span.finish("skipped")
 
         except Exception as e:
-            logger.error(f"Error checking route {route['id']}: {e}")
-            if force_send:
+            ROUTES_CHECKED.inc("error")
+            span.finish("error")
+            logger.error("Error checking route %s: %s", route["id"], e)
+            if progress:
+                # Reported once for all routes when the check is done
+                progress.failed += 1
+            elif force_send:
                 await bot.send_message(telegram_id, f"{t(lang, 'unknown_error')}\nDebug: {str(e)}")
-            continue
-    
+        return None
+
+    progress = None
+    if force_send and not specific_route_id and routes:
+        # Manual check: a placeholder right away, the routes checked concurrently
+        # and the placeholder edited as they finish; the digest then replaces it
+        progress = _Progress(bot, telegram_id, lang, len(routes))
+        await progress.start()
+
+        async def check_and_report(i: int, route: Dict[str, Any]) -> Optional[_Due]:
+            d = await check_route(route)
+            await progress.finished(i, d)
+            return d
+
+        due = await asyncio.gather(*(check_and_report(i, route) for i, route in enumerate(routes)))
+    else:
+        due = [await check_route(route) for route in routes]
+    due = [d for d in due if d is not None]
+
+    placeholder = await progress.close() if progress else None
+    if due:
+        sent_count, messages = await _send_digest(bot, telegram_id, due, on_route_deleted, placeholder)
+        if progress and progress.failed:
+            await bot.send_message(telegram_id, t(lang, "check_failed").format(n=progress.failed))
+        if CHECK_REFRESH and any(d.stored for d in due):
+            # In the background: the handler (and its rate-limit slot) is done once the answer is sent
+            task = asyncio.create_task(_refresh_digest(bot, telegram_id, lang, due, messages))
+            _refresh_tasks.add(task)
+            task.add_done_callback(_refresh_tasks.discard)
+    elif progress:
+        text = t(lang, "check_failed").format(n=progress.failed) if progress.failed else t(lang, "check_nothing_new")
+        try:
+            if placeholder:
+                await bot.edit_message_text(text, chat_id=telegram_id, message_id=placeholder)
+            else:
+                await bot.send_message(telegram_id, text)
+        except Exception as e:
+            logger.warning("Check result send error: %s", e)
     return sent_count
 
 
-async def scheduler_tick(bot: Bot, on_route_deleted=None):
-    # every 5 minutes (User requested 5 mins for testing)
-    uids = await list_users()
-    for uid in uids:
-        await check_and_notify_for_user(bot, uid, force_send=False, on_route_deleted=on_route_deleted)
+# Background refreshes of manual check answers (see _refresh_digest), referenced until done
+_refresh_tasks: Set[asyncio.Task] = set()
+
+class _Due(NamedTuple):
+    route: Dict[str, Any]
+    span: Any
+    text: str
+    available: bool
+    notif_sent: int
+    stored: bool = False  # text made from a stored result, not a fetch
+
+def pack_digest(blocks: List[str], limit: int = MESSAGE_LIMIT) -> List[Tuple[str, List[int]]]:
+    """
+    Join route blocks into as few messages as fit in limit; a block longer
+    than that is split on its own. Returns (text, indexes of the blocks in it).
+    """
+    parts: List[Tuple[str, List[int]]] = []
+    cur, ids = "", []
+    for i, block in enumerate(blocks):
+        joined = f"{cur}\n\n{block}" if cur else block
+        if len(joined) <= limit:
+            cur, ids = joined, ids + [i]
+            continue
+        if cur:
+            parts.append((cur, ids))
+        pieces = split_message(block, limit)
+        parts.extend((piece, [i]) for piece in pieces[:-1])
+        cur, ids = pieces[-1], [i]
+    if cur:
+        parts.append((cur, ids))
+    return parts
+
+def _digest_block(d: _Due, last: bool = False) -> str:
+    # last: the route's final notification (it is deleted after it)
+    block = f"{'🎉' if d.available else '😔'} {d.text}"
+    return block + "\n\n✅" if last else block
+
+def _digest_blocks(due: List[_Due], last: Set[int]) -> List[str]:
+    # last: indexes of routes getting their final notification
+    return [_digest_block(d, i in last) for i, d in enumerate(due)]
+
+def _last_notifications(due: List[_Due]) -> Set[int]:
+    return {i for i, d in enumerate(due) if d.available and d.notif_sent + 1 >= 5}
+
+async def _send_digest(bot: Bot, telegram_id: int, due: List[_Due], on_route_deleted,
+                       placeholder: Optional[int] = None) -> Tuple[int, List[Tuple[int, str]]]:
+    """
+    Send a user's due route notifications as one message (a few when
+    MESSAGE_LIMIT forces a split) with the 🎉 / 😔 / ✅ markers folded into
+    each route's block, then record the routes that were delivered.
+    placeholder: id of a message to edit into the first part instead of sending it.
+    Returns how many routes were notified and the (message id, text) sent.
+    """
+    parts = pack_digest(_digest_blocks(due, _last_notifications(due)))
+
+    # The send is one operation for all routes: its time goes to the first route's span
+    failed, messages = set(), []
+    with due[0].span.phase("send"):
+        for n, (part, ids) in enumerate(parts):
+            try:
+                if n == 0 and placeholder:
+                    await bot.edit_message_text(part, chat_id=telegram_id, message_id=placeholder)
+                    messages.append((placeholder, part))
+                else:
+                    message = await bot.send_message(telegram_id, part)
+                    messages.append((message.message_id, part))
+                DIGEST_MESSAGES.inc()
+            except Exception as e:
+                logger.error("Send error: %s", e)
+                failed.update(i for _, rest in parts[n:] for i in rest)
+                break
+
+    sent_count, deleted = 0, False
+    for i, d in enumerate(due):
+        route, span = d.route, d.span
+        if i in failed:
+            span.finish("error")
+            continue
+        sent_count += 1
+        NOTIFICATIONS_SENT.inc("1" if d.available else "0")
+        try:
+            with span.phase("state_write"):
+                await update_last_notified(route["id"])
+                if d.available:
+                    count = await increment_notification_count(route["id"])
+                    logger.debug("Route %s: Notification count now %d/5", route["id"], count)
+                    if count >= 5: # Limit reached
+                        await delete_route(route["id"])
+                        deleted = True
+                        logger.info("Route %s: Deleted after 5 notifications", route["id"])
+        except Exception as e:
+            logger.error("Error recording notification for route %s: %s", route["id"], e)
+        span.finish("sent")
+    if deleted and on_route_deleted:
+        try:
+            await on_route_deleted(telegram_id)
+        except Exception as e:
+            logger.warning("on_route_deleted callback error: %s", e)
+    return sent_count, messages
+
+class _Progress:
+    """
+    The placeholder message of a manual check: posted before any route is
+    checked, then edited with the routes finished so far (in route order)
+    at most once per PROGRESS_EDIT_INTERVAL, Telegram's edit rate limits
+    being per chat. close() hands it over to _send_digest.
+    """
+
+    def __init__(self, bot: Bot, telegram_id: int, lang: str, total: int):
+        self.bot, self.telegram_id, self.lang, self.total = bot, telegram_id, lang, total
+        self.message_id: Optional[int] = None
+        self.blocks: Dict[int, str] = {}
+        self.done = 0
+        self.failed = 0  # routes whose check raised
+        self._edited_at = 0.0
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    def _text(self) -> str:
+        line = t(self.lang, "checking_routes").format(done=self.done, total=self.total)
+        # Only the first message's worth: the rest shows up in the digest
+        return pack_digest([line] + [self.blocks[i] for i in sorted(self.blocks)])[0][0]
+
+    async def start(self) -> None:
+        try:
+            message = await self.bot.send_message(self.telegram_id, self._text())
+            self.message_id = message.message_id
+            self._edited_at = time.monotonic()
+        except Exception as e:
+            logger.warning("Placeholder send error: %s", e)
+
+    async def finished(self, index: int, due: Optional[_Due]) -> None:
+        self.done += 1
+        if due is not None:
+            self.blocks[index] = _digest_block(due)
+        if self.message_id is None or self.done == self.total or time.monotonic() - self._edited_at < PROGRESS_EDIT_INTERVAL:
+            return  # the last route's result goes straight into the digest
+        self._edited_at = time.monotonic()
+        async with self._lock:
+            if self._closed:
+                return
+            try:
+                await self.bot.edit_message_text(self._text(), chat_id=self.telegram_id, message_id=self.message_id)
+            except Exception as e:
+                logger.warning("Placeholder edit error: %s", e)
+
+    async def close(self) -> Optional[int]:
+        # No more progress edits (waits for one in flight); returns the placeholder's id
+        async with self._lock:
+            self._closed = True
+        return self.message_id
+
+async def _refresh_digest(bot: Bot, telegram_id: int, lang: str, due: List[_Due], messages: List[Tuple[int, str]]) -> None:
+    """
+    Fetch the routes a manual check answered from stored results and edit
+    the messages just sent where the text changed. Notification counts stay
+    as the first answer left them; only the stored result is updated.
+    """
+    last, fresh = _last_notifications(due), []
+    for i, d in enumerate(due):
+        if not d.stored or i in last:  # a route's final notification: it is deleted already
+            fresh.append(d)
+            continue
+        try:
+            result = await fetch_route_result(d.route, INTERACTIVE)
+            fetched_at = int(time.time())
+            available, text = await render_result(lang, d.route, result, fetched_at)
+            await set_route_state(d.route["id"], available, result=result, fetched_at=fetched_at)
+            fresh.append(d._replace(text=text, available=available))
+        except Exception as e:
+            logger.warning("Refresh of route %s failed: %s", d.route["id"], e)
+            fresh.append(d)
+    parts = pack_digest(_digest_blocks(fresh, last))
+    for n, (part, _) in enumerate(parts):
+        try:
+            if n >= len(messages):
+                await bot.send_message(telegram_id, part)
+            elif part != messages[n][1]:
+                await bot.edit_message_text(part, chat_id=telegram_id, message_id=messages[n][0])
+        except Exception as e:
+            logger.warning("Refresh edit error: %s", e)
+
+
+async def sweep_expired_routes() -> int:
+    """
+    Delete all routes whose travel date has passed (Tashkent time) in one
+    transaction; the "route expired" messages go through the task queue.
+    Runs once after midnight and at startup, so ticks only see live routes.
+    """
+    today = datetime.now(TZ_UZ).date().isoformat()
+    count = await expire_routes(today)
+    if count:
+        logger.info("Expired routes swept: %d (travel date before %s)", count, today)
+    return count
+
+async def notify_route_expired(bot: Bot, telegram_id: int, route: Dict[str, Any]) -> None:
+    user = await get_user(telegram_id)
+    lang = user["language"] if user else "ru"
+    await bot.send_message(telegram_id, t(lang, "route_expired").format(
+        from_=route["from_name"],
+        to_=route["to_name"],
+        date=fmt_route_dates(lang, route["travel_date"], route.get("travel_date_to"), route.get("return_date")),
+    ))
+
+def next_tick_at(after: float) -> int:
+    # First tick slot (TICK_INTERVAL boundary + TICK_OFFSET) at or after `after`, as a unix epoch
+    return -(-(int(after) - TICK_OFFSET) // TICK_INTERVAL) * TICK_INTERVAL + TICK_OFFSET
+
+def last_tick_at(now: float) -> int:
+    # Latest tick slot at or before `now`
+    return (int(now) - TICK_OFFSET) // TICK_INTERVAL * TICK_INTERVAL + TICK_OFFSET
+
+# Graceful shutdown: drain() stops new ticks and lets the running one finish
+# its current user. Nothing else is saved: route_state.next_check_at already
+# records which routes the tick got through, and resume_tick() in the next
+# process checks the rest instead of leaving them for the next slot.
+_stopping = False
+_tick_task: Optional[asyncio.Task] = None
+
+async def scheduler_tick(bot: Bot, on_route_deleted=None, shard: Optional[Tuple[int, int]] = None,
+                         started_at: Optional[int] = None, leased: bool = False):
+    # every TICK_INTERVAL (bot.start_scheduler)
+    # leased: only routes in the slots this worker holds (leases.py), each claimed before its check
+    global _tick_task
+    if _stopping:
+        return
+    if _tick_task is not None and not _tick_task.done():
+        logger.warning("Tick skipped: previous tick still running")
+        return
+    _tick_task = asyncio.current_task()
+    started_at = started_at or int(time.time())
+    start = time.perf_counter()
+    trace = tracing.start_tick()
+    uids = []
+    try:
+        # Only routes whose next_check_at has come, grouped per user (rows are ordered by telegram_id).
+        # Checked routes become due half an interval later: skipped by a re-run of this tick,
+        # picked up by the next one even if the cron fires a little early
+        rows = await list_due_routes(started_at)
+        if leased:
+            slots = leases.owned()
+            rows = [r for r in rows if route_shard(r, LEASE_SLOTS) in slots]
+        due = [(uid, list(rows)) for uid, rows in itertools.groupby(rows, key=lambda r: r["telegram_id"])]
+        uids = [uid for uid, _ in due]
+        next_check_at = started_at + TICK_INTERVAL // 2
+        for uid, rows in due:
+            if _stopping:
+                break
+            if leased:
+                # Another worker may have taken the slot over and checked these already, or still be
+                # checking them in a tick that overran: claimed routes are held until they are done
+                # (a worker that dies meanwhile costs them one tick), with their state as of the claim
+                claimed = await claim_due_routes([r["id"] for r in rows], started_at, next_check_at + TICK_INTERVAL)
+                rows = [dict(r, state=claimed[r["id"]]) for r in rows if r["id"] in claimed]
+                try:
+                    if rows:
+                        await check_and_notify_for_user(bot, uid, force_send=False, on_route_deleted=on_route_deleted,
+                                                        due_routes=rows)
+                finally:
+                    await release_routes(list(claimed), next_check_at)
+            else:
+                await check_and_notify_for_user(bot, uid, force_send=False, on_route_deleted=on_route_deleted, shard=shard,
+                                                due_routes=rows, next_check_at=next_check_at)
+    finally:
+        _tick_task = None
+        await tracing.finish_tick(trace)
+    TICK_SECONDS.observe(time.perf_counter() - start)
+    TICK_USERS.set(len(uids))
+    TICK_LAST.set(time.time())
+
+async def resume_tick(bot: Bot, on_route_deleted=None, shard: Optional[Tuple[int, int]] = None) -> None:
+    """Finish this slot's tick if the previous process was stopped in the middle of it."""
+    started_at = last_tick_at(time.time())
+    # Routes the interrupted tick got through are due only after started_at; the rest are still due by it
+    if not await checked_since(started_at):
+        return
+    logger.info("Resuming the tick started at %s", datetime.fromtimestamp(started_at, TZ_UZ).strftime("%H:%M:%S"))
+    await scheduler_tick(bot, on_route_deleted, shard, started_at=started_at)
+
+async def drain(timeout: float) -> None:
+    """Stop starting ticks; wait up to timeout for the running one to reach a user boundary, then cancel it."""
+    global _stopping
+    _stopping = True
+    task = _tick_task
+    if task is None or task.done():
+        return
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if not done:
+        logger.warning("Tick still running after %.1fs, cancelling", timeout)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
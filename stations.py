@@ -0,0 +1,87 @@
+"""
+Station catalogue: station code -> name per language.
+
+Filled from stations API responses (api.search_stations) and persisted in the
+`stations` table, so other modules can resolve a code to a localized name
+without another upstream request.
+"""
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from db import save_stations, load_stations
+
+logger = logging.getLogger("railway_bot")
+
+_names: Dict[str, Dict[str, str]] = {}   # { code: { lang: name } }
+_codes: Dict[Tuple[str, str], str] = {}  # { (lang, name): code }
+_loaded = False
+
+
+async def load() -> None:
+    """Read the persisted catalogue once per process."""
+    global _loaded
+    if _loaded:
+        return
+    for code, lang, name in await load_stations():
+        _names.setdefault(code, {})[lang] = name
+        _codes[(lang, name)] = code
+    _loaded = True
+    logger.info("Station catalogue loaded: %d stations", len(_names))
+
+
+async def remember(lang: str, stations: List[Dict[str, Any]]) -> None:
+    """Record code/name pairs from a stations response; only new names hit the DB."""
+    await load()
+    fresh = []
+    for s in stations:
+        code, name = str(s.get("code", "")), s.get("name", "")
+        if not code or not name:
+            continue
+        known = _names.setdefault(code, {})
+        if known.get(lang) != name:
+            known[lang] = name
+            _codes[(lang, name)] = code
+            fresh.append((code, name))
+    if fresh:
+        try:
+            await save_stations(lang, fresh)
+        except Exception as e:
+            logger.warning("Failed to persist %d stations: %s", len(fresh), e)
+
+
+def name_for(code: str, lang: str) -> Optional[str]:
+    return _names.get(str(code), {}).get(lang)
+
+
+def translate(name: str, from_lang: str, to_lang: str) -> str:
+    """A station name in from_lang as named in to_lang, or unchanged when the catalogue doesn't know it."""
+    if from_lang == to_lang:
+        return name
+    code = _codes.get((from_lang, name))
+    return (code and name_for(code, to_lang)) or name
+
+
+def pack(stations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compact form of a stations list for storage. Codes only when every name can
+    be restored from the catalogue in one language, otherwise [code, name] pairs.
+    """
+    codes = [str(s.get("code", "")) for s in stations]
+    if stations:
+        by_lang = _names.get(codes[0], {})
+        for lang in by_lang:
+            if all(name_for(c, lang) == s.get("name") for c, s in zip(codes, stations)):
+                return {"lang": lang, "codes": codes}
+    return {"pairs": [[c, s.get("name", "")] for c, s in zip(codes, stations)]}
+
+
+def unpack(packed: Dict[str, Any]) -> List[Dict[str, str]]:
+    if "pairs" in packed:
+        return [{"code": c, "name": n} for c, n in packed["pairs"]]
+    lang = packed.get("lang", "")
+    out = []
+    for code in packed.get("codes", []):
+        name = name_for(code, lang)
+        if name:
+            out.append({"code": code, "name": name})
+    return out
@@ -0,0 +1,18 @@
+"""
+Unit tests for the pure parts of the bot: parsers, formatters, packing.
+
+config.py reads the environment at import, so a throwaway token, database
+and log file are set up before any test module imports the bot's modules.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="railway_tests_")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ["DB_PATH"] = os.path.join(_tmp, "test.sqlite3")
+os.environ["LOG_FILE"] = os.path.join(_tmp, "bot.log")
+os.environ["LOG_LEVEL"] = "WARNING"
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import api
+from api import BACKGROUND, INTERACTIVE, fetch_trains_shared
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """api_post replaced by a fake recording the trains requests (by date) in the order they are sent."""
+    sent = []
+
+    async def api_post(url, lang, payload):
+        date = payload["directions"]["forward"]["date"]
+        sent.append(date)
+        await asyncio.sleep(0)
+        return {"data": {"date": date}}
+
+    monkeypatch.setattr(api, "api_post", api_post)
+    monkeypatch.setattr(api, "_trains_cache", {})
+    monkeypatch.setattr(api, "_trains_inflight", {})
+    return sent
+
+
+def test_interactive_caller_joins_a_background_fetch_that_has_not_started(upstream):
+    async def main():
+        # No yield in between: the background fetch's task has not run yet when the interactive caller joins
+        return await asyncio.gather(
+            fetch_trains_shared("2900000", "2900700", "2026-03-05", priority=BACKGROUND),
+            fetch_trains_shared("2900000", "2900700", "2026-03-05", priority=INTERACTIVE),
+        )
+
+    first, second = asyncio.run(main())
+    assert first is second
+    assert upstream == ["2026-03-05"]
+
+
+def test_joining_interactive_caller_moves_a_queued_fetch_ahead(upstream):
+    async def main():
+        api._slots_reset()
+        api._slots_free = 0  # every upstream slot busy
+        fetches = [
+            asyncio.create_task(fetch_trains_shared("2900000", "2900700", "2026-03-05", priority=BACKGROUND)),
+            asyncio.create_task(fetch_trains_shared("2900000", "2900700", "2026-03-06", priority=BACKGROUND)),
+            asyncio.create_task(fetch_trains_shared("2900000", "2900700", "2026-03-06", priority=INTERACTIVE)),
+        ]
+        await asyncio.sleep(0.01)
+        assert upstream == []
+        api._release_slot()
+        api._release_slot()
+        return await asyncio.gather(*fetches)
+
+    results = asyncio.run(main())
+    assert upstream == ["2026-03-06", "2026-03-05"]
+    assert results[1] is results[2]
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_fetch(upstream):
+    async def main():
+        first = asyncio.create_task(fetch_trains_shared("2900000", "2900700", "2026-03-05", priority=BACKGROUND))
+        second = asyncio.create_task(fetch_trains_shared("2900000", "2900700", "2026-03-05", priority=INTERACTIVE))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert isinstance(first, asyncio.CancelledError)
+    assert second == {"data": {"date": "2026-03-05"}}
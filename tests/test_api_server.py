@@ -0,0 +1,36 @@
+from aiohttp.test_utils import make_mocked_request
+
+from api_server import CAR_COLUMNS, _trains_payload
+
+CAR = {"type": "Купе", "free": 3, "price": "250,000", "tariff": 250000,
+       "up": 1, "down": 2, "lateral_up": 0, "lateral_down": 0}
+TRAIN = {"number": "127Ф", "dep_time": "08:00", "arr_time": "12:00", "cars_data": [CAR]}
+
+
+def payload(query: str = ""):
+    return _trains_payload(make_mocked_request("GET", "/api/routes/1/check" + query), [TRAIN])
+
+
+def test_legacy_schema_drops_numeric_tariff():
+    (train,) = payload()
+    assert train["number"] == "127Ф"
+    assert train["cars_data"] == [{k: v for k, v in CAR.items() if k != "tariff"}]
+
+
+def test_compact_schema_sends_cars_as_rows_with_numeric_price():
+    (train,) = payload("?compact=1")
+    cars = train["cars_data"]
+    assert cars["cols"] == CAR_COLUMNS
+    assert cars["rows"] == [["Купе", 3, 250000, 1, 2, 0, 0]]
+
+
+def test_fields_project_train_keys_in_either_schema():
+    assert payload("?fields=number,dep_time") == [{"number": "127Ф", "dep_time": "08:00"}]
+    (train,) = payload("?compact=true&fields=number,%20cars_data,")
+    assert set(train) == {"number", "cars_data"}
+    assert train["cars_data"]["rows"][0][2] == 250000
+
+
+def test_trains_are_not_modified():
+    payload("?compact=1")
+    assert TRAIN["cars_data"] == [CAR]
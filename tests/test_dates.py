@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+import pytest
+
+from bot import check_date_range, parse_date_range, parse_route_dates
+from config import MAX_RANGE_DAYS
+from scheduler import fmt_route_dates, return_leg
+
+
+def iso(days: int) -> str:
+    return (date.today() + timedelta(days=days)).isoformat()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5.3.2026", ("2026-03-05", None)),
+    ("05.03.2026-08.03.2026", ("2026-03-05", "2026-03-08")),
+    ("05.03.2026 - 08.03.2026", ("2026-03-05", "2026-03-08")),
+    ("05.03.2026 — 08.03.2026", ("2026-03-05", "2026-03-08")),
+    ("05.03.2026–08.03.2026", ("2026-03-05", "2026-03-08")),
+    ("05.03.2026-05.03.2026", ("2026-03-05", None)),
+    ("05-03-2026", ("2026-03-05", None)),
+])
+def test_parse_date_range(text, expected):
+    assert parse_date_range(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "tomorrow", "05.03.2026-", "05.03.2026-xx", "5.3.26-8.3.26"])
+def test_parse_date_range_rejects(text):
+    assert parse_date_range(text) is None
+
+
+def test_parse_route_dates_single_day_and_range():
+    assert parse_route_dates("05.03.2026") == ("2026-03-05", None, None)
+    assert parse_route_dates("05.03.2026-08.03.2026") == ("2026-03-05", "2026-03-08", None)
+
+
+def test_check_date_range():
+    assert check_date_range(iso(1), None) == ""
+    assert check_date_range(iso(1), iso(1 + MAX_RANGE_DAYS - 1)) == ""
+    assert check_date_range(iso(-1), None) == "date_past"
+    assert check_date_range(iso(3), iso(2)) == "bad_range"
+    assert check_date_range(iso(1), iso(1 + MAX_RANGE_DAYS)) == "bad_range"
+    assert check_date_range("2026-02-30", None) == "bad_date"
+
+
+def test_parse_route_dates_return_date():
+    assert parse_route_dates("05.03.2026, 08.03.2026") == ("2026-03-05", None, "2026-03-08")
+    assert parse_route_dates("5.3.2026,8.3.2026") == ("2026-03-05", None, "2026-03-08")
+    assert parse_route_dates("05.03.2026, soon") is None
+    assert parse_route_dates("05.03.2026-06.03.2026, 08.03.2026") is None
+
+
+def test_check_date_range_return_before_departure():
+    assert check_date_range(iso(2), None, iso(2)) == ""
+    assert check_date_range(iso(2), None, iso(1)) == "bad_return"
+
+
+def test_fmt_route_dates():
+    assert fmt_route_dates("en", "2026-03-05") == "5 March 2026"
+    assert fmt_route_dates("en", "2026-03-05", "2026-03-05") == "5 March 2026"
+    assert fmt_route_dates("en", "2026-03-05", "2026-03-06") == "5 March 2026 — 6 March 2026"
+    assert fmt_route_dates("en", "2026-03-05", None, "2026-03-08") == "5 March 2026 ⇄ 8 March 2026"
+
+
+def test_return_leg_swaps_stations_and_travels_on_the_return_date():
+    route = {"from_code": "2900000", "from_name": "Ташкент", "to_code": "2900700", "to_name": "Самарканд",
+             "travel_date": "2026-03-05", "travel_date_to": None, "return_date": "2026-03-08"}
+    back = return_leg(route)
+    assert (back["from_code"], back["to_code"]) == ("2900700", "2900000")
+    assert (back["from_name"], back["to_name"]) == ("Самарканд", "Ташкент")
+    assert (back["travel_date"], back["return_date"]) == ("2026-03-08", None)
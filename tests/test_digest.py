@@ -0,0 +1,41 @@
+from scheduler import MESSAGE_LIMIT, _Due, _digest_blocks, _last_notifications, pack_digest, split_message
+
+
+def test_blocks_that_fit_share_one_message():
+    assert pack_digest(["a", "b", "c"]) == [("a\n\nb\n\nc", [0, 1, 2])]
+
+
+def test_a_new_message_starts_when_the_next_block_does_not_fit():
+    blocks = ["a" * 6, "b" * 6, "c" * 3]
+    assert pack_digest(blocks, limit=14) == [("a" * 6 + "\n\n" + "b" * 6, [0, 1]), ("c" * 3, [2])]
+
+
+def test_an_oversized_block_is_split_on_its_own_and_its_tail_shared():
+    big = "x" * 8 + "\n" + "y" * 8
+    parts = pack_digest(["a", big, "b"], limit=11)
+    assert parts == [("a", [0]), ("x" * 8, [1]), ("y" * 8 + "\n\nb", [1, 2])]
+
+
+def test_every_block_lands_in_order_within_the_limit():
+    blocks = [("route %d\n" % i) * (i * 40) for i in range(1, 12)]
+    parts = pack_digest(blocks)
+    assert all(len(text) <= MESSAGE_LIMIT for text, _ in parts)
+    assert sorted({i for _, ids in parts for i in ids}) == list(range(len(blocks)))
+    assert [i for _, ids in parts for i in ids] == sorted(i for _, ids in parts for i in ids)
+
+
+def test_empty_digest():
+    assert pack_digest([]) == []
+
+
+def test_split_message_prefers_paragraphs_then_lines():
+    assert split_message("aaaa\n\nbbbb", limit=6) == ["aaaa", "bbbb"]
+    assert split_message("aaaa\nbbbb", limit=6) == ["aaaa", "bbbb"]
+    assert split_message("a" * 12, limit=5) == ["aaaaa", "aaaaa", "aa"]
+
+
+def test_digest_blocks_mark_availability_and_final_notifications():
+    due = [_Due({}, None, "one", True, 4), _Due({}, None, "two", False, 0), _Due({}, None, "three", True, 1)]
+    last = _last_notifications(due)
+    assert last == {0}
+    assert _digest_blocks(due, last) == ["🎉 one\n\n✅", "😔 two", "🎉 three"]
@@ -0,0 +1,86 @@
+import pytest
+
+from api_server import _filters_error
+from bot import parse_filters
+from scheduler import compile_filters, parse_ticket_info
+from tests.test_parser import car, response, train
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("купе, нижняя", {"car_types": ["kupe"], "berths": ["down"]}),
+    ("Kupe lower, platskart", {"car_types": ["kupe", "platskart"], "berths": ["down"]}),
+    ("боковые", {"berths": ["lateral"]}),
+    ("300000", {"max_price": 300000}),
+    ("300 000", {"max_price": 300000}),
+    ("300.000", {"max_price": 300000}),
+    ("1 250 000", {"max_price": 1250000}),
+    ("127Ф, №53", {"trains": ["127Ф", "53"]}),
+    ("127,300000", {"trains": ["127"], "max_price": 300000}),
+    ("купе; 127ф\n300 000", {"car_types": ["kupe"], "trains": ["127Ф"], "max_price": 300000}),
+    ("yo’q", {}),
+    ("-", {}),
+])
+def test_parse_filters(text, expected):
+    assert parse_filters(text) == (expected, "")
+
+
+def test_parse_filters_reports_the_unrecognised_part():
+    assert parse_filters("купе, окно") == (None, "окно")
+
+
+def test_compile_filters():
+    assert compile_filters(None) is None
+    assert compile_filters({"car_types": [], "trains": []}) is None
+    classes, berths, max_price, trains = compile_filters(
+        {"car_types": ["kupe"], "berths": ["lateral"], "max_price": 300000, "trains": ["053Ф", "127"]})
+    assert classes == {"kupe"}
+    assert berths == ("lateral_up", "lateral_down")
+    assert max_price == 300000
+    assert trains == {"53", "127"}
+
+
+def parse(filters, trains):
+    return parse_ticket_info(response(trains), compile_filters(filters))
+
+
+def test_filters_drop_other_car_classes_and_pricier_cars():
+    trains = [train(cars=[car("Плацкартный", tariff=150000), car("Купе", tariff=250000), car("Люкс", tariff=600000)])]
+    _, (t,), _ = parse({"car_types": ["kupe", "lux"], "max_price": 300000}, trains)
+    assert [c["type"] for c in t["cars_data"]] == ["Купе"]
+
+
+def test_berth_filter_counts_only_the_wanted_berths():
+    trains = [train(cars=[car(free=4, up=4, down=0), car(free=3, up=1, down=0, lateral_up=1, lateral_dn=1)])]
+    _, (t,), _ = parse({"berths": ["lateral"]}, trains)
+    (c,) = t["cars_data"]
+    assert (c["free"], c["up"], c["lateral_up"], c["lateral_down"]) == (2, 0, 1, 1)
+    assert parse({"berths": ["down"]}, trains) == (False, [], 0)
+
+
+def test_train_filter_matches_numbers_without_the_letter():
+    trains = [train("127Ф"), train("053Ф"), train("710Ч")]
+    _, found, _ = parse({"trains": ["53", "127f"]}, trains)
+    assert [t["number"] for t in found] == ["127Ф", "053Ф"]
+
+
+@pytest.mark.parametrize("filters", [
+    None, {}, {"car_types": ["kupe"], "berths": ["down", "lateral"], "max_price": 1, "trains": ["127Ф"]},
+    {"max_price": None},
+])
+def test_filters_error_accepts(filters):
+    assert _filters_error(filters) == ""
+
+
+@pytest.mark.parametrize("filters, field", [
+    (["kupe"], "filters"),
+    ({"seats": 2}, "filters"),
+    ({"car_types": ["bus"]}, "filters.car_types"),
+    ({"berths": ["middle"]}, "filters.berths"),
+    ({"max_price": True}, "filters.max_price"),
+    ({"max_price": 0}, "filters.max_price"),
+    ({"max_price": -5}, "filters.max_price"),
+    ({"max_price": "300000"}, "filters.max_price"),
+    ({"trains": "127Ф"}, "filters.trains"),
+])
+def test_filters_error_rejects(filters, field):
+    assert _filters_error(filters).startswith(field + ":")
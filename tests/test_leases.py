@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import db
+from scheduler import route_shard
+
+SLOTS, TTL = 8, 30
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "leases.sqlite3"))
+    asyncio.run(db.init_db())
+
+
+def renew(worker: str, now: int):
+    return asyncio.run(db.renew_leases(worker, SLOTS, TTL, now))
+
+
+def test_a_lone_worker_owns_every_slot():
+    assert renew("a", 1000) == list(range(SLOTS))
+
+
+def test_a_joining_worker_gets_its_share_once_the_owner_gives_slots_up():
+    renew("a", 1000)
+    assert renew("b", 1001) == []  # every slot is still leased to a
+    assert renew("a", 1002) == [0, 1, 2, 3]
+    assert renew("b", 1003) == [4, 5, 6, 7]
+
+
+def test_share_rounds_up_when_slots_do_not_divide_evenly():
+    for worker in "abc":
+        renew(worker, 1000)
+    mine = [renew(worker, 1001) for worker in "abc"]
+    assert [len(m) for m in mine] == [3, 3, 2]
+    assert sorted(s for m in mine for s in m) == list(range(SLOTS))
+
+
+def test_a_dead_workers_slots_are_taken_over_after_the_ttl():
+    renew("a", 1000)
+    renew("b", 1000)
+    renew("a", 1001)
+    assert renew("b", 1001) == [4, 5, 6, 7]
+    # b stops heartbeating; its leases run out after TTL
+    assert renew("a", 1000 + TTL) == [0, 1, 2, 3]
+    assert renew("a", 1002 + TTL) == list(range(SLOTS))
+
+
+def test_release_frees_the_slots_at_once():
+    renew("a", 1000)
+    renew("b", 1000)
+    renew("a", 1001)
+    renew("b", 1001)
+    asyncio.run(db.release_leases("b"))
+    assert renew("a", 1002) == list(range(SLOTS))
+
+
+def test_route_shard_depends_on_stations_and_date_only():
+    route = {"from_code": "2900000", "to_code": "2900700", "travel_date": "2026-03-05", "telegram_id": 1}
+    same = dict(route, telegram_id=2, return_date="2026-03-08")
+    assert route_shard(route, SLOTS) == route_shard(same, SLOTS)
+    assert 0 <= route_shard(route, SLOTS) < SLOTS
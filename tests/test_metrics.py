@@ -0,0 +1,49 @@
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+
+def test_counter_renders_help_type_and_labelled_samples():
+    c = Counter("test_requests_total", "Requests", ("method", "status"))
+    c.inc("get", "ok")
+    c.inc("get", "ok", amount=2)
+    c.inc("post", "error")
+    assert c.render() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{method="get",status="ok"} 3',
+        'test_requests_total{method="post",status="error"} 1',
+    ]
+
+
+def test_gauge_without_labels():
+    g = Gauge("test_users", "Users")
+    g.set(5)
+    g.set(7)
+    assert g.render()[1:] == ["# TYPE test_users gauge", "test_users 7"]
+
+
+def test_label_values_are_escaped():
+    c = Counter("test_escaped_total", "Escaping", ("path",))
+    c.inc('a"b\\c\nd')
+    assert c.render()[-1] == 'test_escaped_total{path="a\\"b\\\\c\\nd"} 1'
+
+
+def test_histogram_buckets_are_cumulative_with_inf_sum_and_count():
+    h = Histogram("test_seconds", "Latency", ("op",), buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 3):
+        h.observe(value, "read")
+    assert h.render()[2:] == [
+        'test_seconds_bucket{op="read",le="0.1"} 2',
+        'test_seconds_bucket{op="read",le="1"} 3',
+        'test_seconds_bucket{op="read",le="+Inf"} 4',
+        'test_seconds_sum{op="read"} 3.65',
+        'test_seconds_count{op="read"} 4',
+    ]
+
+
+def test_render_joins_every_registered_metric():
+    Counter("test_rendered_total", "Rendered").inc()
+    text = metrics.render()
+    assert text.endswith("\n")
+    assert "# TYPE test_rendered_total counter\ntest_rendered_total 1\n" in text
+    assert "# TYPE railway_telegram_request_seconds histogram" in text
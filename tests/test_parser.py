@@ -0,0 +1,46 @@
+from scheduler import parse_round_trip, parse_ticket_info
+
+
+def car(ctype="Купе", free=4, tariff=250000, up=2, down=2, lateral_up=0, lateral_dn=0):
+    return {"type": {"name": ctype}, "freeSeats": free, "tariffs": [{"tariff": tariff}],
+            "seatDetail": {"up": up, "down": down, "lateralUp": lateral_up, "lateralDn": lateral_dn}}
+
+
+def train(number="127Ф", cars=None):
+    return {"number": number, "brand": "Sharq", "cars": [car()] if cars is None else cars,
+            "departureDate": "05.03.2026 08:00", "arrivalDate": "05.03.2026 12:00", "timeOnWay": "04:00",
+            "originRoute": {"depStationName": "Ташкент", "arvStationName": "Самарканд"}}
+
+
+def response(*legs):
+    names = ("forward", "backward")
+    return {"data": {"directions": {name: {"trains": trains} for name, trains in zip(names, legs)}}}
+
+
+def test_parse_ticket_info_lists_trains_with_free_seats():
+    available, trains, _ = parse_ticket_info(response([train(), train("053Ф", cars=[car(free=0)])]))
+    assert available
+    assert [t["number"] for t in trains] == ["127Ф"]
+    (c,) = trains[0]["cars_data"]
+    assert (c["type"], c["free"], c["price"], c["tariff"]) == ("Купе", 4, "250,000", 250000)
+    assert trains[0]["dep_time"] == "05.03.2026 - 08:00"
+
+
+def test_parse_ticket_info_directions_as_list():
+    api_json = {"data": {"directions": [{"trains": [train()]}]}}
+    assert parse_ticket_info(api_json)[0]
+
+
+def test_parse_ticket_info_empty_response():
+    assert parse_ticket_info({}) == (False, [], 0)
+
+
+def test_parse_round_trip_one_result_per_leg():
+    there, back = parse_round_trip(response([train()], [train("128Ф", cars=[car(free=0)])]))
+    assert there[0] and [t["number"] for t in there[1]] == ["127Ф"]
+    assert back == (False, [], 0)
+
+
+def test_parse_round_trip_one_way_response():
+    assert len(parse_round_trip(response([train()]))) == 1
+    assert parse_round_trip({}) == [(False, [], 0)]
@@ -0,0 +1,40 @@
+import pytest
+
+import stations
+
+TASHKENT = {"code": "2900000", "name": "Ташкент"}
+SAMARKAND = {"code": "2900700", "name": "Самарканд"}
+
+
+@pytest.fixture(autouse=True)
+def catalogue(monkeypatch):
+    names = {"2900000": {"ru": "Ташкент", "en": "Tashkent"}, "2900700": {"ru": "Самарканд"}}
+    monkeypatch.setattr(stations, "_names", names)
+    monkeypatch.setattr(stations, "_codes", {(lang, n): c for c, by in names.items() for lang, n in by.items()})
+
+
+def test_pack_keeps_codes_only_when_the_catalogue_knows_every_name():
+    packed = stations.pack([TASHKENT, SAMARKAND])
+    assert packed == {"lang": "ru", "codes": ["2900000", "2900700"]}
+    assert stations.unpack(packed) == [TASHKENT, SAMARKAND]
+
+
+def test_pack_falls_back_to_pairs_for_unknown_names():
+    listed = [TASHKENT, {"code": "2900800", "name": "Бухара"}]
+    packed = stations.pack(listed)
+    assert packed == {"pairs": [["2900000", "Ташкент"], ["2900800", "Бухара"]]}
+    assert stations.unpack(packed) == listed
+
+
+def test_pack_falls_back_to_pairs_when_no_language_has_every_name():
+    listed = [{"code": "2900000", "name": "Tashkent"}, SAMARKAND]
+    assert "pairs" in stations.pack(listed)
+
+
+def test_pack_empty_and_codes_as_numbers():
+    assert stations.unpack(stations.pack([])) == []
+    assert stations.pack([{"code": 2900000, "name": "Ташкент"}]) == {"lang": "ru", "codes": ["2900000"]}
+
+
+def test_unpack_skips_codes_the_catalogue_no_longer_has():
+    assert stations.unpack({"lang": "en", "codes": ["2900000", "2900700"]}) == [{"code": "2900000", "name": "Tashkent"}]
@@ -19,13 +19,15 @@ TEXT: Dict[str, Dict[str, str]] = {
 
         "enter_from": "Введите название начального города:",
         "enter_to": "Введите название конечного города:",
-        "enter_date": "Введите дату (DD.MM.YYYY)",
+        "enter_date": "Введите дату (DD.MM.YYYY), диапазон дат (DD.MM.YYYY-DD.MM.YYYY) или даты туда и обратно через запятую (DD.MM.YYYY, DD.MM.YYYY)",
 
         "city_not_found": "❌ Не удалось найти город. Попробуйте ещё раз.",
         "bad_date": "❌ Неверный формат даты.",
+        "bad_range": "❌ Диапазон должен быть не длиннее {n} дней, конечная дата — не раньше начальной.",
+        "bad_return": "❌ Дата обратно должна быть не раньше даты туда.",
         "date_past": "❌ Дата уже прошла. Введите текущую или будущую дату:",
         "saved": "✅ Маршрут успешно установлен.",
-        "max_routes": "❌ У вас уже установлено максимальное количество маршрутов (5).",
+        "max_routes": "❌ У вас уже установлено максимальное количество маршрутов ({n}).",
 
         "no_routes": "📭 У вас ещё нет установленных маршрутов.",
         "route_deleted": "🗑 Маршрут успешно удалён.",
@@ -40,6 +42,10 @@ TEXT: Dict[str, Dict[str, str]] = {
         "edit_from": "🏙 Изменить начальную точку",
         "edit_to": "🏁 Изменить конечную точку",
         "edit_date": "📅 Изменить дату",
+        "edit_filters": "🎛 Фильтры мест",
+        "enter_filters": "Какие места подходят? Перечислите через запятую: тип вагона (плацкарт, купе, люкс, сидячий), полку (нижняя, верхняя, боковая), максимальную цену и номера поездов.\nНапример: купе, нижняя, 300000, 127Ф\nОтправьте «-», чтобы сбросить фильтры.",
+        "bad_filters": "❌ Не удалось разобрать: {w}",
+        "filters_label": "🎛 Фильтры: {f}",
         "updated": "✅ Данные успешно изменены.",
 
         "settings_title": "⚙️ Настройки",
@@ -59,6 +65,9 @@ TEXT: Dict[str, Dict[str, str]] = {
         "car_line": "{icon} {type_} — {seats} мест — от {price} сум",
         "train_number": "🚄 Поезд {num}",
         "unknown_error": "⚠️ Произошла ошибка. Попробуйте позже.",
+        "checking_routes": "🔍 Проверяю маршруты… {done}/{total}",
+        "check_failed": "⚠️ Не удалось проверить маршрутов: {n}. Попробуйте позже.",
+        "check_nothing_new": "✅ Маршруты проверены, сообщать пока не о чем.",
         "select_route": "📋 Ваши маршруты:",
         "seats_up": "Верхние",
         "seats_down": "Нижние",
@@ -91,13 +100,15 @@ TEXT: Dict[str, Dict[str, str]] = {
 
         "enter_from": "Boshlang‘ich shaharni kiriting:",
         "enter_to": "Yakuniy shaharni kiriting:",
-        "enter_date": "Sanani kiriting (DD.MM.YYYY)",
+        "enter_date": "Sanani (DD.MM.YYYY), sanalar oralig'ini (DD.MM.YYYY-DD.MM.YYYY) yoki borish va qaytish sanalarini vergul bilan (DD.MM.YYYY, DD.MM.YYYY) kiriting",
 
         "city_not_found": "❌ Shahar topilmadi. Qayta urinib ko‘ring.",
         "bad_date": "❌ Sana formati noto’g’ri.",
+        "bad_range": "❌ Oraliq {n} kundan oshmasligi va oxirgi sana boshlang'ichidan oldin bo'lmasligi kerak.",
+        "bad_return": "❌ Qaytish sanasi borish sanasidan oldin bo'lmasligi kerak.",
         "date_past": "❌ Sana o’tib ketgan. Hozirgi yoki kelajakdagi sanani kiriting:",
         "saved": "✅ Yo'nalish muvaffaqiyatli qo‘shildi.",
-        "max_routes": "❌ Sizda maksimal yo'nalishlar soni (5) mavjud.",
+        "max_routes": "❌ Sizda maksimal yo'nalishlar soni ({n}) mavjud.",
 
         "no_routes": "📭 Sizda hali yo'nalishlar yo‘q.",
         "route_deleted": "🗑 Yo'nalish o‘chirildi.",
@@ -112,6 +123,10 @@ TEXT: Dict[str, Dict[str, str]] = {
         "edit_from": "🏙 Boshlang‘ich nuqtani o‘zgartirish",
         "edit_to": "🏁 Yakuniy nuqtani o‘zgartirish",
         "edit_date": "📅 Sanani o‘zgartirish",
+        "edit_filters": "🎛 Joy filtrlari",
+        "enter_filters": "Qaysi joylar mos keladi? Vergul bilan sanab o'ting: vagon turi (plackart, kupe, lyuks, o'rindiqli), o'rin (pastki, yuqori, yon), eng yuqori narx va poyezd raqamlari.\nMasalan: kupe, pastki, 300000, 127Ф\nFiltrlarni o'chirish uchun «-» yuboring.",
+        "bad_filters": "❌ Tushunilmadi: {w}",
+        "filters_label": "🎛 Filtrlar: {f}",
         "updated": "✅ Ma’lumotlar yangilandi.",
 
         "settings_title": "⚙️ Sozlamalar",
@@ -131,6 +146,9 @@ TEXT: Dict[str, Dict[str, str]] = {
         "car_line": "{icon} {type_} — {seats} ta — {price} so‘m",
         "train_number": "🚄 Poyezd {num}",
         "unknown_error": "⚠️ Xatolik yuz berdi. Keyinroq urinib ko‘ring.",
+        "checking_routes": "🔍 Yo'nalishlar tekshirilmoqda… {done}/{total}",
+        "check_failed": "⚠️ {n} ta yo'nalishni tekshirib bo'lmadi. Keyinroq urinib ko‘ring.",
+        "check_nothing_new": "✅ Yo'nalishlar tekshirildi, hozircha xabar qiladigan narsa yo'q.",
         "select_route": "📋 Sizning yo'nalishlaringiz:",
         "seats_up": "Yuqori",
         "seats_down": "Past",
@@ -163,13 +181,15 @@ TEXT: Dict[str, Dict[str, str]] = {
 
         "enter_from": "Enter departure city:",
         "enter_to": "Enter destination city:",
-        "enter_date": "Enter date (DD.MM.YYYY)",
+        "enter_date": "Enter a date (DD.MM.YYYY), a date range (DD.MM.YYYY-DD.MM.YYYY) or outbound and return dates separated by a comma (DD.MM.YYYY, DD.MM.YYYY)",
 
         "city_not_found": "❌ City not found. Try again.",
         "bad_date": "❌ Invalid date format.",
+        "bad_range": "❌ A date range can be at most {n} days long and must not end before it starts.",
+        "bad_return": "❌ The return date must not be before the outbound date.",
         "date_past": "❌ This date has already passed. Please enter a current or future date:",
         "saved": "✅ Route created successfully.",
-        "max_routes": "❌ You already have the maximum number of routes (5).",
+        "max_routes": "❌ You already have the maximum number of routes ({n}).",
 
         "no_routes": "📭 You don't have any routes yet.",
         "route_deleted": "🗑 Route deleted.",
@@ -184,6 +204,10 @@ TEXT: Dict[str, Dict[str, str]] = {
         "edit_from": "🏙 Change departure",
         "edit_to": "🏁 Change destination",
         "edit_date": "📅 Change date",
+        "edit_filters": "🎛 Seat filters",
+        "enter_filters": "Which seats will do? List them separated by commas: car type (sleeper, compartment, deluxe, seated), berth (lower, upper, side), maximum price and train numbers.\nFor example: compartment, lower, 300000, 127\nSend \"-\" to clear the filters.",
+        "bad_filters": "❌ Could not understand: {w}",
+        "filters_label": "🎛 Filters: {f}",
         "updated": "✅ Updated successfully.",
 
         "settings_title": "⚙️ Settings",
@@ -203,6 +227,9 @@ TEXT: Dict[str, Dict[str, str]] = {
         "car_line": "{icon} {type_} — {seats} seats — from {price} UZS",
         "train_number": "🚄 Train {num}",
         "unknown_error": "⚠️ Something went wrong. Please try later.",
+        "checking_routes": "🔍 Checking your routes… {done}/{total}",
+        "check_failed": "⚠️ Could not check {n} route(s). Please try later.",
+        "check_nothing_new": "✅ Routes checked, nothing to report yet.",
         "select_route": "📋 Your routes:",
         "seats_up": "Upper",
         "seats_down": "Lower",
@@ -219,14 +246,69 @@ TEXT: Dict[str, Dict[str, str]] = {
     },
 }
 
+# Car classes and train kinds as the trains API names them in UPSTREAM_LANG (ru),
+# for users of other languages. Brand names (Afrosiyob, Sharq, ...) are not translated.
+TYPE_NAMES: Dict[str, Dict[str, str]] = {
+    "Плацкартный": {"uz": "Plackart", "en": "Open sleeper"},
+    "Купе": {"uz": "Kupe", "en": "Compartment"},
+    "Люкс": {"uz": "Lyuks", "en": "Deluxe (SV)"},
+    "СВ": {"uz": "SV", "en": "Deluxe (SV)"},
+    "Сидячий": {"uz": "O'rindiqli", "en": "Seated"},
+    "Общий": {"uz": "Umumiy", "en": "General"},
+    "Пассажирский": {"uz": "Yo'lovchi", "en": "Passenger"},
+    "Скорый": {"uz": "Tezyurar", "en": "Express"},
+    "Скоростной": {"uz": "Tezkor", "en": "High-speed"},
+}
+
+def type_name(name: str, lang: str) -> str:
+    return TYPE_NAMES.get(name, {}).get(lang, name)
+
 def t(lang: str, key: str) -> str:
     # Special handling for month list? No, just get via key
     val = TEXT.get(lang, TEXT["ru"]).get(key, key)
     return val
 
+
+class Templates:
+    """
+    One language's route-message strings, resolved once at import.
+    Format templates are stored as bound str.format methods and labels with
+    their separators already attached, so rendering is plain concatenation.
+    """
+    __slots__ = ("check_time", "route_line", "train_header", "car_line", "dep_prefix", "arr_prefix",
+                 "travel_prefix", "seat_prefixes", "time_h_m", "ticket_none", "months", "year_suffix")
+
+    def __init__(self, lang: str):
+        self.check_time = t(lang, "check_time").format
+        self.route_line = t(lang, "route_line").format
+        # The message header adds its own 🚄
+        self.train_header = t(lang, "train_number").replace("🚄 ", "").format
+        self.car_line = t(lang, "car_line").format
+        self.dep_prefix = t(lang, "dep_time_label") + " - "
+        self.arr_prefix = t(lang, "arr_time_label") + " - "
+        self.travel_prefix = t(lang, "travel_time_label") + ": "
+        # Same order as SEAT_KEYS in scheduler.py
+        self.seat_prefixes = (
+            f"⬆️ {t(lang, 'seats_up')}: ",
+            f"⬇️ {t(lang, 'seats_down')}: ",
+            f"↖️ {t(lang, 'seats_lateral_up')}: ",
+            f"↙️ {t(lang, 'seats_lateral_down')}: ",
+        )
+        self.time_h_m = t(lang, "time_h_m").format
+        self.ticket_none = t(lang, "ticket_none")
+        self.months = tuple(t(lang, "months"))
+        self.year_suffix = t(lang, "year_suffix")
+
+
+TEMPLATES: Dict[str, Templates] = {lang: Templates(lang) for lang in TEXT}
+
+
+def templates(lang: str) -> Templates:
+    return TEMPLATES.get(lang, TEMPLATES["ru"])
+
+
 def get_month_name(lang: str, month_idx: int) -> str:
     try:
-        months = TEXT.get(lang, TEXT["ru"]).get("months", [])
-        return months[month_idx]
+        return templates(lang).months[month_idx]
     except IndexError: # Changed from generic 'except' to specific 'IndexError' for robustness
         return ""
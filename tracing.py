@@ -0,0 +1,163 @@
+"""
+Per-tick tracing for the scheduler.
+
+scheduler_tick opens a TickTrace; check_and_notify_for_user records one span
+per route with the time spent in each phase (fetch, parse, state_read,
+state_write, render, send). When the tick ends, spans and a summary line are
+appended to TRACE_PATH as JSON lines. With PROFILE_TICK_THRESHOLD set, every
+tick runs under cProfile and ticks slower than the threshold are dumped to
+PROFILE_DIR as .prof files (open with `python -m pstats` or snakeviz).
+
+Outside a tick (manual checks) route_span() returns a no-op span.
+"""
+import asyncio
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+from config import TRACE_PATH, PROFILE_TICK_THRESHOLD, PROFILE_DIR
+
+logger = logging.getLogger("railway_bot")
+
+_current: contextvars.ContextVar[Optional["TickTrace"]] = contextvars.ContextVar("tick_trace", default=None)
+
+
+class _Phase:
+    __slots__ = ("span", "name", "start")
+
+    def __init__(self, span: "RouteSpan", name: str):
+        self.span = span
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        phases = self.span.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class RouteSpan:
+    __slots__ = ("user_id", "route_id", "start", "end", "phases", "outcome")
+
+    def __init__(self, user_id: int, route_id: int):
+        self.user_id = user_id
+        self.route_id = route_id
+        self.start = time.perf_counter()
+        self.end = 0.0
+        self.phases: Dict[str, float] = {}
+        self.outcome = ""
+
+    def phase(self, name: str) -> _Phase:
+        return _Phase(self, name)
+
+    def finish(self, outcome: str) -> None:
+        self.end = time.perf_counter()
+        self.outcome = outcome
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def phase(self, name: str):
+        return nullcontext()
+
+    def finish(self, outcome: str) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class TickTrace:
+    def __init__(self):
+        self.tick_id = time.strftime("%Y%m%dT%H%M%S")
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[RouteSpan] = []
+        self.profiler: Optional[cProfile.Profile] = None
+
+    def route(self, user_id: int, route_id: int) -> RouteSpan:
+        span = RouteSpan(user_id, route_id)
+        self.spans.append(span)
+        return span
+
+    def lines(self, duration: float) -> List[str]:
+        out = []
+        totals: Dict[str, float] = {}
+        for s in self.spans:
+            for name, value in s.phases.items():
+                totals[name] = totals.get(name, 0.0) + value
+            out.append(json.dumps({
+                "type": "route",
+                "tick": self.tick_id,
+                "user": s.user_id,
+                "route": s.route_id,
+                "outcome": s.outcome,
+                "total_ms": round(((s.end or s.start) - s.start) * 1000, 2),
+                "phases_ms": {k: round(v * 1000, 2) for k, v in s.phases.items()},
+            }))
+        summary: Dict[str, Any] = {
+            "type": "tick",
+            "tick": self.tick_id,
+            "ts": round(self.started_at, 3),
+            "duration_ms": round(duration * 1000, 2),
+            "routes": len(self.spans),
+            "phases_ms": {k: round(v * 1000, 2) for k, v in totals.items()},
+        }
+        out.append(json.dumps(summary))
+        return out
+
+
+def enabled() -> bool:
+    return bool(TRACE_PATH) or PROFILE_TICK_THRESHOLD > 0
+
+
+def start_tick() -> Optional[TickTrace]:
+    if not enabled():
+        return None
+    trace = TickTrace()
+    if PROFILE_TICK_THRESHOLD > 0:
+        trace.profiler = cProfile.Profile()
+        trace.profiler.enable()
+    _current.set(trace)
+    return trace
+
+
+def route_span(user_id: int, route_id: int):
+    trace = _current.get()
+    return trace.route(user_id, route_id) if trace else NULL_SPAN
+
+
+def _write(lines: List[str], profiler: Optional[cProfile.Profile], profile_path: str) -> None:
+    if TRACE_PATH and lines:
+        with open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    if profiler is not None and profile_path:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(profile_path)
+
+
+async def finish_tick(trace: Optional[TickTrace]) -> None:
+    if trace is None:
+        return
+    _current.set(None)
+    duration = time.perf_counter() - trace.start
+    profile_path = ""
+    if trace.profiler is not None:
+        trace.profiler.disable()
+        if duration > PROFILE_TICK_THRESHOLD:
+            profile_path = os.path.join(PROFILE_DIR, f"tick-{trace.tick_id}.prof")
+            logger.warning("Slow tick %s: %.1fs, profile saved to %s", trace.tick_id, duration, profile_path)
+    lines = trace.lines(duration) if TRACE_PATH else []
+    try:
+        await asyncio.to_thread(_write, lines, trace.profiler, profile_path)
+    except Exception as e:
+        logger.warning("Failed to write tick trace: %s", e)
@@ -0,0 +1,72 @@
+"""
+Telegram webhook endpoint mounted on the API aiohttp app (BOT_MODE=webhook).
+
+Telegram is answered as soon as the update is queued; a fixed pool of workers
+feeds queued updates into the dispatcher, so at most WEBHOOK_WORKERS updates
+are processed at once and at most WEBHOOK_QUEUE_SIZE wait. When the queue is
+full Telegram gets 429 and redelivers the update later.
+"""
+import asyncio
+import hmac
+import logging
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger("railway_bot.webhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookQueue:
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, workers: int = 8, maxsize: int = 1000,
+                 drain_timeout: float = 10):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.workers = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.drain_timeout = drain_timeout
+        self._tasks: List[asyncio.Task] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received, self.secret):
+            logger.warning("Webhook request with bad secret token from %s", request.remote)
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as exc:
+            logger.warning("Bad webhook payload: %s", exc)
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Webhook queue full (%d), asking Telegram to retry", self.queue.maxsize)
+            return web.Response(status=429)
+        return web.Response()
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as exc:
+                logger.error("Update %s failed: %s", update.update_id, exc)
+            finally:
+                self.queue.task_done()
+
+    async def start(self, app: web.Application = None) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, app: web.Application = None, timeout: float = None) -> None:
+        try:
+            await asyncio.wait_for(self.queue.join(), self.drain_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook shutdown: %d updates dropped", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []